@@ -4,16 +4,22 @@ UI のみを保持し、処理ロジックは utils.processing に委譲しま
 """
 
 # ── Imports ──────────────────────────────────────────────────────────
+import html
 import os
 import re
 import logging
 import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from urllib.parse import urlparse
 
 import streamlit as st
 from dotenv import load_dotenv
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 from utils.processing import (
     is_valid_url,
@@ -21,9 +27,13 @@ from utils.processing import (
     download_video,
     process_video,
     main_process,
+    SUBTITLE_EXTENSIONS,
 )
-from utils.burn_utils import burn_subtitles
+from utils.burn_utils import burn_subtitles, mux_subtitles
 from utils.video_utils import get_video_resolution
+from utils.whisper_utils import preload_models, get_model_stats
+from utils.events import EventBus, JsonLinesLogger, ProgressAdapter
+from utils.artifacts import publish_artifact, save_stream
 
 # ── Initial Setup ────────────────────────────────────────────────────
 st.set_page_config(page_title="一撃！字幕生成くん", page_icon="🎬", layout="wide")
@@ -36,6 +46,15 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+@st.cache_resource
+def _start_model_preload():
+    """Preload WHISPER_PRELOAD_MODELS once per server process, not on every rerun."""
+    return preload_models()
+
+
+_start_model_preload()
+
 # ── Helper UI class ─────────────────────────────────────────────────
 class ProgressManager:
     """Simple wrapper around Streamlit progress UI."""
@@ -47,10 +66,76 @@ class ProgressManager:
         self.bar.progress(int(max(0, min(100, pct))))
         self.text.text(msg)
 
+    def warning(self, msg: str):
+        st.warning(msg)
+
+    def error(self, msg: str):
+        st.error(msg)
+
     def complete(self, msg: str = "完了！"):
         self.update(100, msg)
 
 
+def _download_link(path, label, mime):
+    """HTML link that downloads ``path`` via static serving or the opt-in artifact server (streamed from disk, not held in memory).
+
+    When no URL can be published (file over Streamlit's static-serving limit
+    and no artifact server) the local path is shown instead.
+    """
+    try:
+        host = st.context.headers.get("Host")
+    except Exception:
+        host = None
+    url = publish_artifact(path, host=host)
+    name = html.escape(Path(path).name, quote=True)
+    if url is None:
+        return f"{html.escape(label)}: ダウンロードリンクを作成できません。サーバー上のファイル <code>{html.escape(str(Path(path).resolve()))}</code> を取得してください。"
+    return f'<a href="{html.escape(url, quote=True)}" download="{name}" type="{mime}">{html.escape(label)}</a>'
+
+
+def _run_ffmpeg_job(prog, func, *args, label="処理中…", **kwargs):
+    """Runs an ffmpeg job (burn_subtitles / mux_subtitles) in a worker thread while the script thread renders its progress.
+
+    When Streamlit stops or reruns the script (e.g. the cancel button), the
+    exception raised in the script thread cancels ffmpeg before propagating.
+    """
+    cancel = threading.Event()
+    latest = deque(maxlen=1)
+    worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="burn")
+    future = worker.submit(func, *args, on_progress=latest.append, cancel_event=cancel, **kwargs)
+    try:
+        while not future.done():
+            if latest:
+                progress = latest[-1]
+                prog.update(progress.pct or 0, f"{label} {progress}")
+            time.sleep(0.5)
+    except BaseException:
+        cancel.set()
+        raise
+    finally:
+        worker.shutdown(wait=False)
+    return future.result()
+
+
+def _streamlit_thread_initializer():
+    """Returns a thread initializer that lets worker threads render st.* widgets."""
+    script_ctx = get_script_run_ctx()
+
+    def _attach_ctx():
+        if script_ctx is not None:
+            add_script_run_ctx(threading.current_thread(), script_ctx)
+
+    return _attach_ctx
+
+
+# ── Sidebar: model cache status ──────────────────────────────────────
+with st.sidebar.expander("Whisper モデルキャッシュ"):
+    model_stats = get_model_stats()
+    if model_stats:
+        st.table(model_stats)
+    else:
+        st.caption("読み込み済みのモデルはありません")
+
 # ── API keys ─────────────────────────────────────────────────────────
 st.header("1. API キー")
 colk1, colk2 = st.columns(2)
@@ -64,6 +149,8 @@ if "generated_subtitles" not in st.session_state:
     st.session_state.generated_subtitles = []  # List[Tuple(filename, segments, info)]
 if "generated_pairs" not in st.session_state:
     st.session_state.generated_pairs = []      # List[dict(video, subtitle)]
+if "downloaded_videos" not in st.session_state:
+    st.session_state.downloaded_videos = {}    # Dict[url, local video path] fetched for burning
 
 # ── UI Tabs ──────────────────────────────────────────────────────────
 tab_generate, tab_burn = st.tabs(["🎤 字幕ファイル作成", "🔥 字幕焼き込み"])
@@ -95,7 +182,7 @@ with tab_generate:
         for up in uploads:
             safe_name = re.sub(r"[\\/*?\"<>|:]", "_", up.name)
             dest = upload_dir / f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{safe_name}"
-            dest.write_bytes(up.getbuffer())
+            save_stream(up, dest)
             uploaded_paths.append(str(dest))
 
     video_inputs = urls + uploaded_paths
@@ -114,16 +201,39 @@ with tab_generate:
     col1, col2 = st.columns(2)
 
     with col1:
-        format_choice = st.selectbox(
+        format_choices = st.multiselect(
             "字幕形式",
-            ["SRT", "ASS", "FCPXML"],
-            index=0,
+            list(SUBTITLE_EXTENSIONS),
+            default=["SRT"],
+            help="複数選択すると1回の文字起こしから全形式を書き出し、ZIPにまとめます",
         )
-        subtitle_ext = { "SRT": ".srt", "ASS": ".ass", "FCPXML": ".fcpxml" }[format_choice]
 
     with col2:
         whisper_size = st.selectbox("Whisper 精度", ["medium", "large"], index=0)
-        whisper_cfg = { "model_size": whisper_size, "beam_size": 5 }
+        whisper_mode = st.selectbox(
+            "文字起こしモード",
+            ["sequential", "batched", "chunked"],
+            index=0,
+            help=(
+                "batched: faster-whisper のバッチ推論で高スループット / "
+                "chunked: 長尺音声を無音区間で分割し、複数プロセスで並列に文字起こし"
+            ),
+        )
+        whisper_batch_size = st.slider(
+            "バッチサイズ（batched モード）",
+            1,
+            32,
+            8,
+            disabled=whisper_mode != "batched",
+        )
+        whisper_cfg = {
+            "model_size": whisper_size,
+            "beam_size": 5,
+            "use_temp_wav": False,
+            "mode": whisper_mode,
+            "batch_size": whisper_batch_size,
+            "chunk_minutes": 10,
+        }
 
     # Font size option
     auto_font = st.checkbox("フォントサイズ自動", value=True)
@@ -142,21 +252,35 @@ with tab_generate:
         index=0,
     )
 
+    # Parallel batch workers
+    max_workers = st.slider(
+        "並列処理数（複数ファイル時）",
+        1,
+        max(1, os.cpu_count() or 1),
+        1,
+    )
+
     # Run button
     st.markdown("---")
-    if st.button("字幕生成開始", disabled=not video_inputs):
+    if st.button("字幕生成開始", disabled=not video_inputs or not format_choices):
         prog = ProgressManager()
+        events = EventBus()
+        events.subscribe(ProgressAdapter(prog, expected_jobs=len(video_inputs)))
+        if os.getenv("PIPELINE_EVENT_LOG"):
+            events.subscribe(JsonLinesLogger(os.getenv("PIPELINE_EVENT_LOG")))
         results = main_process(
             video_inputs,
-            prog,
-            subtitle_ext,
-            format_choice,
+            events,
+            None,
+            format_choices,
             output_language,
             whisper_cfg,
             auto_font,
             manual_font,
             deepl_key,
             gemini_key,
+            max_workers=max_workers,
+            thread_initializer=_streamlit_thread_initializer(),
         )
         prog.complete("完了！")
 
@@ -167,35 +291,36 @@ with tab_generate:
             ]
             # Store video–subtitle pairs
             for idx, res in enumerate(results):
+                # Burning/muxing needs a text subtitle format, not FCPXML
+                files = res["output_files"]
+                burnable = next((files[fmt] for fmt in ("ASS", "SRT", "VTT") if fmt in files), res["output_filename"])
                 st.session_state.generated_pairs.append(
                     {
                         "video": res.get("video_path") or video_inputs[idx],
-                        "subtitle": res["output_filename"],
+                        "subtitle": burnable,
+                        "language": res.get("language"),
                     }
                 )
 
             # Download buttons
             for res in results:
-                file_path = Path(res["output_filename"])
-                mime = (
-                    "application/xml"
-                    if file_path.suffix.lower() == ".fcpxml"
-                    else "text/plain"
-                )
                 col = st.columns(2)[0]
-                with file_path.open("rb") as f:
-                    col.download_button(
-                        label=f"ダウンロード: {file_path.name}",
-                        data=f.read(),
-                        file_name=file_path.name,
-                        mime=mime,
+                if res["bundle"]:
+                    bundle_path = Path(res["bundle"])
+                    col.markdown(
+                        _download_link(bundle_path, f"まとめてダウンロード (ZIP): {bundle_path.name}", "application/zip"),
+                        unsafe_allow_html=True,
                     )
+                for path in res["output_files"].values():
+                    file_path = Path(path)
+                    mime = {".fcpxml": "application/xml", ".vtt": "text/vtt"}.get(file_path.suffix.lower(), "text/plain")
+                    col.markdown(_download_link(file_path, f"ダウンロード: {file_path.name}", mime), unsafe_allow_html=True)
 
 # ─────────────────────────────────────────────────────────────────────
 # Tab 2 – Burn Subtitles
 # ─────────────────────────────────────────────────────────────────────
 with tab_burn:
-    st.header("字幕焼き込み")
+    st.header("字幕焼き込み / ソフト字幕")
 
     DEFAULT = "▼ 生成済みペアを選択 ▼"
     pair_options = [DEFAULT] + [
@@ -215,66 +340,118 @@ with tab_burn:
         temp_dir = Path("./burn_temp")
         temp_dir.mkdir(exist_ok=True)
 
-        # Prefer existing local file; download only if missing
-        candidate = pair["video"]
-        if os.path.exists(str(candidate)):
-            video_path_selected = candidate
-        elif is_valid_url(candidate):
-            st.info("URL から動画をダウンロード中…")
-            video_path_selected = download_video(
-                candidate,
-                output_dir=str(temp_dir),
-                prefix="burn_",
-            )
-        else:
-            video_path_selected = candidate
+        # Prefer existing local file; URLs are downloaded when burning starts
+        video_path_selected = pair["video"]
+        video_path_selected = st.session_state.downloaded_videos.get(video_path_selected, video_path_selected)
 
         st.info(f"選択中: {video_path_selected} + {subtitle_path_selected}")
     else:
         video_file = st.file_uploader("動画ファイル", type=["mp4", "mov", "mkv", "avi"])
-        subtitle_file = st.file_uploader("字幕ファイル", type=["srt", "ass"])
-
-    burn_font_size = st.number_input(
-        "フォントサイズ",
-        10,
-        120,
-        default_font_size,
+        subtitle_file = st.file_uploader("字幕ファイル", type=["srt", "ass", "vtt"])
+        subtitle_language_upload = st.selectbox("字幕の言語", ["ja", "en", "fr", "de"], index=0)
+
+    delivery_mode = st.radio(
+        "出力方式",
+        ["焼き込み（再エンコード）", "ソフト字幕（再エンコードなし）"],
+        horizontal=True,
+        help="ソフト字幕: 映像・音声をコピーしたまま字幕トラックとして追加します（数秒で完了）",
     )
+    soft_subs = delivery_mode.startswith("ソフト字幕")
+
+    if soft_subs:
+        mux_container = st.radio(
+            "コンテナ",
+            ["mp4", "mkv"],
+            horizontal=True,
+            help="mp4: mov_text 形式（ASS のスタイルは失われます） / mkv: ASS・SRT をそのまま格納",
+        )
+        # Other generated subtitles (e.g. other languages) can be added as extra tracks
+        extra_track_options = {
+            f"{Path(p['subtitle']).name} ({p.get('language') or '?'})": p
+            for p in st.session_state.generated_pairs
+            if pair_choice == DEFAULT or p["subtitle"] != subtitle_path_selected
+        }
+        extra_tracks = st.multiselect("追加する字幕トラック", list(extra_track_options))
+    else:
+        burn_font_size = st.number_input(
+            "フォントサイズ",
+            10,
+            120,
+            default_font_size,
+        )
+        burn_workers = st.slider(
+            "並列焼き込み数（キーフレーム分割）",
+            1,
+            max(1, os.cpu_count() or 1),
+            1,
+            help="2 以上で動画をキーフレーム位置で分割し、複数の ffmpeg プロセスで並列に焼き込みます",
+        )
 
     if st.button(
-        "焼き込み開始",
+        "字幕の追加を開始" if soft_subs else "焼き込み開始",
         disabled=(
             pair_choice == DEFAULT and not (video_file and subtitle_file)
         ),
     ):
-        with st.spinner("焼き込み中…"):
+        with st.spinner("処理中…"):
             temp_dir = Path("./burn_temp")
             temp_dir.mkdir(exist_ok=True)
 
             if pair_choice != DEFAULT:
+                if not os.path.exists(str(video_path_selected)) and is_valid_url(video_path_selected):
+                    # Generation fetched only the audio; the full video is needed now
+                    video_url = video_path_selected
+                    download_events = EventBus()
+                    download_events.subscribe(ProgressAdapter(ProgressManager()))
+                    video_path_selected, _, _ = download_video(
+                        video_url,
+                        output_dir=str(temp_dir),
+                        prefix="burn_",
+                        events=download_events,
+                    )
+                    st.session_state.downloaded_videos[video_url] = video_path_selected
                 video_path = Path(video_path_selected)
                 subtitle_path = Path(subtitle_path_selected)
             else:
                 video_path = temp_dir / f"video_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{video_file.name}"
                 subtitle_path = temp_dir / f"subs_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{subtitle_file.name}"
-                video_path.write_bytes(video_file.getbuffer())
-                subtitle_path.write_bytes(subtitle_file.getbuffer())
+                save_stream(video_file, video_path)
+                save_stream(subtitle_file, subtitle_path)
 
             try:
-                output_path = burn_subtitles(
-                    video_path,
-                    subtitle_path,
-                    burn_font_size,
-                    temp_dir,
-                )
-                with output_path.open("rb") as f_out:
-                    st.success("焼き込み完了！")
-                    st.download_button(
-                        label=f"ダウンロード: {output_path.name}",
-                        data=f_out.read(),
-                        file_name=output_path.name,
-                        mime="video/mp4",
+                st.button("キャンセル", key="cancel_burn")
+                if soft_subs:
+                    subtitle_language = pair.get("language") if pair_choice != DEFAULT else subtitle_language_upload
+                    tracks = [(subtitle_path, subtitle_language)] + [
+                        (extra_track_options[name]["subtitle"], extra_track_options[name].get("language"))
+                        for name in extra_tracks
+                    ]
+                    output_path = _run_ffmpeg_job(
+                        ProgressManager(),
+                        mux_subtitles,
+                        video_path,
+                        tracks,
+                        temp_dir,
+                        container=mux_container,
+                        label="字幕トラックを追加中…",
+                    )
+                else:
+                    output_path = _run_ffmpeg_job(
+                        ProgressManager(),
+                        burn_subtitles,
+                        video_path,
+                        subtitle_path,
+                        burn_font_size,
+                        temp_dir,
+                        workers=burn_workers,
+                        label="焼き込み中…",
                     )
+                st.success("完了！")
+                mime = "video/x-matroska" if output_path.suffix == ".mkv" else "video/mp4"
+                st.markdown(
+                    _download_link(output_path, f"ダウンロード: {output_path.name}", mime),
+                    unsafe_allow_html=True,
+                )
             except Exception as e:
-                st.error("焼き込み失敗")
+                st.error("焼き込み失敗" if not soft_subs else "字幕トラックの追加に失敗")
                 st.text(str(e))
\ No newline at end of file
@@ -0,0 +1,286 @@
+"""
+Utility: artifacts.py
+---------------------
+Publishes generated files (burned videos, subtitles) for download without
+reading them into memory.
+
+Files are hard-linked (or, across filesystems, copied in chunks) into
+``static/artifacts`` under an unguessable per-file token and, by default,
+downloaded through Streamlit static serving at ``app/static/...`` (requires
+``server.enableStaticServing``, see ``.streamlit/config.toml``). That goes
+through the app's own port, so it works behind proxies and on single-port
+hosts, and the static handler streams from disk, so server memory does not
+depend on artifact size or on the number of users downloading.
+
+Streamlit refuses files over 200 MB (``STATIC_MAX_FILE_SIZE``) and serves
+most non-image types as ``text/plain``. Deployments that need large
+downloads can opt in to a sidecar HTTP server (``ArtifactServer``) that
+streams the same directory with Range support, the real Content-Type and
+an attachment Content-Disposition. Without it, larger files get no URL and
+callers must point the user at the file on disk instead.
+
+Environment (the sidecar only starts when one of the first two is set):
+    ARTIFACT_SERVER_PORT: Sidecar port.
+    ARTIFACT_PUBLIC_URL: Externally reachable base URL of the sidecar, e.g.
+        a proxy path forwarding to it (default ``http://<app host>:<port>``;
+        the port defaults to 8502 when only this is set).
+    ARTIFACT_SERVER_BIND: Sidecar bind address (default ``127.0.0.1``).
+"""
+
+import logging
+import mimetypes
+import os
+import re
+import secrets
+import shutil
+import threading
+import time
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import quote, urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Streamlit serves <app dir>/static at app/static
+STATIC_DIR = Path(os.environ.get("STREAMLIT_STATIC_DIR", Path(__file__).resolve().parent.parent / "static"))
+ARTIFACT_SUBDIR = "artifacts"
+# Published artifacts older than this are removed on the next publish
+ARTIFACT_MAX_AGE_SEC = float(os.environ.get("ARTIFACT_MAX_AGE_HOURS", "24")) * 3600
+
+try:
+    # Streamlit's static handler answers 404 for anything larger
+    from streamlit.web.server.app_static_file_handler import MAX_APP_STATIC_FILE_SIZE as STATIC_MAX_FILE_SIZE
+except ImportError:
+    STATIC_MAX_FILE_SIZE = 200 * 1024 * 1024
+
+# Opt-in sidecar server: the browser must be able to reach its port (or ARTIFACT_PUBLIC_URL)
+ARTIFACT_PUBLIC_URL = os.environ.get("ARTIFACT_PUBLIC_URL")
+ARTIFACT_SERVER_ENABLED = "ARTIFACT_SERVER_PORT" in os.environ or bool(ARTIFACT_PUBLIC_URL)
+ARTIFACT_SERVER_BIND = os.environ.get("ARTIFACT_SERVER_BIND", "127.0.0.1")
+ARTIFACT_SERVER_PORT = int(os.environ.get("ARTIFACT_SERVER_PORT", "8502"))
+
+# Chunk size for copies, uploads and served responses
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+
+_RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+def save_stream(src, dest_path, chunk_size=COPY_CHUNK_SIZE):
+    """
+    Writes a file-like object (e.g. a Streamlit ``UploadedFile``) to ``dest_path``.
+
+    In-memory buffers are written straight from ``getbuffer()`` without a
+    copy; other sources are copied in ``chunk_size`` chunks.
+    """
+    dest_path = Path(dest_path)
+    with dest_path.open("wb") as dst:
+        if hasattr(src, "getbuffer"):
+            dst.write(src.getbuffer())
+        else:
+            if hasattr(src, "seek"):
+                src.seek(0)
+            shutil.copyfileobj(src, dst, chunk_size)
+    return dest_path
+
+
+def _parse_range(header, size):
+    """
+    Parses a single-range ``Range`` header.
+
+    Returns:
+        tuple | None | bool: ``(start, end)`` (inclusive), None to send the
+        whole file (no header, or a form we do not support such as multiple
+        ranges), or False when the range cannot be satisfied.
+    """
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            return False
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, end
+
+
+class _ArtifactRequestHandler(SimpleHTTPRequestHandler):
+    """Serves published artifact files only: no directory listings, Range support, attachment downloads."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory=str(STATIC_DIR / ARTIFACT_SUBDIR), **kwargs)
+
+    def list_directory(self, path):
+        self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+        return None
+
+    def guess_type(self, path):
+        return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+        try:
+            f = open(path, "rb")
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+        try:
+            size = os.fstat(f.fileno()).st_size
+            byte_range = _parse_range(self.headers.get("Range"), size)
+            if byte_range is False:
+                f.close()
+                self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return None
+            if byte_range is None:
+                start, end = 0, size - 1
+                self.send_response(HTTPStatus.OK)
+            else:
+                start, end = byte_range
+                self.send_response(HTTPStatus.PARTIAL_CONTENT)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            f.seek(start)
+            self._remaining = end - start + 1
+            self.send_header("Content-Type", self.guess_type(path))
+            self.send_header("Content-Length", str(self._remaining))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(os.path.basename(path))}")
+            self.send_header("X-Content-Type-Options", "nosniff")
+            self.end_headers()
+            return f
+        except Exception:
+            f.close()
+            raise
+
+    def copyfile(self, source, outputfile):
+        remaining = self._remaining
+        while remaining > 0:
+            chunk = source.read(min(COPY_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            remaining -= len(chunk)
+
+    def log_message(self, format, *args):
+        logger.debug(f"Artifact server: {self.address_string()} {format % args}")
+
+
+# --- ArtifactServer: 成果物をディスクから配信するサイドカー HTTP サーバ ---
+class ArtifactServer:
+    """Background ``ThreadingHTTPServer`` serving ``STATIC_DIR/artifacts``."""
+
+    def __init__(self, bind=ARTIFACT_SERVER_BIND, port=ARTIFACT_SERVER_PORT):
+        self._httpd = ThreadingHTTPServer((bind, port), _ArtifactRequestHandler)
+        self._httpd.daemon_threads = True
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="artifact-server", daemon=True)
+        self._thread.start()
+        logger.info(f"Artifact server listening on {bind}:{self.port}")
+
+    def url_for(self, relative, host=None):
+        """Absolute URL of ``relative`` (``<token>/<name>``) as seen from a browser that reached the app at ``host``."""
+        if ARTIFACT_PUBLIC_URL:
+            return f"{ARTIFACT_PUBLIC_URL.rstrip('/')}/{relative}"
+        hostname = (urlsplit(f"//{host}").hostname if host else None) or "localhost"
+        if ":" in hostname:
+            hostname = f"[{hostname}]"  # IPv6 literal
+        return f"http://{hostname}:{self.port}/{relative}"
+
+    def shutdown(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+# --- Server singleton (one per process) ---
+_SERVER = None
+_SERVER_FAILED = False
+_SERVER_LOCK = threading.Lock()
+
+
+def get_artifact_server():
+    """
+    Returns the process-wide ``ArtifactServer``, starting it on first use.
+
+    Returns None unless the sidecar is enabled (``ARTIFACT_SERVER_PORT`` or
+    ``ARTIFACT_PUBLIC_URL``) or when it cannot bind.
+    """
+    global _SERVER, _SERVER_FAILED
+    if not ARTIFACT_SERVER_ENABLED:
+        return None
+    with _SERVER_LOCK:
+        if _SERVER is None and not _SERVER_FAILED:
+            (STATIC_DIR / ARTIFACT_SUBDIR).mkdir(parents=True, exist_ok=True)
+            try:
+                _SERVER = ArtifactServer()
+            except OSError as e:
+                _SERVER_FAILED = True
+                logger.warning(f"Artifact server could not start ({e}); falling back to Streamlit static serving.")
+        return _SERVER
+
+
+def prune_artifacts(max_age_sec=ARTIFACT_MAX_AGE_SEC):
+    """Removes published artifact directories older than ``max_age_sec``."""
+    root = STATIC_DIR / ARTIFACT_SUBDIR
+    if not root.is_dir():
+        return
+    cutoff = time.time() - max_age_sec
+    for entry in root.iterdir():
+        try:
+            if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry, ignore_errors=True)
+                logger.info(f"Pruned artifact '{entry.name}'")
+        except OSError:
+            continue
+
+
+def publish_artifact(path, host=None):
+    """
+    Makes ``path`` downloadable and returns its URL.
+
+    Args:
+        path (str | Path): File to publish; it is linked, not moved.
+        host (str, optional): ``Host`` header the browser used to reach the
+            app, used to address the sidecar server.
+
+    Returns:
+        str | None: A relative Streamlit static URL
+        (``app/static/artifacts/<token>/<name>``), the sidecar URL when the
+        sidecar is enabled, or None if the file is too large for static
+        serving and there is no sidecar.
+    """
+    path = Path(path)
+    server = get_artifact_server()
+    if server is None and path.stat().st_size > STATIC_MAX_FILE_SIZE:
+        logger.warning(f"'{path}' exceeds the static serving limit and the artifact server is not enabled.")
+        return None
+    prune_artifacts()
+    token = secrets.token_urlsafe(16)
+    target_dir = STATIC_DIR / ARTIFACT_SUBDIR / token
+    target_dir.mkdir(parents=True, exist_ok=True)
+    target = target_dir / path.name
+    try:
+        os.link(path, target)
+    except OSError:
+        # Different filesystem (or no hard links): chunked copy, never a full read
+        with path.open("rb") as src:
+            save_stream(src, target)
+    logger.info(f"Published artifact '{path}' as '{target}'")
+    relative = f"{token}/{quote(path.name)}"
+    if server is not None:
+        return server.url_for(relative, host)
+    return f"app/static/{ARTIFACT_SUBDIR}/{relative}"
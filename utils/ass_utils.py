@@ -1,11 +1,13 @@
 import textwrap
 import logging # Import logging
+from utils.segments import to_segment
+from utils.time_utils import format_ass_ms, format_ass_times, seconds_to_ms
 # Assuming style_loader might be needed here eventually, but not for current functions
 # from .style_loader import load_styles 
 
 # Utility function to auto-wrap text for ASS subtitles
 def auto_wrap_text(text, max_chars_per_line=40, max_lines=2):
-    """
+    r"""
     Inserts \N into text to wrap lines at natural breakpoints.
     Prioritizes full-width punctuation and spaces.
     """
@@ -41,14 +43,8 @@ logger = logging.getLogger(__name__)
 
 # --- format_ass_time: 秒数を ASS 形式の h:mm:ss.cc タイムスタンプに変換する関数 ---
 def format_ass_time(t):
-    """Converts seconds to ASS time format h:mm:ss.cc"""
-    if t is None:
-        return "0:00:00.00"
-    hours = int(t // 3600)
-    minutes = int((t % 3600) // 60)
-    seconds = int(t % 60)
-    centiseconds = int((t % 1) * 100)
-    return f"{hours}:{minutes:02d}:{seconds:02d}.{centiseconds:02d}"
+    """Converts seconds to ASS time format h:mm:ss.cc (see ``utils.time_utils``)."""
+    return format_ass_ms(seconds_to_ms(t))
 
 # --- generate_ass_header: ASSファイルのヘッダーとスタイル情報を生成する ---
 # Modified signature to accept font_size (which now comes from main4.py's UI)
@@ -156,6 +152,17 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
     # NOTE: When writing this header to file, use encoding="utf-8-sig" to avoid Japanese text garbling
     return header
 
+# --- format_ass_dialogue: 1セグメント分の ASS Dialogue 行を生成する ---
+def format_ass_dialogue(start_time, end_time, text, style_name="Default"):
+    """
+    Returns one Dialogue line for already formatted ``h:mm:ss.cc`` times.
+    Margins are left empty so the style's margins apply, and line breaks are
+    left to the script's WrapStyle.
+    """
+    formatted_text = text.strip().replace('\n', ' ')
+    # Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+    return f"Dialogue: 0,{start_time},{end_time},{style_name},,,,,,{formatted_text}\n"
+
 # --- generate_ass_dialogue: WhisperセグメントからASSダイアログ行を生成する ---
 # Updated signature to accept styles_data to retrieve margins
 def generate_ass_dialogue(segments, styles_data, style_name="Default", width=1280, font_size=65, max_lines=2):
@@ -163,7 +170,7 @@ def generate_ass_dialogue(segments, styles_data, style_name="Default", width=128
     Generates ASS Dialogue lines from Whisper segments.
 
     Args:
-        segments: Iterable of Whisper segment objects (or dicts) with 'start', 'end', 'text'.
+        segments: Iterable of segments (``utils.segments.Segment``, Whisper segments or dicts with 'start', 'end', 'text').
         style_name (str): The ASS style name to apply.
         width (int): The width of the video in pixels.
         font_size (int): The font size used for the subtitles.
@@ -178,20 +185,19 @@ def generate_ass_dialogue(segments, styles_data, style_name="Default", width=128
         logger.error("Segments data is not iterable for ASS generation.")
         return "" # Return empty string if segments is not valid
 
+    # Normalize up front so all timestamps can be formatted in one vectorized pass
+    valid_segments = []
     for segment in segments:
         try:
-            # Check if segment is an object with attributes or a dict
-            if hasattr(segment, 'start') and hasattr(segment, 'end') and hasattr(segment, 'text'):
-                start_time = format_ass_time(segment.start)
-                end_time = format_ass_time(segment.end)
-                text = segment.text
-            elif isinstance(segment, dict) and 'start' in segment and 'end' in segment and 'text' in segment:
-                start_time = format_ass_time(segment['start'])
-                end_time = format_ass_time(segment['end'])
-                text = segment['text']
-            else:
-                logger.warning(f"Skipping invalid segment structure for ASS: {segment}")
-                continue # Skip this segment if structure is wrong
+            valid_segments.append(to_segment(segment))
+        except TypeError:
+            logger.warning(f"Skipping invalid segment structure for ASS: {segment}")
+    start_times = format_ass_times([segment.start for segment in valid_segments])
+    end_times = format_ass_times([segment.end for segment in valid_segments])
+
+    for segment, start_time, end_time in zip(valid_segments, start_times, end_times):
+        try:
+            text = segment.text
 
             # --- Text Preparation for ASS ---
             # Rely on ASS WrapStyle for automatic wrapping; do not insert forced line breaks.
@@ -217,7 +223,7 @@ def generate_ass_dialogue(segments, styles_data, style_name="Default", width=128
             # Create the dialogue line with explicit margins set to 0 (to use style defaults)
             # {\q2} tag removed to rely solely on WrapStyle: 0 and style margins for wrapping.
             # Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
-            dialogue = f"Dialogue: 0,{start_time},{end_time},{style_name},,,,,,{formatted_text}\n"
+            dialogue = format_ass_dialogue(start_time, end_time, formatted_text, style_name)
             dialogue_lines.append(dialogue)
         except Exception as e:
             logger.error(f"Error processing segment for ASS: {segment}. Error: {e}")
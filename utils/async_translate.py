@@ -0,0 +1,341 @@
+"""
+Utility: async_translate.py
+---------------------------
+asyncio-based translation stage. Request-sized batches are sent concurrently
+(bounded per provider) through a shared token-bucket rate limiter that honours
+``Retry-After``. Failed batches are retried, then split into per-segment
+retries, and whatever DeepL cannot translate falls back to Gemini.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import deepl
+
+from utils.translate_utils import (
+    GEMINI_BATCH_SIZE,
+    GEMINI_ENGINE,
+    _chunk_texts_for_deepl,
+    _get_deepl_translator,
+    _get_gemini_model,
+    _resolve_deepl_langs,
+    _resolve_gemini_langs,
+    _send_deepl_batch,
+    _send_gemini_batch,
+)
+from utils.translation_memory import TranslationStats, translate_with_memory
+
+logger = logging.getLogger(__name__)
+
+# Concurrent in-flight requests per provider and per job
+DEEPL_CONCURRENCY = 4
+GEMINI_CONCURRENCY = 4
+# Attempts per request (batch or single segment) before giving up
+MAX_ATTEMPTS = 3
+# Backoff used when a request fails without a Retry-After hint
+BASE_BACKOFF_SEC = 1.0
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket usable from any event loop.
+
+    ``rate`` tokens are added per second up to ``capacity``. ``pause`` blocks
+    every caller until the given delay has passed, which is how a server's
+    ``Retry-After`` is applied to all in-flight requests at once. State is
+    guarded by a ``threading.Lock`` (held only briefly), so one bucket can be
+    shared by jobs running on different threads and loops.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Waits until a token is available and consumes it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._blocked_until - now
+                if wait <= 0:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        """Blocks all callers for ``seconds`` (e.g. from a Retry-After header)."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+
+# One limiter per provider, shared by every in-flight request in the process
+RATE_LIMITERS = {
+    "deepl": TokenBucket(rate=5, capacity=10),
+    "gemini": TokenBucket(rate=2, capacity=4),
+}
+
+
+def retry_after_seconds(exc):
+    """Extracts a server-requested retry delay (in seconds) from an API exception, if any."""
+    value = getattr(exc, "retry_after", None)
+    if value is None:
+        # Explicit None checks: a requests.Response is falsy for 4xx/5xx (bool() is response.ok)
+        response = getattr(exc, "response", None)
+        if response is None:
+            response = getattr(exc, "http_response", None)
+        headers = getattr(response, "headers", None)
+        if headers is not None:
+            value = headers.get("Retry-After")
+    if value is None:
+        # google.api_core errors carry a RetryInfo detail instead of a header
+        for detail in getattr(exc, "details", None) or []:
+            delay = getattr(detail, "retry_delay", None)
+            if delay is not None:
+                return getattr(delay, "seconds", 0) + getattr(delay, "nanos", 0) / 1e9
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def _is_rate_limited(exc):
+    status = getattr(exc, "http_status_code", None) or getattr(exc, "code", None)
+    return status == 429 or isinstance(exc, deepl.TooManyRequestsException)
+
+
+async def _call_with_retry(provider, limiter, semaphore, func, *args):
+    """Runs a blocking request in a worker thread under the limiter, with retries.
+
+    Raises the last exception when all attempts fail. DeepL 429s are not
+    retried here: the deepl client has already retried them with backoff, so
+    another round would multiply the attempts. They only pause the limiter.
+    """
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        async with semaphore:
+            await limiter.acquire()
+            try:
+                return await asyncio.to_thread(func, *args)
+            except deepl.QuotaExceededException:
+                raise
+            except deepl.TooManyRequestsException as e:
+                delay = retry_after_seconds(e)
+                limiter.pause(delay if delay is not None else BASE_BACKOFF_SEC * 2 ** attempt)
+                raise
+            except Exception as e:
+                delay = retry_after_seconds(e)
+                if delay is not None or _is_rate_limited(e):
+                    delay = delay if delay is not None else BASE_BACKOFF_SEC * 2 ** attempt
+                    logger.warning(f"[{provider}] rate limited, pausing all requests for {delay:.1f}s")
+                    limiter.pause(delay)
+                else:
+                    delay = BASE_BACKOFF_SEC * attempt
+                if attempt == MAX_ATTEMPTS:
+                    raise
+                logger.warning(f"[{provider}] request attempt {attempt} failed: {e}")
+        await asyncio.sleep(delay)
+
+
+async def _translate_deepl_async(texts, source_lang_whisper, target_lang_ui, deepl_api_key, progress_callback=None):
+    """Concurrent DeepL stage; returns ``(translations, error)`` aligned with ``texts``."""
+    translations = [None] * len(texts)
+    if not deepl_api_key:
+        return translations, "DeepL API key not provided"
+    source_lang_deepl, target_lang_deepl, lang_error = _resolve_deepl_langs(source_lang_whisper, target_lang_ui)
+    if lang_error:
+        return translations, lang_error
+    try:
+        translator = _get_deepl_translator(deepl_api_key)
+    except Exception as e:
+        return translations, f"DeepL configuration failed: {e}"
+
+    limiter = RATE_LIMITERS["deepl"]
+    semaphore = asyncio.Semaphore(DEEPL_CONCURRENCY)
+    errors = []
+    done = 0
+
+    async def _send(indices):
+        return await _call_with_retry(
+            "deepl", limiter, semaphore, _send_deepl_batch,
+            translator, [texts[i] for i in indices], source_lang_deepl, target_lang_deepl,
+        )
+
+    async def _run_batch(batch):
+        nonlocal done
+        try:
+            for i, result in zip(batch, await _send(batch)):
+                translations[i] = result
+        except deepl.QuotaExceededException:
+            errors.append("DeepL quota exceeded")
+        except deepl.TooManyRequestsException as e:
+            # Already retried inside the deepl client; leave the batch to the Gemini fallback
+            errors.append(f"DeepL rate limit: {e}")
+        except Exception as e:
+            logger.warning(f"DeepL batch of {len(batch)} failed ({e}); retrying per segment")
+            # Per-segment retries so one bad text does not sink the whole batch
+            results = await asyncio.gather(*(_send([i]) for i in batch), return_exceptions=True)
+            for i, result in zip(batch, results):
+                if isinstance(result, BaseException):
+                    errors.append(f"DeepL API error: {result}")
+                else:
+                    translations[i] = result[0]
+        done += len(batch)
+        if progress_callback:
+            progress_callback(done, len(texts))
+
+    pending = [i for i, text in enumerate(texts) if text]
+    for i, text in enumerate(texts):
+        if not text:
+            translations[i] = ""
+    await asyncio.gather(*(_run_batch(batch) for batch in _chunk_texts_for_deepl(pending, texts)))
+    return translations, errors[0] if errors else None
+
+
+async def _translate_gemini_async(texts, source_lang_whisper, target_lang_ui, gemini_api_key, progress_callback=None):
+    """Concurrent Gemini stage; returns ``(translations, error)`` aligned with ``texts``."""
+    translations = [None] * len(texts)
+    if not gemini_api_key:
+        return translations, "Gemini API key not provided"
+    source_lang_gemini, target_lang_gemini = _resolve_gemini_langs(source_lang_whisper, target_lang_ui)
+    if not target_lang_gemini:
+        return translations, f"Gemini does not support target language: {target_lang_ui}"
+    try:
+        model = _get_gemini_model(gemini_api_key)
+    except Exception as e:
+        return translations, f"Gemini configuration failed: {e}"
+
+    limiter = RATE_LIMITERS["gemini"]
+    semaphore = asyncio.Semaphore(GEMINI_CONCURRENCY)
+    errors = []
+    done = 0
+
+    async def _send(indices):
+        return await _call_with_retry(
+            "gemini", limiter, semaphore, _send_gemini_batch,
+            model, [(i, texts[i]) for i in indices], source_lang_gemini, target_lang_gemini, False,
+        )
+
+    async def _run_batch(batch):
+        nonlocal done
+        try:
+            results = await _send(batch)
+        except Exception as e:
+            logger.warning(f"Gemini batch of {len(batch)} failed: {e}")
+            results = {}
+        for i in batch:
+            translations[i] = results.get(i) or None
+        # Missing or merged entries are retried one segment at a time
+        missing = [i for i in batch if translations[i] is None]
+        if missing:
+            retried = await asyncio.gather(*(_send([i]) for i in missing), return_exceptions=True)
+            for i, result in zip(missing, retried):
+                if isinstance(result, BaseException):
+                    errors.append(f"Gemini API error: {result}")
+                else:
+                    translations[i] = result.get(i) or None
+        done += len(batch)
+        if progress_callback:
+            progress_callback(done, len(texts))
+
+    pending = [i for i, text in enumerate(texts) if text]
+    for i, text in enumerate(texts):
+        if not text:
+            translations[i] = ""
+    batches = [pending[start:start + GEMINI_BATCH_SIZE] for start in range(0, len(pending), GEMINI_BATCH_SIZE)]
+    await asyncio.gather(*(_run_batch(batch) for batch in batches))
+    error = None
+    if any(t is None for t in translations):
+        error = errors[0] if errors else "Gemini returned no translation for some segments"
+    return translations, error
+
+
+def translate_segments(
+    texts,
+    source_lang_whisper,
+    target_lang_ui,
+    deepl_api_key=None,
+    gemini_api_key=None,
+    stats=None,
+    progress_callback=None,
+):
+    """
+    Translates segment texts with the concurrent DeepL→Gemini flow.
+
+    DeepL handles everything it can; segments it could not translate are sent
+    to Gemini. Both stages go through the translation memory first; ``stats``
+    counts every segment once (see ``TranslationStats.add_fallback``).
+
+    Args:
+        texts (list[str]): Segment texts.
+        stats (TranslationStats, optional): Translation-memory counters to accumulate into.
+        progress_callback (callable, optional): Called as ``(stage, done, total)``
+            where ``stage`` is ``"deepl"`` or ``"gemini"``.
+
+    Returns:
+        tuple[list, str | None]: Translations aligned with ``texts`` (``None``
+        where both engines failed) and the errors of both stages, if any,
+        joined with ``"; "``. A DeepL error is reported
+        even when Gemini covered every segment, so callers can show why
+        DeepL was skipped.
+    """
+    def _progress(stage):
+        if progress_callback is None:
+            return None
+        return lambda done, total: progress_callback(stage, done, total)
+
+    translations, deepl_error = translate_with_memory(
+        texts,
+        source_lang_whisper,
+        target_lang_ui,
+        "deepl",
+        lambda pending: asyncio.run(
+            _translate_deepl_async(pending, source_lang_whisper, target_lang_ui, deepl_api_key, _progress("deepl"))
+        ),
+        stats=stats,
+    )
+    if deepl_error:
+        logger.warning(f"DeepL stage incomplete: {deepl_error}")
+
+    # Fallback to Gemini for everything DeepL could not translate
+    gemini_error = None
+    missing = [i for i, t in enumerate(translations) if t is None]
+    if missing:
+        fallback_stats = TranslationStats()
+        gemini_translations, gemini_error = translate_with_memory(
+            [texts[i] for i in missing],
+            source_lang_whisper,
+            target_lang_ui,
+            GEMINI_ENGINE,
+            lambda pending: asyncio.run(
+                _translate_gemini_async(pending, source_lang_whisper, target_lang_ui, gemini_api_key, _progress("gemini"))
+            ),
+            stats=fallback_stats,
+        )
+        if stats is not None:
+            stats.add_fallback(fallback_stats)
+        if gemini_error:
+            logger.warning(f"Gemini stage incomplete: {gemini_error}")
+        for i, text_translated in zip(missing, gemini_translations):
+            translations[i] = text_translated
+    # Stage errors already name their engine (e.g. "DeepL quota exceeded")
+    return translations, "; ".join(err for err in (deepl_error, gemini_error) if err) or None
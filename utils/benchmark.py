@@ -0,0 +1,225 @@
+"""
+Utility: benchmark.py
+---------------------
+Command-line benchmarks for the transcription pipeline.
+
+    python -m utils.benchmark transcribe input.mp4 --model medium --batch-size 8 --chunk-minutes 10
+    python -m utils.benchmark segments --count 10000
+    python -m utils.benchmark srt --cues 100000
+
+``transcribe`` decodes the input once, then runs each transcription mode on
+the same audio (with the transcription cache disabled) and reports wall time
+and real-time factor as audio seconds per wall second.
+
+``segments`` compares the memory footprint and SRT writer throughput of
+faster-whisper segments / dicts against ``utils.segments.Segment`` and
+``SegmentColumns`` on synthetic data.
+
+``srt`` writes a synthetic SRT file (CRLF line endings and a BOM by default)
+and reports the throughput and peak memory of the streaming ``iter_srt``
+parser and of ``parse_srt``.
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+
+from utils.segments import Segment, SegmentColumns, to_segments
+from utils.srt_utils import generate_srt_content, iter_srt, parse_srt
+from utils.time_utils import format_srt_times
+
+# Defaults mirrored from utils.whisper_utils, which is imported lazily so the
+# segment benchmarks run without faster-whisper installed
+DEFAULT_BATCH_SIZE = 8
+DEFAULT_CHUNK_MINUTES = 10
+
+
+def _report(name, audio_sec, elapsed, segments):
+    print(
+        f"{name:<12} wall={elapsed:8.1f}s  "
+        f"throughput={audio_sec / elapsed:6.2f} audio-s/s  segments={len(segments or [])}"
+    )
+
+
+def bench_transcribe(args):
+    from utils.video_utils import load_audio
+    from utils.whisper_utils import (
+        SAMPLE_RATE,
+        get_cached_model,
+        transcribe_chunked,
+        transcribe_with_faster_whisper,
+        warm_transcribe_pool,
+    )
+
+    audio = load_audio(args.input)
+    if audio is None:
+        raise SystemExit(f"Could not decode audio from {args.input}")
+    audio_sec = len(audio) / SAMPLE_RATE
+    print(f"Input: {args.input} ({audio_sec:.1f}s of audio), model={args.model}, compute={args.compute_type}")
+
+    # Load the model up front, both in this process (sequential, batched) and in
+    # every pool worker (chunked, including its language detection), so no
+    # mode's timing includes a model load
+    get_cached_model(args.model, "cpu", args.compute_type)
+    warmed = warm_transcribe_pool(args.model, "cpu", args.compute_type)
+    print(f"Model loaded in this process and {warmed} pool worker(s)")
+
+    start = time.perf_counter()
+    segments, _ = transcribe_with_faster_whisper(
+        audio, args.model, "cpu", args.compute_type, args.beam_size, use_cache=False
+    )
+    _report("sequential", audio_sec, time.perf_counter() - start, segments)
+
+    start = time.perf_counter()
+    segments, _ = transcribe_with_faster_whisper(
+        audio, args.model, "cpu", args.compute_type, args.beam_size, use_cache=False,
+        mode="batched", batch_size=args.batch_size,
+    )
+    _report("batched", audio_sec, time.perf_counter() - start, segments)
+
+    start = time.perf_counter()
+    segments, _ = transcribe_chunked(
+        audio, args.model, "cpu", args.compute_type, args.beam_size,
+        chunk_minutes=args.chunk_minutes, use_cache=False,
+    )
+    _report("chunked", audio_sec, time.perf_counter() - start, segments)
+
+
+def _synthetic_whisper_segments(count, words_per_segment=8):
+    """faster-whisper ``Segment`` objects (or equivalent dicts without faster-whisper)."""
+    try:
+        from faster_whisper.transcribe import Segment as WhisperSegment, Word as WhisperWord
+    except ImportError:
+        WhisperSegment = WhisperWord = None
+    segments = []
+    for i in range(count):
+        start = i * 2.5
+        words = [
+            (start + j * 0.25, start + (j + 1) * 0.25, f" word{j}", 0.9)
+            for j in range(words_per_segment)
+        ]
+        text = " ".join(f"word{j}" for j in range(words_per_segment))
+        if WhisperSegment is None:
+            segments.append({
+                "id": i + 1, "seek": 0, "start": start, "end": start + 2.0, "text": text,
+                "tokens": list(range(50364, 50364 + 3 * words_per_segment)),
+                "avg_logprob": -0.2, "compression_ratio": 1.4, "no_speech_prob": 0.01,
+                "words": [dict(zip(("start", "end", "word", "probability"), w)) for w in words],
+                "temperature": 0.0,
+            })
+        else:
+            segments.append(WhisperSegment(
+                id=i + 1, seek=0, start=start, end=start + 2.0, text=text,
+                tokens=list(range(50364, 50364 + 3 * words_per_segment)),
+                avg_logprob=-0.2, compression_ratio=1.4, no_speech_prob=0.01,
+                words=[WhisperWord(*w) for w in words], temperature=0.0,
+            ))
+    return segments, "faster-whisper" if WhisperSegment else "dict"
+
+
+def _measure(build):
+    tracemalloc.start()
+    value = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return value, size
+
+
+def bench_segments(args):
+    count = args.count
+    (baseline, baseline_name), baseline_bytes = _measure(lambda: _synthetic_whisper_segments(count, args.words))
+    compact, compact_bytes = _measure(lambda: to_segments(baseline))
+    bare, bare_bytes = _measure(lambda: [Segment(s.start, s.end, s.text) for s in compact])
+    columns, columns_bytes = _measure(lambda: SegmentColumns.from_segments(compact))
+
+    # Text strings are shared with the baseline, so the compact rows exclude them
+    print(f"Memory per {count} segments ({args.words} words each where kept; text excluded except for the baseline):")
+    for name, size in (
+        (f"{baseline_name} segments", baseline_bytes),
+        ("Segment (with words)", compact_bytes),
+        ("Segment (no words)", bare_bytes),
+        ("SegmentColumns", columns_bytes),
+    ):
+        print(f"  {name:<28} {size / 1024 / 1024:8.2f} MiB  ({size / count:7.1f} B/segment)")
+
+    print(f"SRT writer throughput ({args.repeat} runs):")
+    for name, segments in ((f"{baseline_name} segments", baseline), ("Segment", compact)):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            generate_srt_content(segments)
+        elapsed = time.perf_counter() - start
+        print(f"  {name:<28} {count * args.repeat / elapsed:10.0f} segments/s")
+
+
+def _write_synthetic_srt(path, cues, crlf=True, bom=True):
+    """Writes ``cues`` two-line cues; returns the file size in bytes."""
+    newline = "\r\n" if crlf else "\n"
+    starts = [i * 2.5 for i in range(cues)]
+    start_strs = format_srt_times(starts)
+    end_strs = format_srt_times([t + 2.0 for t in starts])
+    with open(path, "w", encoding="utf-8-sig" if bom else "utf-8", newline="") as f:
+        for i, (start, end) in enumerate(zip(start_strs, end_strs), 1):
+            f.write(f"{i}{newline}{start} --> {end}{newline}Subtitle line {i}{newline}字幕の二行目{newline}{newline}")
+    return os.path.getsize(path)
+
+
+def bench_srt(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.srt")
+        size = _write_synthetic_srt(path, args.cues, crlf=not args.lf, bom=not args.no_bom)
+        print(f"{args.cues} cues, {size / 1024 / 1024:.1f} MiB ({'LF' if args.lf else 'CRLF'}), {args.repeat} runs:")
+
+        def _consume():
+            return sum(1 for _ in iter_srt(path))
+
+        for name, parse in (("iter_srt (streaming)", _consume), ("parse_srt (list)", lambda: len(parse_srt(path)))):
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                parsed = parse()
+            elapsed = (time.perf_counter() - start) / args.repeat
+            tracemalloc.start()
+            parse()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(
+                f"  {name:<22} {args.cues / elapsed:10.0f} cues/s  {size / 1024 / 1024 / elapsed:7.1f} MiB/s  "
+                f"peak={peak / 1024 / 1024:7.2f} MiB  cues={parsed if isinstance(parsed, int) else len(parsed)}"
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("transcribe", help="Compare transcription modes on one input")
+    p.add_argument("input")
+    p.add_argument("--model", default="medium")
+    p.add_argument("--compute-type", default="int8")
+    p.add_argument("--beam-size", type=int, default=5)
+    p.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    p.add_argument("--chunk-minutes", type=float, default=DEFAULT_CHUNK_MINUTES)
+    p.set_defaults(func=bench_transcribe)
+
+    p = sub.add_parser("segments", help="Segment model memory and writer throughput")
+    p.add_argument("--count", type=int, default=10000)
+    p.add_argument("--words", type=int, default=8, help="Words per synthetic segment")
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=bench_segments)
+
+    p = sub.add_parser("srt", help="SRT parser throughput on a synthetic file")
+    p.add_argument("--cues", type=int, default=100000)
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--lf", action="store_true", help="Use LF instead of CRLF line endings")
+    p.add_argument("--no-bom", action="store_true", help="Omit the UTF-8 BOM")
+    p.set_defaults(func=bench_srt)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,19 +2,259 @@
 Utility: burn_utils.py
 ----------------------
 Contains helper to burn an external subtitle file into a video using ffmpeg.
+
+Besides the single-pass encode, ``burn_subtitles`` can split the video at
+keyframes and burn the chunks in parallel ffmpeg processes; the burned
+chunks are joined with the concat demuxer (stream copy) and the original
+audio is muxed back in. Encodes run through ``utils.ffmpeg_runner``, so they
+report progress and can be cancelled or time out.
+
+``mux_subtitles`` is the no-re-encode alternative: it adds one or more
+subtitle files as soft subtitle tracks (stream copy for video and audio).
 """
 
+import logging
+import os
+import shutil
 import subprocess
+import tempfile
+import threading
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
 from pathlib import Path
 
+from utils.ffmpeg_runner import FfmpegCancelled, FfmpegError, FfmpegProgress, run_ffmpeg
+from utils.video_utils import probe_media
+
+logger = logging.getLogger(__name__)
+
+# Chunks shorter than this are not worth an extra ffmpeg process
+MIN_CHUNK_SEC = 10.0
+
+
 class BurnError(RuntimeError):
     """Raised when ffmpeg burning fails."""
 
+
+def _subtitles_filter(subtitle_path, font_size):
+    return f"subtitles='{subtitle_path}':force_style='Fontsize={font_size}'"
+
+
+def _run_ffmpeg(cmd, **kwargs):
+    try:
+        run_ffmpeg(cmd, **kwargs)
+    except FfmpegError as e:
+        raise BurnError(str(e)) from e
+
+
+def get_keyframe_times(video_path, start_time=0.0) -> list[float]:
+    """
+    Returns the presentation times (seconds) of the video keyframes.
+
+    Reads packet flags with ffprobe, so nothing is decoded. ffprobe reports
+    absolute stream timestamps; ``start_time`` (the container start, see
+    ``MediaInfo.start_time``) is subtracted so the times are on the same
+    file-relative timeline as ffmpeg's ``-ss`` and the subtitles filter.
+    Keyframes before the start are dropped.
+    """
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags",
+        "-of", "csv=p=0",
+        str(video_path),
+    ]
+    try:
+        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        raise BurnError(e.stderr) from e
+    times = []
+    for line in result.stdout.splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags:
+            try:
+                t = float(pts_time) - start_time
+            except ValueError:
+                continue
+            if t >= 0:
+                times.append(t)
+    return sorted(times)
+
+
+def plan_chunks(keyframes, duration, chunks) -> list[tuple[float, float]]:
+    """
+    Splits ``[0, duration)`` into at most ``chunks`` ``(start, end)`` ranges
+    whose inner boundaries are keyframes closest to an even split.
+    """
+    cuts = []
+    for i in range(1, chunks):
+        target = duration * i / chunks
+        candidates = [
+            t for t in keyframes
+            if t - (cuts[-1] if cuts else 0.0) >= MIN_CHUNK_SEC and duration - t >= MIN_CHUNK_SEC
+        ]
+        if not candidates:
+            break
+        cut = min(candidates, key=lambda t: abs(t - target))
+        if cut not in cuts and (not cuts or cut > cuts[-1]):
+            cuts.append(cut)
+    bounds = [0.0] + cuts + [duration]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _burn_single(video_path, subtitle_path, font_size, output_path, duration, **run_kwargs):
+    cmd = [
+        "ffmpeg",
+        "-i",
+        str(video_path),
+        "-vf",
+        _subtitles_filter(subtitle_path, font_size),
+        "-c:a",
+        "copy",
+        str(output_path),
+        "-y",
+    ]
+    _run_ffmpeg(cmd, duration=duration, **run_kwargs)
+
+
+def _burn_chunk(video_path, subtitle_path, font_size, start, end, chunk_path, threads, **run_kwargs):
+    """Burns ``[start, end)`` of the video (video stream only) into ``chunk_path``.
+
+    ``start``/``end`` are relative to the file start (see
+    ``get_keyframe_times``). Input seeking lands exactly on ``start`` because
+    it is a keyframe. The chunk's timestamps restart at 0, so they are shifted back onto the source
+    timeline for the subtitles filter and reset afterwards.
+    """
+    cmd = [
+        "ffmpeg",
+        "-ss", f"{start:.6f}",
+        "-i", str(video_path),
+        "-t", f"{end - start:.6f}",
+        "-map", "0:v:0",
+        "-an",
+        "-vf",
+        f"setpts=PTS+{start:.6f}/TB,{_subtitles_filter(subtitle_path, font_size)},setpts=PTS-STARTPTS",
+        "-threads", str(threads),
+        str(chunk_path),
+        "-y",
+    ]
+    _run_ffmpeg(cmd, duration=end - start, **run_kwargs)
+    return chunk_path
+
+
+class _ChunkProgress:
+    """Folds the progress of concurrently encoded chunks into one ``FfmpegProgress``."""
+
+    def __init__(self, total, on_progress):
+        self._total = total
+        self._on_progress = on_progress
+        self._chunks = {}
+        self._lock = threading.Lock()
+
+    def for_chunk(self, idx):
+        if self._on_progress is None:
+            return None
+        return lambda progress: self._update(idx, progress)
+
+    def _update(self, idx, progress):
+        with self._lock:
+            self._chunks[idx] = progress
+            chunks = list(self._chunks.values())
+            self._on_progress(
+                FfmpegProgress(
+                    frame=sum(p.frame for p in chunks),
+                    fps=sum(p.fps for p in chunks),
+                    speed=sum(p.speed or 0.0 for p in chunks) or None,
+                    out_time=sum(p.out_time for p in chunks),
+                    total=self._total,
+                )
+            )
+
+
+def _raise_chunk_failure(futures):
+    """Re-raises the error of the chunk that actually failed.
+
+    When one chunk fails the others are aborted and raise ``FfmpegCancelled``
+    (wrapped in ``BurnError``); those are only reported if nothing else
+    failed, i.e. the caller cancelled.
+    """
+    cancelled = None
+    for future in futures:
+        error = future.exception()
+        if error is None:
+            continue
+        if isinstance(error.__cause__, FfmpegCancelled) or isinstance(error, FfmpegCancelled):
+            cancelled = cancelled or error
+            continue
+        raise error
+    if cancelled is not None:
+        raise cancelled
+
+
+def _burn_parallel(video_path, subtitle_path, font_size, output_path, workers, media,
+                   on_progress=None, cancel_event=None, timeout=None):
+    """Returns False (without writing anything) when the video cannot be split usefully."""
+    chunks = plan_chunks(get_keyframe_times(video_path, media.start_time), media.duration, workers)
+    if len(chunks) < 2:
+        return False
+
+    threads = max(1, (os.cpu_count() or 1) // len(chunks))
+    logger.info(f"Burning {video_path} in {len(chunks)} parallel chunks ({threads} threads each)")
+    work_dir = Path(tempfile.mkdtemp(prefix="burn_chunks_", dir=output_path.parent))
+    progress = _ChunkProgress(media.duration, on_progress)
+    # Stops every chunk when the caller cancels or one chunk fails
+    abort = threading.Event()
+    try:
+        chunk_paths = [work_dir / f"chunk_{i:03}{output_path.suffix}" for i in range(len(chunks))]
+        with ThreadPoolExecutor(max_workers=len(chunks), thread_name_prefix="burn_chunk") as executor:
+            futures = [
+                executor.submit(
+                    _burn_chunk, video_path, subtitle_path, font_size, start, end, path, threads,
+                    on_progress=progress.for_chunk(i), cancel_event=abort, timeout=timeout,
+                )
+                for i, ((start, end), path) in enumerate(zip(chunks, chunk_paths))
+            ]
+            pending = futures
+            while pending:
+                done, pending = wait(pending, timeout=0.2, return_when=FIRST_EXCEPTION)
+                if (cancel_event is not None and cancel_event.is_set()) or any(f.exception() for f in done):
+                    abort.set()
+            _raise_chunk_failure(futures)
+
+        concat_list = work_dir / "concat.txt"
+        concat_list.write_text(
+            "".join(f"file '{path.resolve()}'\n" for path in chunk_paths), encoding="utf-8"
+        )
+        # Join the burned video losslessly and take the untouched audio from the source
+        _run_ffmpeg(
+            [
+                "ffmpeg",
+                "-f", "concat", "-safe", "0", "-i", str(concat_list),
+                "-i", str(video_path),
+                "-map", "0:v:0",
+                "-map", "1:a?",
+                "-c", "copy",
+                str(output_path),
+                "-y",
+            ],
+            cancel_event=cancel_event,
+            timeout=timeout,
+        )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if on_progress is not None:
+        on_progress(FfmpegProgress(out_time=media.duration, total=media.duration, finished=True))
+    return True
+
+
 def burn_subtitles(
     video_path: Path,
     subtitle_path: Path,
     font_size: int = 24,
     out_dir: Path | str = "./burn_temp",
+    workers: int = 1,
+    on_progress=None,
+    cancel_event: threading.Event | None = None,
+    timeout: float | None = None,
 ) -> Path:
     """
     Burn subtitles into a video file.
@@ -24,29 +264,131 @@ def burn_subtitles(
         subtitle_path: Path to the subtitle (SRT/ASS) file.
         font_size: ASS style Fontsize to apply.
         out_dir: Directory to write the burned video.
+        workers: Number of keyframe-aligned chunks encoded in parallel. With 1
+            (or a video too short to split) a single ffmpeg pass is used.
+        on_progress: Receives ``FfmpegProgress`` snapshots (fps, speed, ETA).
+        cancel_event: Setting it stops the encode (raises ``BurnError``).
+        timeout: Wall-clock limit in seconds for each ffmpeg process.
 
     Returns:
         Path of the burned MP4.
     """
+    video_path = Path(video_path)
     out_dir = Path(out_dir)
     out_dir.mkdir(exist_ok=True)
 
     output_path = out_dir / f"burn_{video_path.name}"
+    media = probe_media(video_path)
+    run_kwargs = {"on_progress": on_progress, "cancel_event": cancel_event, "timeout": timeout}
 
-    cmd = [
-        "ffmpeg",
-        "-i",
-        str(video_path),
-        "-vf",
-        f"subtitles='{subtitle_path}':force_style='Fontsize={font_size}'",
-        "-c:a",
-        "copy",
-        str(output_path),
-        "-y",
-    ]
-    try:
-        subprocess.run(cmd, check=True, capture_output=True)
-    except subprocess.CalledProcessError as e:
-        raise BurnError(e.stderr.decode(errors="ignore")) from e
+    if (
+        workers > 1
+        and media is not None
+        and media.duration
+        and _burn_parallel(video_path, subtitle_path, font_size, output_path, workers, media, **run_kwargs)
+    ):
+        return output_path
+    _burn_single(video_path, subtitle_path, font_size, output_path, media.duration if media else None, **run_kwargs)
+    return output_path
+
+
+# --- Soft subtitles (mux without re-encoding) ---------------------------
+# ISO 639-1 (UI / Whisper codes) → ISO 639-2/T, used by MP4/MOV language tags
+ISO639_2 = {
+    "ja": "jpn", "en": "eng", "fr": "fra", "de": "deu", "es": "spa", "it": "ita",
+    "pt": "por", "ru": "rus", "zh": "zho", "ko": "kor", "nl": "nld", "sv": "swe",
+    "pl": "pol", "tr": "tur", "ar": "ara", "hi": "hin", "th": "tha", "vi": "vie",
+    "id": "ind", "uk": "ukr",
+}
+# Matroska uses the bibliographic (ISO 639-2/B) codes where they differ
+ISO639_2_B = {"fra": "fre", "deu": "ger", "zho": "chi", "nld": "dut"}
+
+# Containers that only carry text subtitles as mov_text (ASS styling is dropped)
+_MOV_TEXT_CONTAINERS = {".mp4", ".m4v", ".mov"}
+
+
+def _language_tag(language, container_suffix):
+    if not language:
+        return "und"
+    language = language.lower()
+    tag = ISO639_2.get(language, language if len(language) == 3 else "und")
+    if container_suffix == ".mkv":
+        tag = ISO639_2_B.get(tag, tag)
+    return tag
+
+
+def _subtitle_codec(container_suffix, subtitle_path):
+    if container_suffix in _MOV_TEXT_CONTAINERS:
+        return "mov_text"
+    return "ass" if Path(subtitle_path).suffix.lower() == ".ass" else "srt"
+
+
+def mux_subtitles(
+    video_path: Path,
+    subtitle_tracks,
+    out_dir: Path | str = "./burn_temp",
+    container: str | None = None,
+    on_progress=None,
+    cancel_event: threading.Event | None = None,
+    timeout: float | None = None,
+) -> Path:
+    """
+    Add subtitle files to a video as soft subtitle tracks, without re-encoding.
+
+    Video and audio are stream-copied. MP4/MOV outputs store the tracks as
+    ``mov_text``; MKV keeps ASS files as ``ass`` (with their styling) and SRT
+    files as ``srt``. The first track is marked as the default.
+
+    Args:
+        video_path: Path to the source video.
+        subtitle_tracks: Iterable of ``(subtitle_path, language)`` pairs; the
+            language is an ISO 639-1 code (``"ja"``) or ISO 639-2 code, or None.
+        out_dir: Directory to write the muxed video.
+        container: Output extension (``"mp4"``, ``"mkv"``, ...). Defaults to the
+            source's if it is MP4/MOV/MKV, otherwise MKV.
+        on_progress, cancel_event, timeout: See ``burn_subtitles``.
+
+    Returns:
+        Path of the muxed video.
+    """
+    video_path = Path(video_path)
+    subtitle_tracks = [(Path(path), language) for path, language in subtitle_tracks]
+    if not subtitle_tracks:
+        raise BurnError("No subtitle tracks to mux")
+    out_dir = Path(out_dir)
+    out_dir.mkdir(exist_ok=True)
+
+    if container:
+        suffix = "." + container.lower().lstrip(".")
+    else:
+        suffix = video_path.suffix.lower()
+        if suffix not in _MOV_TEXT_CONTAINERS | {".mkv"}:
+            suffix = ".mkv"
+    output_path = out_dir / f"mux_{video_path.stem}{suffix}"
+
+    cmd = ["ffmpeg", "-i", str(video_path)]
+    for subtitle_path, _ in subtitle_tracks:
+        cmd += ["-i", str(subtitle_path)]
+    cmd += ["-map", "0:v", "-map", "0:a?"]
+    for i in range(len(subtitle_tracks)):
+        cmd += ["-map", f"{i + 1}:0"]
+    cmd += ["-c:v", "copy", "-c:a", "copy"]
+    for i, (subtitle_path, language) in enumerate(subtitle_tracks):
+        cmd += [
+            f"-c:s:{i}", _subtitle_codec(suffix, subtitle_path),
+            f"-metadata:s:s:{i}", f"language={_language_tag(language, suffix)}",
+            f"-disposition:s:{i}", "default" if i == 0 else "0",
+        ]
+        if language:
+            cmd += [f"-metadata:s:s:{i}", f"title={language}"]
+    cmd += [str(output_path), "-y"]
 
+    media = probe_media(video_path)
+    _run_ffmpeg(
+        cmd,
+        duration=media.duration if media else None,
+        on_progress=on_progress,
+        cancel_event=cancel_event,
+        timeout=timeout,
+    )
     return output_path
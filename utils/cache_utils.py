@@ -0,0 +1,279 @@
+"""
+Utility: cache_utils.py
+-----------------------
+Size-bounded on-disk LRU caches used to persist expensive pipeline results
+(e.g. Whisper transcriptions, downloaded media) across runs and processes.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+_HASH_CHUNK_SIZE = 1 << 20  # 1 MiB
+
+
+def hash_bytes_like(data, hasher=None):
+    """Feeds a bytes-like object (bytes, memoryview, contiguous ndarray) into a sha256 hasher."""
+    hasher = hasher or hashlib.sha256()
+    hasher.update(memoryview(data).cast("B"))
+    return hasher
+
+
+def hash_file(path, hasher=None):
+    """Feeds the contents of ``path`` into a sha256 hasher in fixed-size chunks."""
+    hasher = hasher or hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher
+
+
+class DiskLRUCache:
+    """
+    Pickle-backed key/value cache stored as one file per entry under ``root``.
+
+    Entry recency is tracked through file mtimes (touched on every hit), so
+    several processes can share one cache directory. Writes go through a
+    temporary file plus ``os.replace`` and are therefore atomic. Whenever the
+    total size exceeds ``max_bytes`` the least recently used entries are removed.
+    """
+
+    def __init__(self, root, max_bytes, suffix=".pkl"):
+        self.root = Path(root)
+        self.max_bytes = int(max_bytes)
+        self.suffix = suffix
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return self.root / f"{key}{self.suffix}"
+
+    def get(self, key, default=None):
+        """Returns the cached value for ``key`` or ``default`` on a miss."""
+        path = self._path(key)
+        try:
+            with path.open("rb") as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return default
+        except Exception as e:
+            logger.warning(f"Discarding unreadable cache entry '{path}': {e}")
+            self._remove(path)
+            return default
+        try:
+            os.utime(path)  # mark as most recently used
+        except OSError:
+            pass
+        return value
+
+    def set(self, key, value):
+        """Stores ``value`` under ``key`` and evicts old entries if over budget."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except Exception:
+            self._remove(Path(tmp_path))
+            raise
+        self.evict()
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits ``max_bytes``."""
+        with self._lock:
+            entries = []
+            total = 0
+            for path in self.root.glob(f"*{self.suffix}"):
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+            if total <= self.max_bytes:
+                return
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+                logger.info(f"Evicted cache entry '{path.name}' ({size} bytes)")
+
+    @staticmethod
+    def _remove(path):
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+
+class FileLRUCache:
+    """
+    Size-bounded LRU cache of whole files (e.g. downloaded media) under ``root``.
+
+    Each entry is a data file ``<key><ext>`` plus a ``<key>.json`` sidecar
+    recording its size and sha256. A hit requires the data file to exist with
+    the recorded size (and, with ``verify_hash``, the recorded digest), so
+    truncated or replaced files are dropped instead of being served. Recency is
+    tracked through the sidecar mtime, touched on every hit, and the total of
+    the recorded sizes is kept under ``max_bytes``.
+    """
+
+    def __init__(self, root, max_bytes, verify_hash=False):
+        self.root = Path(root)
+        self.max_bytes = int(max_bytes)
+        self.verify_hash = verify_hash
+        self._lock = threading.Lock()
+
+    def _meta_path(self, key):
+        return self.root / f"{key}.json"
+
+    def _read_meta(self, meta_path):
+        try:
+            with meta_path.open("r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Discarding unreadable cache metadata '{meta_path}': {e}")
+            DiskLRUCache._remove(meta_path)
+            return None
+
+    def get(self, key):
+        """Returns the cached file path for ``key``, or ``None`` on a miss or a failed integrity check."""
+        meta_path = self._meta_path(key)
+        meta = self._read_meta(meta_path)
+        if meta is None:
+            return None
+        path = self.root / meta["file"]
+        try:
+            size = path.stat().st_size
+        except OSError:
+            size = None
+        intact = size == meta.get("size")
+        if intact and self.verify_hash:
+            intact = hash_file(path).hexdigest() == meta.get("sha256")
+        if not intact:
+            logger.warning(f"Cached file '{path.name}' failed integrity check; discarding entry")
+            self._remove_entry(meta_path, path)
+            return None
+        try:
+            os.utime(meta_path)  # mark as most recently used
+        except OSError:
+            pass
+        return path
+
+    def put(self, key, src_path, **meta):
+        """
+        Adds ``src_path`` to the cache under ``key`` and returns the cached path.
+
+        The cache gets a hard link (a copy across filesystems), so
+        ``src_path`` stays owned by the caller and is unaffected by later
+        evictions. Files larger than ``max_bytes`` are not cached and
+        ``src_path`` is returned as is. Extra keyword arguments are stored in
+        the sidecar for reference. Evicts old entries, never ``key`` itself,
+        if the cache is over budget afterwards.
+        """
+        src_path = Path(src_path)
+        size = src_path.stat().st_size
+        if size > self.max_bytes:
+            logger.info(f"Not caching '{src_path.name}': {size} bytes exceeds the cache budget of {self.max_bytes}")
+            return src_path
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.root / f"{key}{src_path.suffix}"
+        record = {
+            "file": path.name,
+            "size": size,
+            "sha256": hash_file(src_path).hexdigest(),
+            **meta,
+        }
+        if src_path.resolve() != path.resolve():
+            self._link_or_copy(src_path, path)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(record, f, ensure_ascii=False)
+            os.replace(tmp_path, self._meta_path(key))
+        except Exception:
+            DiskLRUCache._remove(Path(tmp_path))
+            raise
+        self.evict(keep=key)
+        return path
+
+    def checkout(self, path, dest_path):
+        """
+        Gives the caller its own name for the cached file ``path`` at ``dest_path``.
+
+        ``dest_path`` is a hard link (a copy across filesystems), so it stays
+        valid when the entry is evicted while the caller is still using it.
+
+        Raises:
+            FileNotFoundError: The entry was evicted since ``get``.
+        """
+        path, dest_path = Path(path), Path(dest_path)
+        if dest_path.exists() and dest_path.samefile(path):
+            return dest_path
+        self._link_or_copy(path, dest_path)
+        return dest_path
+
+    @staticmethod
+    def _link_or_copy(src_path, dest_path):
+        """Atomically places a hard link (or, across filesystems, a copy) of ``src_path`` at ``dest_path``."""
+        dest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = dest_path.with_name(f".{dest_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            try:
+                os.link(src_path, tmp_path)
+            except FileNotFoundError:
+                raise  # The source is gone (e.g. evicted): nothing to copy either
+            except OSError:
+                shutil.copyfile(src_path, tmp_path)
+            os.replace(tmp_path, dest_path)
+        except Exception:
+            DiskLRUCache._remove(tmp_path)
+            raise
+
+    def evict(self, keep=None):
+        """Removes least recently used entries until the cache fits ``max_bytes``; ``keep`` is never removed."""
+        with self._lock:
+            entries = []
+            total = 0
+            for meta_path in self.root.glob("*.json"):
+                meta = self._read_meta(meta_path)
+                if meta is None:
+                    continue
+                try:
+                    mtime = meta_path.stat().st_mtime
+                except OSError:
+                    continue
+                size = meta.get("size", 0)
+                total += size
+                if meta_path.stem == keep:
+                    continue
+                entries.append((mtime, size, meta_path, self.root / meta["file"]))
+            if total <= self.max_bytes:
+                return
+            entries.sort()
+            for _, size, meta_path, path in entries:
+                if total <= self.max_bytes:
+                    break
+                self._remove_entry(meta_path, path)
+                total -= size
+                logger.info(f"Evicted cached file '{path.name}' ({size} bytes)")
+
+    @staticmethod
+    def _remove_entry(meta_path, path):
+        # Sidecar first, so a half-removed entry is never served
+        DiskLRUCache._remove(meta_path)
+        DiskLRUCache._remove(path)
@@ -0,0 +1,119 @@
+"""
+Headless command-line entry point for subtitle generation.
+
+    python -m utils.cli input.mp4 https://www.youtube.com/watch?v=... \
+        --format SRT --language ja --model medium --output-dir ./subs
+
+Several formats can be written from one transcription (``--format SRT,ASS,
+FCPXML,VTT``); they are also bundled into one zip archive per input.
+
+Runs the same pipeline as the Streamlit front-end (``utils.processing``)
+without importing Streamlit, so it can be used from cron jobs, container
+workers and benchmarks. API keys default to the DEEPL_API_KEY and
+GEMINI_API_KEY environment variables (a ``.env`` file is honoured).
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+from dotenv import load_dotenv
+
+from utils.events import EventBus, JsonLinesLogger, ProgressAdapter
+from utils.processing import SUBTITLE_EXTENSIONS, main_process
+
+
+class ConsoleProgress:
+    """Progress sink that writes one line per update to stderr."""
+
+    def __init__(self, quiet=False):
+        self.quiet = quiet
+
+    def update(self, pct: float, msg: str):
+        if not self.quiet:
+            print(f"[{pct:5.1f}%] {msg}", file=sys.stderr, flush=True)
+
+    def warning(self, msg: str):
+        print(f"WARNING: {msg}", file=sys.stderr, flush=True)
+
+    def error(self, msg: str):
+        print(f"ERROR: {msg}", file=sys.stderr, flush=True)
+
+
+def _parse_formats(value):
+    formats = [fmt.strip().upper() for fmt in value.split(",") if fmt.strip()]
+    unknown = [fmt for fmt in formats if fmt not in SUBTITLE_EXTENSIONS]
+    if not formats or unknown:
+        raise argparse.ArgumentTypeError(f"unknown format(s): {', '.join(unknown) or value!r}")
+    return formats
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m utils.cli",
+        description="Generate (and optionally translate) subtitles for local files or URLs.",
+    )
+    parser.add_argument("inputs", nargs="+", help="Local media files and/or http(s) URLs")
+    parser.add_argument("--format", default=["SRT"], type=_parse_formats,
+                        help=f"Comma-separated subtitle formats, written in a single pass ({', '.join(SUBTITLE_EXTENSIONS)})")
+    parser.add_argument("--language", default="ja", help="Output language code (e.g. ja, en, fr, de)")
+    parser.add_argument("--model", default="medium", help="Whisper model size")
+    parser.add_argument("--mode", choices=["sequential", "batched", "chunked"], default="sequential")
+    parser.add_argument("--beam-size", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=8, help="Batch size for --mode batched")
+    parser.add_argument("--chunk-minutes", type=float, default=10, help="Chunk length for --mode chunked")
+    parser.add_argument("--font-size", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=1, help="Files processed in parallel")
+    parser.add_argument("--output-dir", default="./generated_subs")
+    parser.add_argument("--use-temp-wav", action="store_true", help="Decode audio via a temporary WAV file")
+    parser.add_argument("--deepl-key", default=None, help="DeepL API key (default: $DEEPL_API_KEY)")
+    parser.add_argument("--gemini-key", default=None, help="Gemini API key (default: $GEMINI_API_KEY)")
+    parser.add_argument("--event-log", default=os.environ.get("PIPELINE_EVENT_LOG"),
+                        help="Append pipeline events as JSON lines to this file")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Only print warnings, errors and results")
+    return parser
+
+
+def main(argv=None):
+    load_dotenv()
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    whisper_cfg = {
+        "model_size": args.model,
+        "beam_size": args.beam_size,
+        "use_temp_wav": args.use_temp_wav,
+        "mode": args.mode,
+        "batch_size": args.batch_size,
+        "chunk_minutes": args.chunk_minutes,
+    }
+    events = EventBus()
+    events.subscribe(ProgressAdapter(ConsoleProgress(quiet=args.quiet), expected_jobs=len(args.inputs)))
+    if args.event_log:
+        events.subscribe(JsonLinesLogger(args.event_log))
+    results = main_process(
+        args.inputs,
+        events,
+        None,
+        args.format,
+        args.language,
+        whisper_cfg,
+        False,
+        args.font_size,
+        args.deepl_key or os.environ.get("DEEPL_API_KEY"),
+        args.gemini_key or os.environ.get("GEMINI_API_KEY"),
+        max_workers=args.workers,
+        output_dir=args.output_dir,
+    )
+
+    for res in results:
+        for path in res["output_files"].values():
+            print(path)
+        if res["bundle"]:
+            print(res["bundle"])
+    return 0 if len(results) == len(args.inputs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
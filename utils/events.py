@@ -0,0 +1,231 @@
+"""
+Utility: events.py
+------------------
+Typed progress/event stream for the processing pipeline.
+
+Pipeline code publishes events to an ``EventBus``; front-ends subscribe to
+it. ``ProgressAdapter`` turns the stream into ``update``/``warning``/``error``
+calls on a progress sink (the Streamlit ``ProgressManager`` or the CLI
+console), and ``JsonLinesLogger`` appends every event to a JSON-lines file.
+The bus is thread-safe, throttles high-frequency events, and can receive
+events from worker processes through ``EventBus.process_channel``.
+"""
+
+import json
+import logging
+import multiprocessing
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+# --- Event types ---------------------------------------------------------
+@dataclass(frozen=True)
+class Event:
+    """Base event. ``pct`` is the job's overall progress (0–100) when known."""
+    job: str
+    message: str = ""
+    pct: Optional[float] = None
+    timestamp: float = field(default_factory=time.time)
+
+
+@dataclass(frozen=True)
+class Progress(Event):
+    """Generic progress update with a user-facing message."""
+
+
+@dataclass(frozen=True)
+class StageStarted(Event):
+    stage: str = ""
+
+
+@dataclass(frozen=True)
+class StageFinished(Event):
+    stage: str = ""
+    elapsed: float = 0.0
+
+
+@dataclass(frozen=True)
+class BytesDownloaded(Event):
+    downloaded: int = 0
+    total: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class AudioDecoded(Event):
+    """Audio seconds transcribed so far out of ``total_seconds``."""
+    seconds: float = 0.0
+    total_seconds: float = 0.0
+
+
+@dataclass(frozen=True)
+class EncodeProgress(Event):
+    """ffmpeg progress (see ``utils.ffmpeg_runner.FfmpegProgress``)."""
+    fps: float = 0.0
+    speed: Optional[float] = None
+    out_time: float = 0.0
+    eta: Optional[float] = None
+
+
+@dataclass(frozen=True)
+class SegmentsTranslated(Event):
+    done: int = 0
+    total: int = 0
+
+
+@dataclass(frozen=True)
+class PipelineWarning(Event):
+    pass
+
+
+@dataclass(frozen=True)
+class PipelineError(Event):
+    pass
+
+
+# High-frequency events that are rate-limited per (job, type)
+_THROTTLED_TYPES = (Progress, BytesDownloaded, AudioDecoded, EncodeProgress, SegmentsTranslated)
+
+
+def _is_final(event):
+    if isinstance(event, BytesDownloaded):
+        return event.total is not None and event.downloaded >= event.total
+    # A total of 0 means "unknown" (e.g. a stream that is still growing)
+    if isinstance(event, AudioDecoded):
+        return event.total_seconds > 0 and event.seconds >= event.total_seconds
+    if isinstance(event, SegmentsTranslated):
+        return event.total > 0 and event.done >= event.total
+    return False
+
+
+# --- Bus -----------------------------------------------------------------
+class EventBus:
+    """
+    Thread-safe publish/subscribe hub.
+
+    Subscribers are called synchronously in the publishing thread, one event
+    at a time (dispatch is serialized), so UI callbacks never run concurrently.
+    Events of the throttled types are dropped when the previous event of the
+    same type for the same job was published less than ``throttle_sec`` ago,
+    except for the final event of a series.
+    """
+
+    def __init__(self, throttle_sec=0.1):
+        self.throttle_sec = throttle_sec
+        self._subscribers = []
+        self._lock = threading.RLock()
+        self._last_sent = {}
+
+    def subscribe(self, callback, event_types=None):
+        """Registers ``callback(event)``; returns a function that unsubscribes it."""
+        entry = (callback, tuple(event_types) if event_types else None)
+        with self._lock:
+            self._subscribers.append(entry)
+
+        def _unsubscribe():
+            with self._lock:
+                if entry in self._subscribers:
+                    self._subscribers.remove(entry)
+
+        return _unsubscribe
+
+    def publish(self, event):
+        with self._lock:
+            if isinstance(event, _THROTTLED_TYPES) and not _is_final(event):
+                key = (event.job, type(event))
+                now = time.monotonic()
+                if now - self._last_sent.get(key, 0.0) < self.throttle_sec:
+                    return
+                self._last_sent[key] = now
+            for callback, event_types in list(self._subscribers):
+                if event_types and not isinstance(event, event_types):
+                    continue
+                try:
+                    callback(event)
+                except Exception as e:
+                    logger.error(f"Event subscriber {callback!r} failed on {type(event).__name__}: {e}")
+
+    @contextmanager
+    def process_channel(self, thread_initializer=None):
+        """
+        Yields a picklable ``QueuePublisher`` for use in worker processes.
+
+        Events put on it are forwarded to this bus by a pump thread until the
+        context exits. ``thread_initializer`` runs first on the pump thread,
+        so subscribers see the same thread setup as the caller's worker
+        threads (e.g. the Streamlit script context).
+        """
+        manager = multiprocessing.get_context("spawn").Manager()
+        queue = manager.Queue()
+
+        def _pump():
+            if thread_initializer is not None:
+                thread_initializer()
+            while True:
+                event = queue.get()
+                if event is None:
+                    break
+                self.publish(event)
+
+        pump = threading.Thread(target=_pump, name="event-pump", daemon=True)
+        pump.start()
+        try:
+            yield QueuePublisher(queue)
+        finally:
+            queue.put(None)
+            pump.join(timeout=5)
+            manager.shutdown()
+
+
+class QueuePublisher:
+    """Process-side handle that forwards events to an ``EventBus`` via a queue."""
+
+    def __init__(self, queue):
+        self._queue = queue
+
+    def publish(self, event):
+        self._queue.put(event)
+
+
+# --- Subscribers ---------------------------------------------------------
+class ProgressAdapter:
+    """
+    Subscriber that drives a progress sink (``update``/``warning``/``error``).
+
+    With several jobs in flight the reported percentage is the mean of the
+    latest percentage of every job seen so far (``expected_jobs`` seeds the
+    denominator so the bar does not jump back when new jobs start).
+    """
+
+    def __init__(self, sink, expected_jobs=1):
+        self.sink = sink
+        self.expected_jobs = max(1, expected_jobs)
+        self._pcts = {}
+
+    def __call__(self, event):
+        if isinstance(event, PipelineError):
+            self.sink.error(event.message)
+        elif isinstance(event, PipelineWarning):
+            self.sink.warning(event.message)
+        elif event.pct is not None:
+            self._pcts[event.job] = max(0.0, min(100.0, float(event.pct)))
+            overall = sum(self._pcts.values()) / max(self.expected_jobs, len(self._pcts))
+            self.sink.update(overall, event.message)
+
+
+class JsonLinesLogger:
+    """Subscriber that appends every event as one JSON object per line."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        record = {"type": type(event).__name__, **asdict(event)}
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
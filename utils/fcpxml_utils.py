@@ -1,220 +1,243 @@
-import xml.dom.minidom
-from xml.etree.ElementTree import Element, SubElement, ElementTree, Comment
 import io
-import datetime # Import datetime module
-import ffmpeg # Import ffmpeg for probing
 import logging
 import math
+import re
+from datetime import datetime
+from fractions import Fraction
+from xml.sax.saxutils import escape, quoteattr
+
+from utils.video_utils import probe_media
+from utils.segments import to_segment
+from utils.time_utils import format_frames, format_rational_time, frame_duration, seconds_to_frames
 
 logger = logging.getLogger(__name__)
 
+FCPXML_VERSION = "1.13"
+BASIC_TITLE_UID = ".../Titles.localized/Bumper:Opener.localized/Basic Title.localized/Basic Title.moti"
+TITLE_FONT = "Meiryo"
+# Characters that are not allowed anywhere in an XML 1.0 document
+_INVALID_XML_CHARS_RE = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+# Room reserved for the sequence/gap duration so it can be patched in place on close
+_DURATION_FIELD_WIDTH = 40
+
 # --- Helper to format time for FCPXML (fractional seconds) ---
 def to_fractional_time(seconds, frame_rate=24.0):
-    """Converts seconds to FCPXML fractional time format 'frames/fpss'."""
-    if seconds is None: return "0/1s"
-    # Ensure frame_rate is float for division
-    frame_rate = float(frame_rate) if frame_rate else 24.0
-    if frame_rate <= 0: frame_rate = 24.0 # Avoid division by zero
-    
-    # Calculate total frames, ensuring non-negative result
-    total_frames = max(0, round(seconds * frame_rate))
-    
-    # Format as fraction, ensuring integer frame rate in denominator if possible
-    if frame_rate.is_integer():
-        return f"{total_frames}/{int(frame_rate)}s"
-    else:
-        # Use a common denominator like 100 or 1000 for non-integer rates if needed,
-        # but standard practice is often to just use the float rate.
-        # For simplicity, we'll use the float rate directly here.
-        # A more robust solution might involve finding common denominators.
-        return f"{total_frames}/{frame_rate:.2f}s" # Format float rate
+    """Converts seconds to an FCPXML rational time on the frame grid (e.g. '1001/30000s')."""
+    if not frame_rate or frame_rate <= 0: frame_rate = 24.0 # Avoid division by zero
+    return format_rational_time(seconds, frame_rate)
+
+def _xml_text(text):
+    return escape(_INVALID_XML_CHARS_RE.sub("", text))
+
+def _xml_attr(text):
+    return quoteattr(_INVALID_XML_CHARS_RE.sub("", text))
+
+def _format_name(height, frame_rate):
+    """FCP-style format name, e.g. FFVideoFormat1080p2997 or FFVideoFormat1080p24."""
+    rate = Fraction(frame_rate)
+    rate_str = str(rate.numerator) if rate.denominator == 1 else f"{float(rate) * 100:.0f}"
+    return f"FFVideoFormat{height}p{rate_str}"
+
+# --- FcpxmlWriter: タイトルを1件ずつファイルへ書き出すストリーミング FCPXML ライター ---
+class FcpxmlWriter:
+    """
+    Streaming FCPXML writer: the header is written on construction, each
+    ``write(segment)`` emits one ``<title>`` to ``fh`` immediately, and
+    ``close()`` writes the closing tags. Nothing is kept per title, so memory
+    stays flat regardless of the number of segments.
+
+    Titles with identical styling share one ``text-style-def`` (defined in
+    the first title that uses it and referenced by id afterwards). Times are
+    exact rationals on the frame grid, so NTSC rates such as 30000/1001 get
+    ``1001/30000s``-based offsets without drift.
+
+    The sequence must be at least as long as its last title. When ``fh`` is
+    seekable the duration is patched in place on ``close()``; otherwise the
+    given ``duration`` is used as is.
+    """
+
+    def __init__(self, fh, width=1920, height=1080, frame_rate=24, font_size=65, duration=None):
+        self._fh = fh
+        self.frame_rate = frame_rate if frame_rate and frame_rate > 0 else 24
+        self.width = width
+        self.height = height
+        self.font_size = max(10, int(font_size)) # Ensure minimum size 10
+        self.title_count = 0
+        self._style_ids = {}
+        self._min_frames = seconds_to_frames(duration, self.frame_rate) if duration else 0
+        self._last_frame = 0
+        self._duration_positions = []
+        # Compute vertical margin as 5% of video height
+        self._position = f"0 -{int(height * 0.05)}"
+        self._write_header()
+
+    def _duration_attr(self, frames):
+        return f'duration="{format_frames(frames, self.frame_rate)}"'.ljust(_DURATION_FIELD_WIDTH)
+
+    def _write_with_duration(self, before, after):
+        """Writes ``before`` + a patchable duration attribute + ``after``."""
+        self._fh.write(before)
+        try:
+            self._duration_positions.append(self._fh.tell())
+        except (OSError, io.UnsupportedOperation):
+            pass
+        self._fh.write(self._duration_attr(self._min_frames) + after)
+
+    def _write_header(self):
+        fh = self._fh
+        fh.write('<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE fcpxml>\n')
+        fh.write(f'<fcpxml version="{FCPXML_VERSION}">\n')
+        fh.write(f"<!-- Generated by Subtitle Tool on {datetime.now().isoformat()} -->\n")
+        frame = frame_duration(self.frame_rate)
+        fh.write(
+            "<resources>\n"
+            f'<format id="r1" name="{_format_name(self.height, 1 / frame)}" '
+            f'frameDuration="{format_frames(1, self.frame_rate)}" width="{self.width}" height="{self.height}"/>\n'
+            f'<effect id="r2" name="Basic Title" uid={_xml_attr(BASIC_TITLE_UID)}/>\n'
+            "</resources>\n"
+            '<library>\n<event name="Subtitle Import">\n<project name="Generated Subtitles Project">\n'
+        )
+        # NDF = Non-Drop Frame
+        self._write_with_duration('<sequence format="r1" tcStart="0s" tcFormat="NDF" ', ">\n<spine>\n")
+        # A gap covering the entire sequence holds the titles
+        self._write_with_duration('<gap name="Base Gap" offset="0s" start="0s" ', ">\n")
+
+    def _style_ref(self, font, size):
+        """Returns ``(style_id, is_new)`` for the given styling."""
+        key = (font, size)
+        style_id = self._style_ids.get(key)
+        if style_id is not None:
+            return style_id, False
+        style_id = f"ts{len(self._style_ids) + 1}"
+        self._style_ids[key] = style_id
+        return style_id, True
+
+    def write(self, segment):
+        """Writes one title; returns False if the segment was skipped."""
+        segment = to_segment(segment)
+        start_s, end_s, text = segment.start, segment.end, (segment.text or "").strip()
+        if start_s is None or end_s is None or not text or start_s >= end_s:
+            logger.warning(f"Skipping segment with invalid time or text: Start={start_s}, End={end_s}, Text='{text}'")
+            return False
+
+        start_frame = seconds_to_frames(start_s, self.frame_rate)
+        # Ensure minimum duration of one frame for visibility in FCP
+        end_frame = max(start_frame + 1, seconds_to_frames(end_s, self.frame_rate))
+        self._last_frame = max(self._last_frame, end_frame)
+        style_id, is_new = self._style_ref(TITLE_FONT, self.font_size)
+        # Use first 30 chars (on one line) for the title name
+        name = text[:30].replace("\n", " ")
+
+        parts = [
+            f'<title name={_xml_attr(name)} lane="1" offset="{format_frames(start_frame, self.frame_rate)}" '
+            f'ref="r2" duration="{format_frames(end_frame - start_frame, self.frame_rate)}">\n',
+            f'<param name="Position" key="9999/999166631/999166633/1/100/101" value="{self._position}"/>\n',
+            f'<text>\n<text-style ref="{style_id}">{_xml_text(text)}</text-style>\n</text>\n',
+        ]
+        if is_new:
+            parts.append(
+                f'<text-style-def id="{style_id}">\n'
+                f'<text-style font={_xml_attr(TITLE_FONT)} fontSize="{self.font_size}" '
+                'fontColor="1 1 1 1" alignment="center"/>\n</text-style-def>\n'
+            )
+        parts.append("</title>\n")
+        self._fh.write("".join(parts))
+        self.title_count += 1
+        return True
+
+    def close(self):
+        """Writes the closing tags and patches the sequence duration to cover every title."""
+        fh = self._fh
+        fh.write("</gap>\n</spine>\n</sequence>\n</project>\n</event>\n</library>\n</fcpxml>\n")
+        # Cover the last subtitle plus a one-second buffer
+        needed = seconds_to_frames(math.ceil(self._last_frame / self.frame_rate) + 1, self.frame_rate) if self._last_frame else 0
+        if needed <= self._min_frames:
+            return
+        if len(self._duration_positions) != 2:
+            logger.warning("FCPXML output is not seekable; sequence duration may be shorter than the last title.")
+            return
+        end = fh.tell()
+        for position in self._duration_positions:
+            fh.seek(position)
+            fh.write(self._duration_attr(needed))
+        fh.seek(end)
+
+# --- write_fcpxml: セグメントを逐次 FCPXML としてファイルハンドルへ書き出す ---
+def write_fcpxml(segments, fh, width=1920, height=1080, frame_rate=24, font_size=65, duration=None):
+    """
+    Streams segments to ``fh`` as an FCPXML document (see ``FcpxmlWriter``).
+
+    Args:
+        segments: Iterable of segments (``utils.segments.Segment``, Whisper segments or dicts with 'start', 'end', 'text').
+        fh: Text file handle opened for writing (seekable for exact sequence durations).
+        frame_rate (Fraction | float | int): Timeline frame rate, e.g. ``Fraction(30000, 1001)``.
+        duration (float, optional): Minimum sequence duration in seconds (e.g. the video length).
+
+    Returns:
+        int: Number of titles written.
+    """
+    writer = FcpxmlWriter(fh, width, height, frame_rate, font_size, duration)
+    for segment in segments or ():
+        try:
+            writer.write(segment)
+        except TypeError:
+            logger.warning(f"Skipping invalid segment structure for FCPXML: {segment}")
+        except Exception as e:
+            logger.error(f"Error processing segment for FCPXML: {segment}. Error: {e}")
+    writer.close()
+    return writer.title_count
+
+# --- probe_fcpxml_format: 動画のプローブ結果から FCPXML の解像度・フレームレート・長さを決める ---
+def probe_fcpxml_format(video_path=None):
+    """
+    Returns ``(width, height, frame_rate, duration)`` for the timeline, using
+    video_path's probed metadata (see ``probe_media``) when available.
+    ``frame_rate`` is an exact ``Fraction`` for probed videos.
+    """
+    # --- Default video properties ---
+    width, height, frame_rate, duration = 1920, 1080, 24, 60.0
+    if video_path:
+        media = probe_media(video_path)
+        if media is None:
+            logger.warning(f"Probe failed for {video_path}. Using default metadata.")
+        elif not media.has_video:
+            logger.warning(f"No video stream found in probe for {video_path}. Using default metadata.")
+        else:
+            width = media.width
+            height = media.height
+            if media.frame_rate:
+                frame_rate = media.frame_rate
+            if media.duration:
+                duration = media.duration
+            logger.info(f"Probed video: {width}x{height}, Rate: {float(frame_rate):.3f} fps, Duration: {duration:.2f}s")
+    return width, height, frame_rate, duration
 
 # --- generate_fcpxml: Whisperセグメントを元に Final Cut Pro 用 FCPXML 文字列を生成 ---
 # Modified signature to accept font_size (defaulting to 65 now)
-def generate_fcpxml(segments, video_path=None, font_size=65): 
+def generate_fcpxml(segments, video_path=None, font_size=65):
     """
-    Generates FCPXML content string from Whisper segments.
-    Optionally probes video_path for accurate duration and frame rate.
+    Generates FCPXML content string from Whisper segments (see ``write_fcpxml``
+    for writing straight to a file).
+    Optionally uses video_path's probed metadata (see ``probe_media``) for accurate duration and frame rate.
 
     Args:
-        segments: Iterable of Whisper segment objects (or dicts) with 'start', 'end', 'text'.
+        segments: Iterable of segments (``utils.segments.Segment``, Whisper segments or dicts with 'start', 'end', 'text').
         video_path (str, optional): Path to the source video file for probing. Defaults to None.
         font_size (int, optional): Font size to apply to the titles. Defaults to 65.
 
     Returns:
         str: The generated FCPXML content as a string, or None if generation fails.
     """
+    segments = list(segments or ())
     if not segments:
         logger.warning("No subtitle segments provided for FCPXML generation.")
         return None
-
-    # --- Default video properties ---
-    width = 1920
-    height = 1080
-    frame_rate = 24.0 # Default frame rate
-    sequence_duration_s = 60.0 # Default duration in seconds
-
-    # --- Probe video for accurate properties if path is provided ---
-    if video_path:
-        try:
-            logger.info(f"Probing video for FCPXML metadata: {video_path}")
-            probe = ffmpeg.probe(video_path)
-            video_stream = next((s for s in probe['streams'] if s['codec_type'] == 'video'), None)
-            
-            if video_stream:
-                width = int(video_stream.get('width', width))
-                height = int(video_stream.get('height', height))
-                
-                # Get frame rate (may be fraction like '30000/1001')
-                r_frame_rate = video_stream.get('r_frame_rate')
-                if r_frame_rate and '/' in r_frame_rate:
-                    num, den = map(float, r_frame_rate.split('/'))
-                    if den != 0:
-                        frame_rate = num / den
-                elif 'avg_frame_rate' in video_stream and '/' in video_stream['avg_frame_rate']:
-                     num, den = map(float, video_stream['avg_frame_rate'].split('/'))
-                     if den != 0:
-                         frame_rate = num / den
-
-                # Get duration
-                duration_str = video_stream.get('duration')
-                if duration_str:
-                    try:
-                        sequence_duration_s = float(duration_str)
-                    except ValueError:
-                         logger.warning(f"Could not parse video duration '{duration_str}'. Using default.")
-                elif probe.get('format', {}).get('duration'):
-                     try:
-                         sequence_duration_s = float(probe['format']['duration'])
-                     except ValueError:
-                         logger.warning(f"Could not parse format duration '{probe['format']['duration']}'. Using default.")
-
-                logger.info(f"Probed video: {width}x{height}, Rate: {frame_rate:.2f} fps, Duration: {sequence_duration_s:.2f}s")
-            else:
-                logger.warning(f"No video stream found in probe for {video_path}. Using default metadata.")
-        except Exception as probe_err:
-            logger.warning(f"ffmpeg.probe failed for {video_path}: {probe_err}. Using default metadata.")
-
-    # Ensure sequence duration covers the last subtitle
-    last_segment_end = 0
+    width, height, frame_rate, duration = probe_fcpxml_format(video_path)
     try:
-        # Find the end time of the last segment
-        valid_segments = [s for s in segments if hasattr(s, 'end') or (isinstance(s, dict) and 'end' in s)]
-        if valid_segments:
-            last_segment_end = max(getattr(s, 'end', s.get('end', 0)) for s in valid_segments)
-        sequence_duration_s = max(sequence_duration_s, math.ceil(last_segment_end) + 1) # Add buffer
-    except Exception as e:
-        logger.warning(f"Could not determine last segment end time: {e}. Using probed/default duration.")
-
-    sequence_duration_frac = to_fractional_time(sequence_duration_s, frame_rate)
-    # Compute vertical margin as 5% of video height
-    margin_v = int(height * 0.05)
-    format_id = "r1"
-    effect_id = "r2" # Basic Title effect
-
-    # --- Build FCPXML Structure ---
-    fcpxml = Element('fcpxml', version="1.13")
-    
-    # Add comment about generation
-    fcpxml.append(Comment(f" Generated by Subtitle Tool on {datetime.now().isoformat()} "))
-
-    resources = SubElement(fcpxml, 'resources')
-    # Define format based on probed/default video properties
-    SubElement(resources, 'format', id=format_id, name=f"FFVideoFormat{height}p{frame_rate:.2f}",
-               frameDuration=f"{int(100000/frame_rate)}/100000s" if frame_rate else "100/2400s", # Approximate frame duration
-               width=str(width), height=str(height))
-    # Define the Basic Title effect (adjust uid if necessary for specific FCP versions)
-    SubElement(resources, 'effect', id=effect_id, name="Basic Title",
-               uid=".../Titles.localized/Bumper:Opener.localized/Basic Title.localized/Basic Title.moti")
-
-    library = SubElement(fcpxml, 'library')
-    event = SubElement(library, 'event', name="Subtitle Import")
-    project = SubElement(event, 'project', name="Generated Subtitles Project")
-    sequence = SubElement(project, 'sequence', duration=sequence_duration_frac, format=format_id, tcStart="0s", tcFormat="NDF") # NDF = Non-Drop Frame
-    spine = SubElement(sequence, 'spine')
-
-    # Create a gap that covers the entire sequence duration
-    gap = SubElement(spine, 'gap', name="Base Gap", offset="0s", duration=sequence_duration_frac, start="0s")
-
-    # Add titles (subtitles) within the gap
-    title_count = 0
-    for segment in segments:
-        try:
-            # Extract data (handle both objects and dicts)
-            if hasattr(segment, 'start') and hasattr(segment, 'end') and hasattr(segment, 'text'):
-                start_s = segment.start
-                end_s = segment.end
-                text = segment.text.strip()
-            elif isinstance(segment, dict) and 'start' in segment and 'end' in segment and 'text' in segment:
-                start_s = segment['start']
-                end_s = segment['end']
-                text = segment['text'].strip()
-            else:
-                logger.warning(f"Skipping invalid segment structure for FCPXML: {segment}")
-                continue
-
-            if start_s is None or end_s is None or text is None or start_s >= end_s:
-                 logger.warning(f"Skipping segment with invalid time or text: Start={start_s}, End={end_s}, Text='{text}'")
-                 continue
-
-            duration_s = end_s - start_s
-            offset_frac = to_fractional_time(start_s, frame_rate)
-            duration_frac = to_fractional_time(duration_s, frame_rate)
-            
-            # Ensure minimum duration for visibility in FCP
-            if duration_s < (1 / frame_rate):
-                 duration_frac = to_fractional_time(1 / frame_rate, frame_rate) # Min 1 frame duration
-
-            # Create the title element
-            title = SubElement(gap, 'title', name=text[:30], lane="1", # Use first 30 chars for name
-                               offset=offset_frac, ref=effect_id, duration=duration_frac)
-            
-            # Add text style definition (Basic Title uses this structure)
-            text_elem = SubElement(title, 'text')
-            text_style = SubElement(text_elem, 'text-style', ref=f"ts{title_count+1}") # Unique ref for style
-            text_style.text = text # Set the actual subtitle text here
-
-            # Define the text style properties (can be customized)
-            SubElement(title, 'text-style-def', id=f"ts{title_count+1}") # Matches ref above
-            # Add parameters for Basic Title (font, size, position, etc.) - Example:
-            SubElement(
-                title,
-                'param',
-                name="Position",
-                key="9999/999166631/999166633/1/100/101",
-                value=f"0 -{margin_v}"  # Center bottom-ish with dynamic margin
-            )
-            SubElement(title, 'param', name="Alignment", key="9999/999166631/999166633/1/100/100", value="1") # Center align = 1
-            SubElement(title, 'param', name="Font", key="9999/999166631/999166633/5/100/105", value="Meiryo")
-            # Use the provided font_size, ensuring it's an integer string
-            final_font_size_str = str(max(10, int(font_size))) # Ensure minimum size 10
-            SubElement(title, 'param', name="Size", key="9999/999166631/999166633/5/100/103", value=final_font_size_str)
-
-            title_count += 1
-        except Exception as e:
-            logger.error(f"Error processing segment for FCPXML: {segment}. Error: {e}")
-            continue # Skip segment on error
-
-    if title_count == 0:
-        logger.warning("No valid titles were added to the FCPXML spine.")
-        # Optionally return None or an empty structure
-        # return None 
-
-    # --- Serialize XML ---
-    try:
-        # Use io.StringIO to write XML to a string
-        xml_buffer = io.StringIO()
-        tree = ElementTree(fcpxml)
-        tree.write(xml_buffer, encoding='unicode', xml_declaration=True)
-        xml_str = xml_buffer.getvalue()
-        
-        # Use minidom for pretty printing (optional, adds indentation)
-        # parsed_xml = xml.dom.minidom.parseString(xml_str)
-        # pretty_xml_str = parsed_xml.toprettyxml(indent="  ", encoding="utf-8").decode('utf-8')
-        # return pretty_xml_str
-        
-        return xml_str # Return non-prettified XML string
-
+        buffer = io.StringIO()
+        if write_fcpxml(segments, buffer, width, height, frame_rate, font_size, duration) == 0:
+            logger.warning("No valid titles were added to the FCPXML spine.")
+        return buffer.getvalue()
     except Exception as e:
         logger.error(f"Error serializing FCPXML: {e}")
         return None
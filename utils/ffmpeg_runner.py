@@ -0,0 +1,190 @@
+"""
+Utility: ffmpeg_runner.py
+-------------------------
+Managed ffmpeg subprocess runner.
+
+``run_ffmpeg`` adds ``-progress pipe:1`` to the command and turns the
+key=value blocks ffmpeg writes there into ``FfmpegProgress`` snapshots
+(fps, speed, out_time, ETA). It supports cooperative cancellation through a
+``threading.Event`` and a wall-clock timeout, and keeps only the last lines
+of stderr in a bounded ring buffer instead of buffering all of it.
+"""
+
+import logging
+import subprocess
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Lines of ffmpeg stderr kept for error messages
+STDERR_TAIL_LINES = 200
+# Grace period between SIGTERM and SIGKILL when stopping ffmpeg
+TERMINATE_GRACE_SEC = 5.0
+
+
+class FfmpegError(RuntimeError):
+    """Raised when ffmpeg exits with an error; ``stderr`` holds the buffered tail."""
+
+    def __init__(self, message, returncode=None, stderr=""):
+        super().__init__(f"{message}\n{stderr}" if stderr else message)
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+class FfmpegCancelled(FfmpegError):
+    """Raised when the run was stopped through its cancel event."""
+
+
+class FfmpegTimeout(FfmpegError):
+    """Raised when the run exceeded its timeout."""
+
+
+@dataclass(frozen=True)
+class FfmpegProgress:
+    """One ``-progress`` block. ``total``/``pct``/``eta`` need the input duration."""
+    frame: int = 0
+    fps: float = 0.0
+    speed: Optional[float] = None
+    out_time: float = 0.0
+    total: Optional[float] = None
+    finished: bool = False
+
+    @property
+    def pct(self):
+        if not self.total:
+            return None
+        return 100.0 if self.finished else min(100.0, 100.0 * self.out_time / self.total)
+
+    @property
+    def eta(self):
+        """Estimated seconds until the end, from the realtime ``speed`` factor."""
+        if not self.total or not self.speed:
+            return None
+        return max(0.0, (self.total - self.out_time) / self.speed)
+
+    def __str__(self):
+        parts = [f"{self.out_time:.0f}s" + (f"/{self.total:.0f}s" if self.total else "")]
+        if self.fps:
+            parts.append(f"{self.fps:.1f} fps")
+        if self.speed:
+            parts.append(f"{self.speed:.2f}x")
+        if self.eta is not None:
+            minutes, seconds = divmod(int(self.eta), 60)
+            parts.append(f"ETA {minutes:02}:{seconds:02}")
+        return " / ".join(parts)
+
+
+def _parse_progress_block(fields, total):
+    def _float(value, default=0.0):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return default
+
+    out_time_us = fields.get("out_time_us") or fields.get("out_time_ms")  # both are microseconds
+    speed = fields.get("speed", "").rstrip("x")
+    return FfmpegProgress(
+        frame=int(_float(fields.get("frame"))),
+        fps=_float(fields.get("fps")),
+        speed=_float(speed, None) or None,
+        out_time=max(0.0, _float(out_time_us) / 1e6),
+        total=total,
+        finished=fields.get("progress") == "end",
+    )
+
+
+def _stop(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=TERMINATE_GRACE_SEC)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def run_ffmpeg(cmd, duration=None, on_progress=None, cancel_event=None, timeout=None):
+    """
+    Runs an ffmpeg command, reporting progress until it exits.
+
+    Args:
+        cmd (list[str]): Full command starting with ``"ffmpeg"``.
+        duration (float, optional): Expected output duration in seconds, for pct/ETA.
+        on_progress (callable, optional): Called with an ``FfmpegProgress`` for
+            every progress block, in the calling thread.
+        cancel_event (threading.Event, optional): Setting it stops ffmpeg.
+        timeout (float, optional): Wall-clock limit in seconds.
+
+    Returns:
+        str: The buffered stderr tail.
+
+    Raises:
+        FfmpegCancelled, FfmpegTimeout, FfmpegError: On cancellation, timeout or
+            a non-zero exit. ffmpeg is also stopped if ``on_progress`` raises.
+        FileNotFoundError: If ffmpeg is not installed.
+    """
+    cmd = [cmd[0], "-nostdin", "-nostats", "-progress", "pipe:1", *cmd[1:]]
+    proc = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        stdin=subprocess.DEVNULL,
+        text=True,
+        errors="replace",
+    )
+    stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+    stop_reason = []
+
+    def _drain_stderr():
+        for line in proc.stderr:
+            stderr_tail.append(line.rstrip("\n"))
+
+    def _watchdog():
+        deadline = time.monotonic() + timeout if timeout else None
+        while proc.poll() is None:
+            if cancel_event is not None and cancel_event.is_set():
+                stop_reason.append("cancelled")
+            elif deadline is not None and time.monotonic() >= deadline:
+                stop_reason.append("timeout")
+            if stop_reason:
+                _stop(proc)
+                return
+            if cancel_event is not None:
+                cancel_event.wait(0.2)
+            else:
+                time.sleep(0.2)
+
+    stderr_thread = threading.Thread(target=_drain_stderr, name="ffmpeg-stderr", daemon=True)
+    stderr_thread.start()
+    watchdog = None
+    if cancel_event is not None or timeout:
+        watchdog = threading.Thread(target=_watchdog, name="ffmpeg-watchdog", daemon=True)
+        watchdog.start()
+
+    try:
+        fields = {}
+        for line in proc.stdout:
+            key, _, value = line.strip().partition("=")
+            fields[key] = value
+            if key == "progress":
+                if on_progress is not None:
+                    on_progress(_parse_progress_block(fields, duration))
+                fields = {}
+        returncode = proc.wait()
+    finally:
+        # Never leave ffmpeg running behind an exception in the caller's callback
+        if proc.poll() is None:
+            _stop(proc)
+    stderr_thread.join(timeout=TERMINATE_GRACE_SEC)
+    stderr = "\n".join(stderr_tail)
+
+    if stop_reason and stop_reason[0] == "cancelled":
+        raise FfmpegCancelled("ffmpeg was cancelled", returncode, stderr)
+    if stop_reason:
+        raise FfmpegTimeout(f"ffmpeg timed out after {timeout}s", returncode, stderr)
+    if returncode != 0:
+        raise FfmpegError(f"ffmpeg exited with code {returncode}", returncode, stderr)
+    return stderr
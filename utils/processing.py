@@ -2,13 +2,41 @@
 
 This module centralises video downloading, audio conversion, transcription,
 translation and subtitle generation so that Streamlit UI remains lightweight.
+It does not depend on Streamlit: all user-facing output is published as
+typed events on an ``utils.events.EventBus``, so the same pipeline runs
+headless from ``utils.cli``.
 """
 
 # --- Imports (mirroring main.py's requirements) ---
-import streamlit as st
-from utils.video_utils import convert_to_wav
-from utils.whisper_utils import transcribe_with_faster_whisper
-from utils.translate_utils import translate_text_deepl, translate_text_gemini
+from utils.video_utils import convert_to_wav, load_audio, get_video_resolution, probe_media
+from utils.whisper_utils import (
+    transcribe_with_faster_whisper,
+    stream_transcribe_with_faster_whisper,
+    transcribe_chunked,
+    get_transcribe_pool,
+    DEFAULT_CHUNK_MINUTES,
+    DEFAULT_BATCH_SIZE,
+)
+from utils.async_translate import DEEPL_CONCURRENCY, translate_segments
+from utils.translate_utils import DEEPL_MAX_TEXTS_PER_REQUEST
+from utils.translation_memory import TranslationStats
+from utils.cache_utils import FileLRUCache
+from utils.time_utils import format_ass_ms, format_srt_ms, format_vtt_ms, seconds_to_ms
+from utils.ass_utils import format_ass_dialogue, generate_ass_header
+from utils.style_loader import load_styles
+from utils.events import (
+    EventBus,
+    ProgressAdapter,
+    Progress,
+    StageStarted,
+    StageFinished,
+    BytesDownloaded,
+    AudioDecoded,
+    EncodeProgress,
+    SegmentsTranslated,
+    PipelineWarning,
+    PipelineError,
+)
 import ffmpeg
 import os
 from urllib.parse import urlparse
@@ -23,61 +51,378 @@ import re
 from xml.etree.ElementTree import Element, SubElement, ElementTree
 import xml.dom.minidom
 import time
+import logging
+import hashlib
+import queue
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
-from utils.fcpxml_utils import generate_fcpxml
+from utils.fcpxml_utils import FcpxmlWriter, probe_fcpxml_format
+
+logger = logging.getLogger(__name__)
+
+# Output formats and their file extensions (several can be written in one run)
+SUBTITLE_EXTENSIONS = {"SRT": ".srt", "ASS": ".ass", "FCPXML": ".fcpxml", "VTT": ".vtt"}
+# ASS style from styles.json used for generated .ass files
+ASS_STYLE = "Meiryo"
+# Subtitle layout size when the input has no video stream (e.g. audio-only downloads)
+DEFAULT_CANVAS = (1920, 1080)
+
+# --- Progress sink ------------------------------------------------------
+class ProgressSink:
+    """Default progress sink that only logs.
+
+    Any object with the same ``update``/``warning``/``error`` methods can be
+    subscribed to the pipeline's ``EventBus`` through ``ProgressAdapter``
+    (e.g. the Streamlit ``ProgressManager`` in main.py or the console sink in
+    ``utils.cli``).
+    """
+
+    def update(self, pct: float, msg: str):
+        logger.info(f"[{pct:5.1f}%] {msg}")
+
+    def warning(self, msg: str):
+        logger.warning(msg)
+
+    def error(self, msg: str):
+        logger.error(msg)
+
+
+def _as_event_bus(events, expected_jobs=1):
+    """Returns ``events`` if it is an ``EventBus``; otherwise wraps a progress
+    sink (or the logging ``ProgressSink`` when ``None``) in a new bus."""
+    if isinstance(events, EventBus):
+        return events
+    bus = EventBus()
+    bus.subscribe(ProgressAdapter(events or ProgressSink(), expected_jobs=expected_jobs))
+    return bus
+
+
+def _publish_audio_decoded(events, job, lo, hi, seconds, total_seconds):
+    """``on_segment`` callback for Whisper workers (module-level so it pickles)."""
+    ratio = min(1.0, seconds / total_seconds) if total_seconds > 0 else 0.0
+    events.publish(
+        AudioDecoded(
+            job,
+            f"[{job}] 文字起こし中... {seconds:.0f}/{total_seconds:.0f}秒",
+            lo + (hi - lo) * ratio,
+            seconds=seconds,
+            total_seconds=total_seconds,
+        )
+    )
+
 
 # === Moved functions ===
 # --- Subtitle writers -------------------------------------------------
-def _format_timestamp(sec: float) -> str:
-    """sec (float) -> 'HH:MM:SS,mmm'"""
-    h, rem = divmod(sec, 3600)
-    m, s = divmod(rem, 60)
-    ms = int(round((s - int(s)) * 1000))
-    return f"{int(h):02}:{int(m):02}:{int(s):02},{ms:03}"
-
-def _write_srt(segments, out_path: Path):
-    """Write segments to .srt"""
-    with out_path.open("w", encoding="utf-8") as f:
-        for i, seg in enumerate(segments, 1):
-            start = _format_timestamp(seg.start)
-            end   = _format_timestamp(seg.end)
-            raw_text = getattr(seg, "text", "") or ""
-            text = raw_text.strip().replace("\n", " ")
-            f.write(f"{i}\n{start} --> {end}\n{text}\n\n")
-
-def _format_ass_timestamp(sec: float) -> str:
-    """sec (float) -> 'HH:MM:SS.cc' for ASS (centiseconds)"""
-    h, rem = divmod(sec, 3600)
-    m, s = divmod(rem, 60)
-    cs = int(round((s - int(s)) * 100))
-    return f"{int(h):02}:{int(m):02}:{int(s):02}.{cs:02}"
-
-def _write_ass(segments, out_path: Path, font_size: int):
-    """Write segments to .ass"""
-    with out_path.open("w", encoding="utf-8") as f:
-        # Script Info
-        f.write("[Script Info]\n")
-        f.write("ScriptType: v4.00+\n")
-        f.write("Collisions: Normal\n")
-        f.write("PlayResX: 1920\n")
-        f.write("PlayResY: 1080\n")
-        f.write("WrapStyle: 1\n")
-        f.write("\n")
-        # Styles
-        f.write("[V4+ Styles]\n")
-        f.write("Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, " 
-                "ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding\n")
-        f.write(f"Style: Default,Meiryo,{font_size},&H00FFFFFF,&H000000FF,&H00000000,&H64000000,0,0,0,0,100,100,0,0,1,2,0,2,15,15,10,1\n")
-        f.write("\n")
-        # Events
-        f.write("[Events]\n")
-        f.write("Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n")
+class _SrtWriter:
+    """Incremental .srt writer; every cue is flushed to disk as soon as it is written."""
+
+    def __init__(self, out_path: Path):
+        self._f = out_path.open("w", encoding="utf-8")
+        self._index = 0
+
+    def write(self, seg):
+        self._index += 1
+        start = format_srt_ms(seconds_to_ms(seg.start))
+        end = format_srt_ms(seconds_to_ms(seg.end))
+        raw_text = getattr(seg, "text", "") or ""
+        text = raw_text.strip().replace("\n", " ")
+        self._f.write(f"{self._index}\n{start} --> {end}\n{text}\n\n")
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+class _AssWriter:
+    """Incremental .ass writer; the styled header (see ``utils.ass_utils``) is written up front, then one Dialogue per segment."""
+
+    def __init__(self, out_path: Path, font_size: int, video_path=None):
+        styles = load_styles()
+        # generate_ass_header falls back to "Default" when the style is missing
+        self._style = ASS_STYLE if ASS_STYLE in styles else "Default"
+        width, height = _subtitle_canvas(video_path)
+        # utf-8-sig keeps Japanese text readable in players that sniff the encoding
+        self._f = out_path.open("w", encoding="utf-8-sig")
+        self._f.write(generate_ass_header(width, height, styles, self._style, False, font_size))
+        self._f.flush()
+
+    def write(self, seg):
+        start = format_ass_ms(seconds_to_ms(seg.start))
+        end = format_ass_ms(seconds_to_ms(seg.end))
+        self._f.write(format_ass_dialogue(start, end, getattr(seg, "text", "") or "", self._style))
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+class _VttWriter:
+    """Incremental WebVTT writer."""
+
+    def __init__(self, out_path: Path):
+        self._f = out_path.open("w", encoding="utf-8")
+        self._f.write("WEBVTT\n\n")
+        self._f.flush()
+
+    def write(self, seg):
+        start = format_vtt_ms(seconds_to_ms(seg.start))
+        end = format_vtt_ms(seconds_to_ms(seg.end))
+        raw_text = getattr(seg, "text", "") or ""
+        # A blank line would end the cue early; &, < and > are markup in cue text
+        text = raw_text.strip().replace("\n", " ").replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+        self._f.write(f"{start} --> {end}\n{text}\n\n")
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+class _FcpxmlWriter:
+    """Incremental .fcpxml writer; each segment is written as a title as soon as it arrives."""
+
+    def __init__(self, out_path: Path, video_path, font_size: int):
+        width, height, frame_rate, duration = probe_fcpxml_format(video_path)
+        self._f = out_path.open("w", encoding="utf-8")
+        self._writer = FcpxmlWriter(self._f, width, height, frame_rate, font_size, duration)
+
+    def write(self, seg):
+        self._writer.write(seg)
+        self._f.flush()
+
+    def close(self):
+        try:
+            self._writer.close()
+        finally:
+            self._f.close()
+
+class _UnsupportedWriter:
+    def __init__(self, out_path: Path):
+        # Unsupported format fallback
+        with out_path.open("w", encoding="utf-8") as f:
+            f.write("// 未対応フォーマット: ここに実装予定\n")
+
+    def write(self, seg):
+        pass
+
+    def close(self):
+        pass
+
+def _open_subtitle_writer(generate_format, out_path: Path, font_size: int, video_path=None):
+    """Returns an incremental writer (``write(seg)`` / ``close()``) for the format."""
+    fmt = generate_format.upper()
+    if fmt == "SRT":
+        return _SrtWriter(out_path)
+    if fmt == "ASS":
+        return _AssWriter(out_path, font_size, video_path)
+    if fmt == "FCPXML":
+        return _FcpxmlWriter(out_path, video_path, font_size)
+    if fmt == "VTT":
+        return _VttWriter(out_path)
+    return _UnsupportedWriter(out_path)
+
+class _MultiWriter:
+    """Fans every segment out to several format writers in one pass."""
+
+    def __init__(self, writers):
+        self._writers = writers
+
+    def write(self, seg):
+        for writer in self._writers:
+            writer.write(seg)
+
+    def close(self):
+        # Close every writer even if one fails, then re-raise the first error
+        error = None
+        for writer in self._writers:
+            try:
+                writer.close()
+            except Exception as e:
+                logger.error(f"Failed to close subtitle writer {type(writer).__name__}: {e}")
+                error = error or e
+        if error is not None:
+            raise error
+
+def _open_subtitle_writers(formats, output_paths, font_size: int, video_path=None):
+    """Opens one writer per format; returns a single writer that feeds them all."""
+    writers = []
+    try:
+        for fmt in formats:
+            writers.append(_open_subtitle_writer(fmt, output_paths[fmt], font_size, video_path))
+    except Exception:
+        _MultiWriter(writers).close()
+        raise
+    return writers[0] if len(writers) == 1 else _MultiWriter(writers)
+
+def _normalize_formats(generate_format):
+    """Accepts one format name or a list of them; returns unique upper-case names in order."""
+    if isinstance(generate_format, str):
+        generate_format = [generate_format]
+    return list(dict.fromkeys(fmt.upper() for fmt in generate_format))
+
+def _subtitle_canvas(video_path):
+    """Returns the (width, height) subtitles are laid out for; 1920x1080 without a video stream."""
+    media = probe_media(video_path) if video_path and os.path.isfile(video_path) else None
+    if media is None or not media.has_video or not media.width:
+        return DEFAULT_CANVAS
+    return media.width, media.height
+
+def bundle_subtitles(paths, zip_path):
+    """Writes ``paths`` into one zip archive (flat, by file name) and returns its path."""
+    zip_path = Path(zip_path)
+    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for path in paths:
+            zf.write(path, arcname=Path(path).name)
+    return zip_path
+
+# --- Streaming translation --------------------------------------------
+# Batches start small so the first subtitles are translated within seconds,
+# then double up to one full DeepL request (which also widens translation-
+# memory deduplication). A partially filled batch is sent once its first
+# segment has waited this long, whether or not more segments arrive. Up to
+# TRANSLATE_STREAM_IN_FLIGHT batches are translated concurrently, so the
+# provider rate limiters (not batch boundaries) bound the request rate.
+TRANSLATE_STREAM_FIRST_BATCH = 8
+TRANSLATE_STREAM_MAX_BATCH = DEEPL_MAX_TEXTS_PER_REQUEST
+TRANSLATE_STREAM_MAX_WAIT_SEC = 5.0
+TRANSLATE_STREAM_IN_FLIGHT = DEEPL_CONCURRENCY
+# How often finished batches are checked for while waiting for segments
+_STREAM_POLL_SEC = 0.1
+
+def _set_segment_text(seg, text):
+    """Returns a copy of ``seg`` with its text replaced.
+
+    Segments are never mutated: the untranslated ones are shared with the
+    transcription cache.
+    """
+    return seg.replace(text=text)
+
+class _StreamEnd:
+    """Queue marker for the end of the upstream segment stream (``error`` if it failed)."""
+
+    def __init__(self, error=None):
+        self.error = error
+
+def _pump_segments(segments, out_queue, stop):
+    """Moves segments from the upstream iterator onto ``out_queue`` until it ends or ``stop`` is set."""
+    try:
         for seg in segments:
-            start = _format_ass_timestamp(seg.start)
-            end = _format_ass_timestamp(seg.end)
-            raw_text = getattr(seg, "text", "") or ""
-            text = raw_text.strip().replace("\n", "\\N")
-            f.write(f"Dialogue: 0,{start},{end},Default,,0,0,0,,{text}\n")
+            if stop.is_set():
+                return
+            out_queue.put(seg)
+    except Exception as e:
+        out_queue.put(_StreamEnd(e))
+        return
+    out_queue.put(_StreamEnd())
+
+def _translate_stream(
+    segments,
+    source_lang_whisper,
+    target_lang_ui,
+    deepl_key,
+    gemini_key,
+    stats,
+    prefix="",
+    first_batch=TRANSLATE_STREAM_FIRST_BATCH,
+    max_batch=TRANSLATE_STREAM_MAX_BATCH,
+    max_wait=TRANSLATE_STREAM_MAX_WAIT_SEC,
+    in_flight=TRANSLATE_STREAM_IN_FLIGHT,
+    events=None,
+):
+    """Translates a segment stream in growing batches and yields translated segments in order.
+
+    The upstream iterator (usually Whisper's segment generator) is drained on
+    a background thread, so decoding continues while batches are being
+    translated and a partial batch is flushed after ``max_wait`` seconds even
+    when no further segment arrives. Batch sizes start at ``first_batch`` and
+    double up to ``max_batch``; up to ``in_flight`` batches are translated
+    concurrently and their segments are yielded in stream order.
+
+    After each batch a ``SegmentsTranslated`` event with the running count is
+    published to ``events`` (the total is unknown while the stream is open).
+    """
+    done = 0
+    reported_errors = set()
+    # (batch, batch stats, future) in stream order
+    running = deque()
+    executor = ThreadPoolExecutor(max_workers=max(1, in_flight), thread_name_prefix=f"translate-{prefix}")
+
+    def _submit(batch):
+        # Per-batch stats: concurrent batches must not update one object
+        batch_stats = TranslationStats()
+        future = executor.submit(
+            translate_segments,
+            [seg.text for seg in batch],
+            source_lang_whisper,
+            target_lang_ui,
+            deepl_api_key=deepl_key,
+            gemini_api_key=gemini_key,
+            stats=batch_stats,
+        )
+        running.append((batch, batch_stats, future))
+
+    def _collect():
+        nonlocal done
+        batch, batch_stats, future = running.popleft()
+        translations, err = future.result()
+        if stats is not None:
+            stats.add(batch_stats)
+        if err:
+            logger.warning(f"[{prefix}] Translation issues: {err}")
+            # e.g. why DeepL was skipped; shown once per distinct message
+            if events is not None and err not in reported_errors:
+                reported_errors.add(err)
+                events.publish(PipelineWarning(prefix, f"[{prefix}] 翻訳エラー: {err}"))
+        done += len(batch)
+        if events is not None:
+            events.publish(SegmentsTranslated(prefix, f"[{prefix}] {done} セグメント翻訳済み", done=done))
+        for seg, text_translated in zip(batch, translations):
+            yield _set_segment_text(seg, text_translated)
+
+    pending = queue.Queue()
+    stop = threading.Event()
+    threading.Thread(
+        target=_pump_segments, args=(segments, pending, stop), name=f"segments-{prefix}", daemon=True
+    ).start()
+
+    batch_size = first_batch
+    error = None
+    finished = False
+    try:
+        while not finished:
+            batch = []
+            deadline = None
+            while len(batch) < batch_size:
+                while running and running[0][2].done():
+                    yield from _collect()
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                if running:
+                    timeout = _STREAM_POLL_SEC if timeout is None else min(timeout, _STREAM_POLL_SEC)
+                try:
+                    item = pending.get(timeout=timeout)
+                except queue.Empty:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        break  # The oldest segment has waited max_wait: send what we have
+                    continue
+                if isinstance(item, _StreamEnd):
+                    error, finished = item.error, True
+                    break
+                if deadline is None:
+                    deadline = time.monotonic() + max_wait
+                batch.append(item)
+            if batch:
+                _submit(batch)
+                batch_size = min(max_batch, batch_size * 2)
+            while len(running) >= max(1, in_flight):
+                yield from _collect()
+        while running:
+            yield from _collect()
+        if error is not None:
+            raise error
+    finally:
+        # Lets the pump thread exit if the consumer stops early
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
 
 def is_valid_url(url):
     """Checks if a string is a valid HTTP/HTTPS URL."""
@@ -92,17 +437,135 @@ def check_local_file(path):
     return os.path.isfile(path) and os.access(path, os.R_OK)
 
 
-def download_video(url, output_dir="./", prefix=""):
+class _DownloadMonitor:
+    """yt-dlp progress hook that publishes ``BytesDownloaded`` events and
+    totals the bytes transferred over every file of one download."""
+
+    def __init__(self, events, job, pct_range):
+        self.events = events
+        self.job = job
+        self.lo, self.hi = pct_range
+        self.started = time.monotonic()
+        self._bytes = {}
+
+    @property
+    def total_bytes(self):
+        return sum(self._bytes.values())
+
+    def __call__(self, d):
+        name = d.get("filename", "")
+        if d["status"] == "downloading":
+            downloaded = d.get("downloaded_bytes") or 0
+            total = d.get("total_bytes") or d.get("total_bytes_estimate")
+            self._bytes[name] = downloaded
+            percent = 100.0 * downloaded / total if total else 0.0
+            self.events.publish(
+                BytesDownloaded(
+                    self.job,
+                    f"Downloading… {d.get('_percent_str', '').strip()}",
+                    self.lo + (self.hi - self.lo) * min(percent, 100.0) / 100,
+                    downloaded=downloaded,
+                    total=total,
+                )
+            )
+        elif d["status"] == "finished":
+            self._bytes[name] = d.get("total_bytes") or d.get("downloaded_bytes") or self._bytes.get(name, 0)
+
+    def finish(self):
+        """Publishes and returns ``(bytes_transferred, elapsed_sec)`` for the whole download."""
+        elapsed = time.monotonic() - self.started
+        msg = f"Download completed: {self.total_bytes / 1e6:.1f} MB in {elapsed:.1f}s"
+        logger.info(f"[{self.job}] {msg}")
+        self.events.publish(Progress(self.job, msg, self.hi))
+        return self.total_bytes, elapsed
+
+
+# --- Download cache ----------------------------------------------------
+# Downloads are cached by extractor + video id + requested format, so the same
+# URL in a later batch (or in the burn tab) is not fetched again.
+DOWNLOAD_CACHE = FileLRUCache(
+    os.environ.get("DOWNLOAD_CACHE_DIR", "./.cache/downloads"),
+    max_bytes=int(os.environ.get("DOWNLOAD_CACHE_MAX_MB", "10240")) * 1024 * 1024,
+    verify_hash=os.environ.get("DOWNLOAD_CACHE_VERIFY", "0") == "1",
+)
+
+
+def download_cache_key(info, requested_format):
+    """Builds a filesystem-safe cache key from a yt_dlp info dict and the requested format."""
+    extractor = re.sub(r"[^A-Za-z0-9_-]", "_", info.get("extractor_key") or info.get("extractor") or "generic")
+    video_id = re.sub(r"[^A-Za-z0-9_-]", "_", str(info.get("id") or info.get("webpage_url") or ""))
+    format_tag = hashlib.sha256(requested_format.encode()).hexdigest()[:12]
+    return f"{extractor}-{video_id}-{format_tag}"
+
+
+def _cached_download(url, ydl_opts, job, events):
+    """Downloads ``url`` with ``ydl_opts`` through ``DOWNLOAD_CACHE`` and returns the job's own path.
+
+    The info dict is extracted once without downloading to build the cache
+    key; on a miss the same info dict is then processed for the download.
+    The returned file lives at the ``outtmpl`` location and is hard-linked
+    with the cache entry, so evicting the entry (by this or a parallel job)
+    never removes a file a job is still using.
+    """
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+        key = download_cache_key(info, ydl_opts["format"])
+        cached = DOWNLOAD_CACHE.get(key)
+        if cached is not None:
+            job_path = ydl_opts["outtmpl"].replace("%(ext)s", cached.suffix.lstrip("."))
+            try:
+                job_path = DOWNLOAD_CACHE.checkout(cached, job_path)
+            except FileNotFoundError:
+                logger.info(f"[{job}] Cached file {cached.name} was evicted; downloading again")
+            else:
+                logger.info(f"[{job}] Download cache hit for {url} ({cached.name})")
+                events.publish(Progress(job, f"キャッシュ済みのファイルを使用: {cached.name}"))
+                return str(job_path)
+        info = ydl.process_ie_result(info, download=True)
+        downloads = info.get("requested_downloads") or []
+        output_path = downloads[0].get("filepath") if downloads else None
+        output_path = output_path or ydl.prepare_filename(info)
+    DOWNLOAD_CACHE.put(key, output_path, url=url, format=ydl_opts["format"])
+    return output_path
+
+
+def download_audio(url, output_dir="./", prefix="", events=None, job="", pct_range=(0.0, 100.0)):
+    """
+    Downloads only the best audio stream of a URL using yt_dlp and returns the local path.
+
+    No merge or convert postprocessors run: the file keeps the container the
+    site serves (m4a, webm, ...), which ffmpeg decodes directly. This is what
+    subtitle generation needs; the full video is only fetched for burning.
+    The file is saved in ``output_dir`` and shared with ``DOWNLOAD_CACHE``
+    through a hard link. Progress, bytes transferred and elapsed time are published to ``events``.
+    """
+    events = _as_event_bus(events)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    monitor = _DownloadMonitor(events, job, pct_range)
+    ydl_opts = {
+        "outtmpl": os.path.join(output_dir, f"{prefix}{timestamp}.%(ext)s"),
+        "format": "bestaudio/best",
+        "quiet": True,
+        "progress_hooks": [monitor],
+    }
+    output_path = _cached_download(url, ydl_opts, job, events)
+    monitor.finish()
+    return output_path
+
+
+def download_video(url, output_dir="./", prefix="", events=None, job="", pct_range=(0.0, 100.0)):
     """
     Downloads a video from a URL using yt_dlp and returns the local path and video resolution as (path, width, height).
-    Shows progress in Streamlit while downloading.
+    The file is saved in ``output_dir`` and shared with ``DOWNLOAD_CACHE`` through a hard link.
+    Progress is published to ``events`` as ``BytesDownloaded`` events for ``job``, with
+    ``pct`` mapped into ``pct_range``; format fallbacks are published as ``PipelineWarning``.
     """
+    events = _as_event_bus(events)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{prefix}{timestamp}.mp4"
-    output_path = os.path.join(output_dir, filename)
+    monitor = _DownloadMonitor(events, job, pct_range)
 
     ydl_opts = {
-        "outtmpl": output_path,
+        "outtmpl": os.path.join(output_dir, f"{prefix}{timestamp}.%(ext)s"),
         "format": "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best",
         "merge_output_format": "mp4",
         "postprocessors": [
@@ -110,75 +573,40 @@ def download_video(url, output_dir="./", prefix=""):
             {"key": "FFmpegVideoConvertor", "preferedformat": "mp4"},
         ],
         "quiet": True,
-        "progress_hooks": [],
+        "progress_hooks": [monitor],
     }
 
-    # Streamlit progress bar
-    progress_bar = st.progress(0)
-    progress_text = st.empty()
-
-    def progress_hook(d):
-        if d["status"] == "downloading":
-            progress = d.get("_percent_str", "").strip()
-            try:
-                percent = float(progress.replace("%", ""))
-                progress_bar.progress(min(max(percent / 100.0, 0.0), 1.0))
-                progress_text.text(f"Downloading… {progress}")
-            except ValueError:
-                pass
-        elif d["status"] == "finished":
-            progress_bar.progress(1.0)
-            progress_text.text("Download completed")
-
-    ydl_opts["progress_hooks"].append(progress_hook)
-
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            try:
-                ydl.download([url])
-            except yt_dlp.utils.DownloadError as e:
-                # Fallback when requested MP4 is not available
-                if "Requested format is not available" in str(e):
-                    st.warning("MP4 が取得できなかったため汎用フォーマットで再試行します")
-                    ydl_opts["format"] = "bestvideo+bestaudio/best"
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl_retry:
-                        ydl_retry.download([url])
-                else:
-                    raise
-        # Get video resolution using ffmpeg.probe
         try:
-            info = ffmpeg.probe(output_path)
-            vid_stream = next(s for s in info["streams"] if s.get("codec_type") == "video")
-            width = vid_stream.get("width", 0)
-            height = vid_stream.get("height", 0)
-        except Exception:
-            width, height = 0, 0
-        return output_path, width, height
+            output_path = _cached_download(url, ydl_opts, job, events)
+        except yt_dlp.utils.DownloadError as e:
+            # Fallback when requested MP4 is not available
+            if "Requested format is not available" in str(e):
+                events.publish(PipelineWarning(job, "MP4 が取得できなかったため汎用フォーマットで再試行します"))
+                ydl_opts["format"] = "bestvideo+bestaudio/best"
+                output_path = _cached_download(url, ydl_opts, job, events)
+            else:
+                raise
     except KeyError as e:
         # Merge時のKeyErrorをキャッチして単純なbestフォーマットで再試行
-        st.warning(f"フォーマット処理中にエラーが発生したため、ベストフォーマットで再試行します: {e}")
-        simple_opts = {"outtmpl": output_path, "format": "best", "quiet": True}
-        with yt_dlp.YoutubeDL(simple_opts) as ydl_simple:
-            ydl_simple.download([url])
-        # Probe resolution for fallback file
-        try:
-            info = ffmpeg.probe(output_path)
-            vid_stream = next(s for s in info["streams"] if s.get("codec_type") == "video")
-            width = vid_stream.get("width", 0)
-            height = vid_stream.get("height", 0)
-        except Exception:
-            width, height = 0, 0
-        return output_path, width, height
-    
-    finally:
-        progress_bar.empty()
-        progress_text.empty()
+        events.publish(PipelineWarning(job, f"フォーマット処理中にエラーが発生したため、ベストフォーマットで再試行します: {e}"))
+        simple_opts = {
+            "outtmpl": ydl_opts["outtmpl"],
+            "format": "best",
+            "quiet": True,
+            "progress_hooks": [monitor],
+        }
+        output_path = _cached_download(url, simple_opts, job, events)
+    monitor.finish()
+    # Resolution comes from the shared probe cache, so later callers do not probe again
+    width, height = get_video_resolution(output_path)
+    return output_path, width, height
 
 
 def process_video(
     video_input,
     idx,
-    progress_manager,
+    events,
     subtitle_ext,
     generate_format,
     output_language,          # ← NEW
@@ -187,161 +615,267 @@ def process_video(
     manual_font_size,
     deepl_key,
     gemini_key,
+    transcribe_executor=None,
+    output_dir="./generated_subs",
+    worker_events=None,
 ):
     """Processes a single video: download (if URL), convert, transcribe,
-    translate, generate subtitle content in memory."""
+    translate, generate subtitle content in memory.
+
+    Progress is published to ``events`` (an ``EventBus``, or a plain progress
+    sink that gets wrapped in one) under the job id ``prefix``.
+
+    When ``transcribe_executor`` is given (see ``main_process``), the Whisper
+    decode is submitted to it instead of running in the calling thread;
+    ``worker_events`` is then the picklable publisher the worker process
+    reports ``AudioDecoded`` events through.
+
+    ``generate_format`` may also be a list of formats (see
+    ``SUBTITLE_EXTENSIONS``): every format is then written from the same
+    segment stream in a single pass, and the files are bundled into one zip
+    archive (``bundle`` in the result). ``subtitle_ext`` only applies to a
+    single format."""
+    events = _as_event_bus(events)
     video_start_time = time.time()
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     prefix = f"{idx:02}_{timestamp}"
-    output_filename = f"{prefix}{subtitle_ext}"
+    formats = _normalize_formats(generate_format)
+    if len(formats) == 1 and subtitle_ext:
+        output_filenames = {formats[0]: f"{prefix}{subtitle_ext}"}
+    else:
+        output_filenames = {fmt: f"{prefix}{SUBTITLE_EXTENSIONS.get(fmt, '.txt')}" for fmt in formats}
     temp_wav_path = f"./{prefix}_temp.wav"
-    downloaded_video_path = None
-    audio_path_for_whisper = None
+    fetched_audio_only = False
     video_path = None
 
-    progress_manager.update(0, f"[{prefix}] 処理開始: {video_input}")
-    download_status_placeholder = st.empty()
+    def _stage_started(stage, pct, msg):
+        events.publish(StageStarted(prefix, f"[{prefix}] {msg}", pct, stage=stage))
+        return time.monotonic()
+
+    def _stage_finished(stage, started, pct, msg):
+        events.publish(
+            StageFinished(prefix, f"[{prefix}] {msg}", pct, stage=stage, elapsed=time.monotonic() - started)
+        )
+
+    def _fail(msg):
+        events.publish(PipelineError(prefix, f"[{prefix}] {msg}"))
+        return None
+
+    events.publish(Progress(prefix, f"[{prefix}] 処理開始: {video_input}", 0))
 
     try:
         # 1. Download or open local
-        if is_valid_url(video_input):
-            progress_manager.update(5, f"[{prefix}] URLから動画をダウンロード準備中...")
-            video_path, video_width, video_height = download_video(video_input, prefix=f"{prefix}_")
-            downloaded_video_path = video_path
-            progress_manager.update(
-                15,
-                f"[{prefix}] ダウンロード完了: {os.path.basename(video_path)}",
+        if is_valid_url(video_input) and "FCPXML" in formats:
+            # FCPXML probes the video stream for frame rate and resolution
+            started = _stage_started("download", 5, "URLから動画をダウンロード準備中...")
+            video_path, video_width, video_height = download_video(
+                video_input,
+                prefix=f"{prefix}_",
+                events=events,
+                job=prefix,
+                pct_range=(5, 15),
+            )
+            _stage_finished("download", started, 15, f"ダウンロード完了: {os.path.basename(video_path)}")
+        elif is_valid_url(video_input):
+            # Only the audio is needed here; the burn tab fetches the video lazily from the URL
+            started = _stage_started("download", 5, "URLから音声をダウンロード準備中...")
+            video_path = download_audio(
+                video_input,
+                prefix=f"{prefix}_",
+                events=events,
+                job=prefix,
+                pct_range=(5, 15),
             )
+            fetched_audio_only = True
+            _stage_finished("download", started, 15, f"音声ダウンロード完了: {os.path.basename(video_path)}")
         elif check_local_file(video_input):
             video_path = video_input
-            progress_manager.update(
-                15,
-                f"[{prefix}] ローカルファイルを使用: {os.path.basename(video_path)}",
+            events.publish(
+                Progress(prefix, f"[{prefix}] ローカルファイルを使用: {os.path.basename(video_path)}", 15)
             )
         else:
-            st.error(f"[{prefix}] 入力が URL でも既存ファイルでもありません: {video_input}")
-            return None
-
-        # 2. Convert to WAV if necessary
-        if not video_path.lower().endswith(".wav"):
-            progress_manager.update(20, f"[{prefix}] 音声ファイルをWAV形式に変換中...")
-            audio_path_for_whisper = convert_to_wav(video_path, temp_wav_path)
-            if not audio_path_for_whisper:
-                return None
-            progress_manager.update(
-                35,
-                f"[{prefix}] WAV変換完了: {os.path.basename(audio_path_for_whisper)}",
+            return _fail(f"入力が URL でも既存ファイルでもありません: {video_input}")
+
+        # 2. Decode audio in memory (temp WAV only when explicitly requested)
+        if video_path.lower().endswith(".wav"):
+            audio_for_whisper = video_path
+            events.publish(Progress(prefix, f"[{prefix}] 入力はWAVファイルのため、変換をスキップ。", 35))
+        elif whisper_config.get("use_temp_wav", False):
+            started = _stage_started("decode", 20, "音声ファイルをWAV形式に変換中...")
+            audio_for_whisper = convert_to_wav(
+                video_path,
+                temp_wav_path,
+                on_progress=lambda p: events.publish(
+                    EncodeProgress(
+                        prefix,
+                        f"[{prefix}] WAV変換中... {p}",
+                        20 + 15 * (p.pct or 0) / 100,
+                        fps=p.fps,
+                        speed=p.speed,
+                        out_time=p.out_time,
+                        eta=p.eta,
+                    )
+                ),
             )
+            if not audio_for_whisper:
+                return _fail("WAV変換に失敗しました。")
+            _stage_finished("decode", started, 35, f"WAV変換完了: {os.path.basename(audio_for_whisper)}")
         else:
-            audio_path_for_whisper = video_path
-            progress_manager.update(
-                35, f"[{prefix}] 入力はWAVファイルのため、変換をスキップ。"
-            )
+            started = _stage_started("decode", 20, "音声をメモリ上にデコード中...")
+            audio_for_whisper = load_audio(video_path)
+            if audio_for_whisper is None:
+                return _fail("音声のデコードに失敗しました。")
+            _stage_finished("decode", started, 35, f"音声デコード完了: {len(audio_for_whisper) / 16000:.1f}秒")
 
-        # 3. Transcribe
-        progress_manager.update(
-            40,
-            f"[{prefix}] Whisperモデル ({whisper_config['model_size']}) 読み込み＆文字起こし中...",
+        # 3. Transcribe (streaming: segments flow on as soon as Whisper emits them)
+        transcribe_started = _stage_started(
+            "transcribe", 40, f"Whisperモデル ({whisper_config['model_size']}) 読み込み＆文字起こし中..."
         )
-        segments, info = transcribe_with_faster_whisper(
-            audio_path_for_whisper,
+        transcribe_args = (
+            audio_for_whisper,
             whisper_config["model_size"],
             "cpu",
             "int8",
             whisper_config["beam_size"],
         )
-        if segments is None:
-            return None
-        progress_manager.update(
-            80,
-            f"[{prefix}] 文字起こし完了。言語: {info.language} ({info.language_probability:.2f})",
+        transcribe_mode = whisper_config.get("mode", "sequential")
+        transcribe_kwargs = {}
+        if transcribe_mode == "batched":
+            transcribe_kwargs = {
+                "mode": "batched",
+                "batch_size": whisper_config.get("batch_size", DEFAULT_BATCH_SIZE),
+            }
+        # Streaming decodes while writing (45–95%); list-based modes decode up front (40–85%)
+        write_range = (45, 95)
+        if transcribe_mode == "chunked":
+            # Chunks are fanned out over the shared process pool from this thread
+            segments, info = transcribe_chunked(
+                *transcribe_args,
+                chunk_minutes=whisper_config.get("chunk_minutes", DEFAULT_CHUNK_MINUTES),
+            )
+            if segments is None:
+                return _fail("文字起こしに失敗しました。")
+            segment_stream = iter(segments)
+            write_range = (85, 95)
+        elif transcribe_executor is not None:
+            # Generators cannot cross the process boundary; stream the finished list instead
+            if worker_events is not None:
+                transcribe_kwargs["on_segment"] = partial(_publish_audio_decoded, worker_events, prefix, 40, 85)
+            segments, info = transcribe_executor.submit(
+                transcribe_with_faster_whisper, *transcribe_args, **transcribe_kwargs
+            ).result()
+            if segments is None:
+                return _fail("文字起こしに失敗しました。")
+            segment_stream = iter(segments)
+            write_range = (85, 95)
+        else:
+            try:
+                segment_stream, info = stream_transcribe_with_faster_whisper(
+                    *transcribe_args, **transcribe_kwargs
+                )
+            except Exception as e:
+                logger.exception(f"[{prefix}] Failed to start transcription: {e}")
+                return _fail(f"文字起こしを開始できませんでした: {e}")
+        del audio_for_whisper
+        events.publish(
+            Progress(
+                prefix,
+                f"[{prefix}] 文字起こし中。言語: {info.language} ({info.language_probability:.2f})",
+                write_range[0],
+            )
         )
+
         # 4. Translate (if target language differs)
         target_lang_ui = output_language
         source_lang_whisper = info.language
+        tm_stats = None
 
         if (
             target_lang_ui
             and target_lang_ui not in ["", source_lang_whisper]
         ):
-            progress_manager.update(
-                82,
-                f"[{prefix}] {source_lang_whisper} -> {target_lang_ui} 翻訳中...",
+            tm_stats = TranslationStats()
+            translate_started = _stage_started("translate", None, f"翻訳開始: {source_lang_whisper} → {target_lang_ui}")
+            segment_stream = _translate_stream(
+                segment_stream,
+                source_lang_whisper,
+                target_lang_ui,
+                deepl_key,
+                gemini_key,
+                tm_stats,
+                prefix,
+                events=events,
             )
-            translated_segments = []
-            for seg_idx, seg in enumerate(segments, 1):
-                try:
-                    text_translated, err = translate_text_deepl(
-                        seg.text,
-                        source_lang_whisper,
-                        target_lang_ui,
-                        deepl_api_key=deepl_key,
-                    )
-                    if text_translated is None:
-                        raise RuntimeError(err or "DeepL translation failed")
-                except Exception:
-                    # Fallback to Gemini
-                    text_translated, _ = translate_text_gemini(
-                        seg.text,
-                        source_lang_whisper,
-                        target_lang_ui,
-                        gemini_api_key=gemini_key,
+
+        # 5. 字幕ファイルの生成と保存（セグメントごとに逐次書き出し）
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        output_paths = {fmt: output_dir / name for fmt, name in output_filenames.items()}
+        output_path = output_paths[formats[0]]
+        output_names = ", ".join(path.name for path in output_paths.values())
+
+        duration = info.duration or 0
+        segments = []
+        lo, hi = write_range
+        write_started = _stage_started("write", None, f"字幕書き出し開始: {output_names}")
+        writer = _open_subtitle_writers(formats, output_paths, manual_font_size, video_path)
+        try:
+            for seg in segment_stream:
+                writer.write(seg)
+                segments.append(seg)
+                if duration > 0:
+                    events.publish(
+                        AudioDecoded(
+                            prefix,
+                            f"[{prefix}] 字幕生成中... {seg.end:.0f}/{duration:.0f}秒 ({len(segments)} セグメント)",
+                            lo + (hi - lo) * min(1.0, seg.end / duration),
+                            seconds=seg.end,
+                            total_seconds=duration,
+                        )
                     )
-                # Update text
-                try:
-                    seg.text = text_translated
-                except AttributeError:
-                    seg = seg._replace(text=text_translated)  # namedtuple case
-                translated_segments.append(seg)
-
-                progress_manager.update(
-                    82 + int(3 * seg_idx / len(segments)),
-                    f"[{prefix}] 翻訳中... ({seg_idx}/{len(segments)})",
-                )
-            segments = translated_segments
-            progress_manager.update(85, f"[{prefix}] 翻訳完了。")
-        else:
-            progress_manager.update(85, f"[{prefix}] 翻訳スキップ。")
-
-        # 5. 字幕ファイルの生成と保存
-        output_dir = Path("./generated_subs")
-        output_dir.mkdir(exist_ok=True)
-        output_path = output_dir / output_filename
-
-        if generate_format.upper() == "SRT":
-            _write_srt(segments, output_path)
-        elif generate_format.upper() == "ASS":
-            _write_ass(segments, output_path, manual_font_size)
-        elif generate_format.upper() == "FCPXML":
-            # FCPXML writer using fcpxml_utils
-            xml_content = generate_fcpxml(segments, video_path, manual_font_size)
-            if xml_content:
-                with output_path.open("w", encoding="utf-8") as f:
-                    f.write(xml_content)
-            else:
-                with output_path.open("w", encoding="utf-8") as f:
-                    f.write('<?xml version="1.0"?><fcpxml></fcpxml>')
+        except Exception as e:
+            logger.error(f"[{prefix}] Error during transcription/translation: {e}")
+            logger.exception("Detailed traceback for streaming pipeline error:")
+            return _fail(f"文字起こし／翻訳中にエラーが発生しました: {e}")
+        finally:
+            writer.close()
+        _stage_finished("transcribe", transcribe_started, None, f"文字起こし完了: {len(segments)} セグメント")
+        _stage_finished("write", write_started, None, f"字幕書き出し完了: {output_names}")
+
+        bundle_path = None
+        if len(output_paths) > 1:
+            bundle_path = bundle_subtitles(output_paths.values(), output_dir / f"{prefix}_subtitles.zip")
+
+        if tm_stats is not None:
+            logger.info(f"[{prefix}] Translation memory: {tm_stats}")
+            _stage_finished(
+                "translate",
+                translate_started,
+                95,
+                f"翻訳完了。（翻訳メモリ: ヒット {tm_stats.hits} / ミス {tm_stats.misses} / 重複 {tm_stats.duplicates} / Gemini 補完 {tm_stats.fallbacks}）",
+            )
         else:
-            # Unsupported format fallback
-            with output_path.open("w", encoding="utf-8") as f:
-                f.write("// 未対応フォーマット: ここに実装予定\n")
+            events.publish(Progress(prefix, f"[{prefix}] 翻訳スキップ。", 95))
 
-        # 5. 戻り値として生成したバイナリ/パスなどを返す
+        events.publish(
+            Progress(prefix, f"[{prefix}] 完了 ({time.time() - video_start_time:.1f}秒)", 100)
+        )
+
+        # 6. 戻り値として生成したバイナリ/パスなどを返す
         return {
             "prefix": prefix,
             "segments": segments,
             "info": info,
             "output_filename": str(output_path),
-            "video_path": video_path,
+            "output_files": {fmt: str(path) for fmt, path in output_paths.items()},
+            "bundle": str(bundle_path) if bundle_path else None,
+            # URL inputs keep the URL when only the audio was fetched, so burning downloads the video
+            "video_path": video_input if fetched_audio_only else video_path,
+            "language": target_lang_ui or source_lang_whisper,
         }
 
     finally:
-        # Cleanup
-        # if downloaded_video_path and os.path.exists(downloaded_video_path):
-        #     try:
-        #         os.remove(downloaded_video_path)
-        #     except OSError:
-        #         pass
+        # Cleanup (downloads stay in DOWNLOAD_CACHE)
         if os.path.exists(temp_wav_path):
             try:
                 os.remove(temp_wav_path)
@@ -351,7 +885,7 @@ def process_video(
 
 def main_process(
     video_inputs,
-    progress_manager,
+    events,
     subtitle_ext,
     generate_format,
     output_language,          # ← NEW
@@ -360,23 +894,90 @@ def main_process(
     manual_font_size,
     deepl_key,
     gemini_key,
+    max_workers=1,
+    output_dir="./generated_subs",
+    thread_initializer=None,
 ):
-    """Handles a list of video_inputs sequentially by calling process_video()."""
-    results = []
-    for idx, video_input in enumerate(video_inputs, start=1):
-        res = process_video(
-            video_input,
-            idx,
-            progress_manager,
-            subtitle_ext,
-            generate_format,
-            output_language,          # ← PASS THROUGH
-            whisper_config,
-            auto_font_size_enabled,
-            manual_font_size,
-            deepl_key,
-            gemini_key,
-        )
-        if res:
-            results.append(res)
+    """Handles a list of video_inputs by calling process_video().
+
+    ``events`` is the ``EventBus`` every job publishes to; a plain progress
+    sink is accepted too and wrapped in a ``ProgressAdapter`` that averages
+    progress over all inputs.
+
+    With ``max_workers`` > 1 the files are processed in parallel: download,
+    ffmpeg and translation run on a bounded thread pool, while Whisper decoding
+    goes to a process pool capped at the CPU core count (worker processes
+    report through ``EventBus.process_channel``). Results keep the order of
+    ``video_inputs``. In both modes a failure in one file is published as a
+    ``PipelineError`` and does not affect the others.
+    ``thread_initializer`` runs in each worker thread (the Streamlit
+    front-end uses it to attach its script context).
+    """
+    events = _as_event_bus(events, expected_jobs=len(video_inputs))
+
+    if max_workers <= 1 or len(video_inputs) <= 1:
+        results = []
+        for idx, video_input in enumerate(video_inputs, start=1):
+            try:
+                res = process_video(
+                    video_input,
+                    idx,
+                    events,
+                    subtitle_ext,
+                    generate_format,
+                    output_language,          # ← PASS THROUGH
+                    whisper_config,
+                    auto_font_size_enabled,
+                    manual_font_size,
+                    deepl_key,
+                    gemini_key,
+                    output_dir=output_dir,
+                )
+            except Exception as e:
+                logger.exception(f"Processing failed for {video_input}")
+                events.publish(PipelineError(str(video_input), f"処理に失敗しました: {video_input} ({e})"))
+                continue
+            if res:
+                results.append(res)
+        return results
+
+    workers = min(max_workers, len(video_inputs))
+    transcribe_pool = get_transcribe_pool(workers)
+
+    with events.process_channel(thread_initializer) as worker_events, ThreadPoolExecutor(
+        max_workers=workers,
+        thread_name_prefix="process_video",
+        initializer=thread_initializer,
+    ) as executor:
+        futures = [
+            executor.submit(
+                process_video,
+                video_input,
+                idx,
+                events,
+                subtitle_ext,
+                generate_format,
+                output_language,
+                whisper_config,
+                auto_font_size_enabled,
+                manual_font_size,
+                deepl_key,
+                gemini_key,
+                transcribe_pool,
+                output_dir,
+                worker_events,
+            )
+            for idx, video_input in enumerate(video_inputs, start=1)
+        ]
+
+        results = []
+        for video_input, future in zip(video_inputs, futures):
+            try:
+                res = future.result()
+            except Exception as e:
+                logger.exception(f"Processing failed for {video_input}")
+                events.publish(PipelineError(str(video_input), f"処理に失敗しました: {video_input} ({e})"))
+                continue
+            if res:
+                results.append(res)
     return results
@@ -0,0 +1,199 @@
+"""
+Utility: segments.py
+--------------------
+Canonical subtitle segment model shared by transcription, translation,
+writers and parsers.
+
+``Segment``/``Word`` are ``__slots__`` classes holding only what subtitles
+need (no token ids, no per-segment dicts), so a long transcript costs a
+fraction of the memory of faster-whisper's dataclasses. Everything that
+enters the pipeline (faster-whisper output, cached results, parsed SRT
+dicts) is converted once with ``to_segment``/``to_segments``; downstream
+code can then rely on plain attribute access.
+
+``SegmentColumns`` is a columnar alternative for bulk numeric work: start
+and end times live in ``array('d')`` buffers that ``starts``/``ends``
+expose to NumPy without copying.
+"""
+
+import math
+from array import array
+
+import numpy as np
+
+
+class Word:
+    """One word with its timing and recognition probability."""
+
+    __slots__ = ("start", "end", "word", "probability")
+
+    def __init__(self, start, end, word, probability=None):
+        self.start = start
+        self.end = end
+        self.word = word
+        self.probability = probability
+
+    def shifted(self, offset):
+        return Word(self.start + offset, self.end + offset, self.word, self.probability)
+
+    def __repr__(self):
+        return f"Word({self.start!r}, {self.end!r}, {self.word!r}, {self.probability!r})"
+
+    def __eq__(self, other):
+        if not isinstance(other, Word):
+            return NotImplemented
+        return (self.start, self.end, self.word, self.probability) == (
+            other.start, other.end, other.word, other.probability
+        )
+
+    def __getstate__(self):
+        return (self.start, self.end, self.word, self.probability)
+
+    def __setstate__(self, state):
+        self.start, self.end, self.word, self.probability = state
+
+
+class Segment:
+    """
+    One subtitle cue: ``start``/``end`` in seconds, ``text``, and optionally
+    the ``words`` and a ``confidence`` in [0, 1] (from Whisper's avg_logprob).
+    """
+
+    __slots__ = ("start", "end", "text", "words", "confidence")
+
+    def __init__(self, start, end, text, words=None, confidence=None):
+        self.start = start
+        self.end = end
+        self.text = text
+        self.words = words
+        self.confidence = confidence
+
+    def replace(self, **changes):
+        """Returns a copy with the given fields changed."""
+        values = {name: getattr(self, name) for name in self.__slots__}
+        values.update(changes)
+        return Segment(**values)
+
+    def shifted(self, offset):
+        """Returns a copy moved ``offset`` seconds along the timeline (words included)."""
+        words = [w.shifted(offset) for w in self.words] if self.words else self.words
+        return self.replace(start=self.start + offset, end=self.end + offset, words=words)
+
+    def to_dict(self):
+        return {"start": self.start, "end": self.end, "text": self.text}
+
+    def __repr__(self):
+        return f"Segment({self.start!r}, {self.end!r}, {self.text!r})"
+
+    def __eq__(self, other):
+        if not isinstance(other, Segment):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+
+def _to_word(obj):
+    if isinstance(obj, Word):
+        return obj
+    if isinstance(obj, dict):
+        return Word(obj["start"], obj["end"], obj.get("word", ""), obj.get("probability"))
+    return Word(obj.start, obj.end, obj.word, getattr(obj, "probability", None))
+
+
+def to_segment(obj):
+    """
+    Converts a segment-like object to a ``Segment``.
+
+    Accepts ``Segment`` (returned as is), faster-whisper ``Segment``
+    dataclasses / legacy namedtuples, and dicts with ``start``/``end``/``text``.
+
+    Raises:
+        TypeError: If ``obj`` has no start/end/text.
+    """
+    if isinstance(obj, Segment):
+        return obj
+    if isinstance(obj, dict):
+        try:
+            words = obj.get("words")
+            return Segment(
+                obj["start"],
+                obj["end"],
+                obj["text"],
+                [_to_word(w) for w in words] if words else None,
+                obj.get("confidence"),
+            )
+        except KeyError as e:
+            raise TypeError(f"Not a segment: {obj!r}") from e
+    try:
+        start, end, text = obj.start, obj.end, obj.text
+    except AttributeError as e:
+        raise TypeError(f"Not a segment: {obj!r}") from e
+    words = getattr(obj, "words", None)
+    avg_logprob = getattr(obj, "avg_logprob", None)
+    return Segment(
+        start,
+        end,
+        text,
+        [_to_word(w) for w in words] if words else None,
+        math.exp(avg_logprob) if avg_logprob is not None else None,
+    )
+
+
+def to_segments(objs):
+    """Converts an iterable of segment-like objects to a list of ``Segment``."""
+    return [to_segment(obj) for obj in objs]
+
+
+class SegmentColumns:
+    """
+    Columnar segment storage: ``array('d')`` start/end buffers plus a text list.
+
+    ``starts``/``ends`` are NumPy views over the arrays (no copy). While such a
+    view is alive the underlying array cannot be resized, so build the
+    columns completely before taking views.
+    """
+
+    __slots__ = ("_starts", "_ends", "texts")
+
+    def __init__(self, starts=(), ends=(), texts=()):
+        self._starts = array("d", starts)
+        self._ends = array("d", ends)
+        self.texts = list(texts)
+        if not len(self._starts) == len(self._ends) == len(self.texts):
+            raise ValueError("starts, ends and texts must have the same length")
+
+    @classmethod
+    def from_segments(cls, segments):
+        columns = cls()
+        for seg in segments:
+            columns.append(to_segment(seg))
+        return columns
+
+    def append(self, seg):
+        self._starts.append(seg.start)
+        self._ends.append(seg.end)
+        self.texts.append(seg.text)
+
+    @property
+    def starts(self):
+        return np.frombuffer(self._starts, dtype=np.float64)
+
+    @property
+    def ends(self):
+        return np.frombuffer(self._ends, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __getitem__(self, i):
+        return Segment(self._starts[i], self._ends[i], self.texts[i])
+
+    def __iter__(self):
+        for start, end, text in zip(self._starts, self._ends, self.texts):
+            yield Segment(start, end, text)
@@ -1,44 +1,205 @@
 # utils/srt_utils.py
 
+import mmap
+import os
 import re
-from datetime import timedelta
 import textwrap
 import logging # Import logging
+from utils.segments import to_segment
+from utils.time_utils import format_srt_ms, format_srt_times, parse_timestamp_ms, seconds_to_ms
 
 # --- Logging Setup ---
 logger = logging.getLogger(__name__)
 
 # --- format_srt_time: 秒数を SRT 形式の hh:mm:ss,ms タイムスタンプに変換する関数 ---
 def format_srt_time(t):
-    """Converts seconds to SRT time format hh:mm:ss,ms"""
-    if t is None:
-        return "00:00:00,000"
-    hours = int(t // 3600)
-    minutes = int((t % 3600) // 60)
-    seconds = int(t % 60)
-    milliseconds = int((t % 1) * 1000)
-    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
+    """Converts seconds to SRT time format hh:mm:ss,ms (see ``utils.time_utils``)."""
+    return format_srt_ms(seconds_to_ms(t))
 
 # --- srt_time_to_seconds: SRT形式の字幕時間表記を秒数に変換する関数 ---
 def srt_time_to_seconds(srt_time: str) -> float:
     """Converts SRT time format hh:mm:ss,ms to seconds"""
     try:
-        h, m, s_ms = srt_time.split(':')
-        s, ms = s_ms.split(',')
-        td = timedelta(hours=int(h), minutes=int(m), seconds=int(s), milliseconds=int(ms))
-        return td.total_seconds()
+        return parse_timestamp_ms(srt_time) / 1000
     except ValueError:
         # Handle potential format errors gracefully
         logger.warning(f"Could not parse SRT time format: {srt_time}")
         return 0.0
 
+# --- SrtEntry: ストリーミングパーサーが返すコンパクトな字幕レコード ---
+class SrtEntry:
+    """
+    One parsed SRT cue. ``start``/``end`` are seconds and ``offset`` is the
+    byte offset of the cue's timing line in the file. Has the same
+    ``start``/``end``/``text`` attributes as ``utils.segments.Segment``, so
+    it can be passed to ``to_segment`` and the writers directly.
+    """
+
+    __slots__ = ("index", "start", "end", "text", "offset")
+
+    def __init__(self, index, start, end, text, offset):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.text = text
+        self.offset = offset
+
+    def to_dict(self):
+        return {'index': self.index, 'start': self.start, 'end': self.end, 'text': self.text}
+
+    def __repr__(self):
+        return f"SrtEntry({self.index!r}, {self.start!r}, {self.end!r}, {self.text!r}, offset={self.offset})"
+
+
+_UTF8_BOM = b"\xef\xbb\xbf"
+# One or more blank (whitespace-only) lines; linear, no backtracking
+_BLANK_LINES_RE = re.compile(rb"\n(?:[ \t\r]*\n)+")
+_TIMING_RE = re.compile(rb"^\s*(\S+)\s*-->\s*(\S+)")
+# Fast path for well-formed hh:mm:ss,mmm timing lines
+_STRICT_TIMING_RE = re.compile(
+    rb"^\s*(\d+):(\d\d):(\d\d)[,.](\d{1,3})\s*-->\s*(\d+):(\d\d):(\d\d)[,.](\d{1,3})"
+)
+_FRACTION_SCALE = (0, 100, 10, 1)
+
+
+def _timing_ms(line):
+    """Returns ``(start_ms, end_ms)`` for a timing line; raises ValueError if malformed."""
+    m = _STRICT_TIMING_RE.match(line)
+    if m is not None:
+        h1, m1, s1, f1, h2, m2, s2, f2 = m.groups()
+        return (
+            ((int(h1) * 60 + int(m1)) * 60 + int(s1)) * 1000 + int(f1) * _FRACTION_SCALE[len(f1)],
+            ((int(h2) * 60 + int(m2)) * 60 + int(s2)) * 1000 + int(f2) * _FRACTION_SCALE[len(f2)],
+        )
+    m = _TIMING_RE.match(line)
+    if m is None:
+        raise ValueError(f"Malformed timing line: {line!r}")
+    return parse_timestamp_ms(m.group(1)), parse_timestamp_ms(m.group(2))
+
+
+def _log_malformed(offset, message):
+    logger.warning(f"Malformed SRT block at byte {offset}: {message}")
+
+
+def _preview(line):
+    return line.strip()[:60].decode("utf-8", errors="replace")
+
+
+def _parse_simple_block(block, offset):
+    """
+    Fast path for the common "index / timing / text..." block holding exactly
+    one cue. Returns an ``SrtEntry``, or None if the block needs the general
+    parser.
+    """
+    head, sep, rest = block.partition(b"\n")
+    timing, _, text = rest.partition(b"\n")
+    if b"-->" not in timing or rest.count(b"-->") != 1 or not head.strip().isdigit():
+        return None
+    m = _STRICT_TIMING_RE.match(timing)
+    if m is None:
+        return None
+    h1, m1, s1, f1, h2, m2, s2, f2 = m.groups()
+    return SrtEntry(
+        int(head),
+        (((int(h1) * 60 + int(m1)) * 60 + int(s1)) * 1000 + int(f1) * _FRACTION_SCALE[len(f1)]) / 1000,
+        (((int(h2) * 60 + int(m2)) * 60 + int(s2)) * 1000 + int(f2) * _FRACTION_SCALE[len(f2)]) / 1000,
+        text.replace(b"\r", b"").strip().decode("utf-8", errors="replace"),
+        offset + len(head) + 1,
+    )
+
+
+def _parse_srt_block(block, offset, report):
+    """
+    Parses one blank-line-delimited block (possibly several cues when blank
+    lines are missing) starting at byte ``offset``; yields ``SrtEntry``.
+    """
+    lines = block.split(b"\n")
+    timing_rows = [i for i, line in enumerate(lines) if b"-->" in line]
+    if not timing_rows:
+        report(offset, f"text outside any cue: {_preview(lines[0])!r}")
+        return
+
+    def _line_offset(row):
+        return offset + sum(len(line) + 1 for line in lines[:row])
+
+    # An index line directly above a timing line belongs to that cue
+    indexed = [row > 0 and lines[row - 1].strip().isdigit() for row in timing_rows]
+    first = timing_rows[0] - 1 if indexed[0] else timing_rows[0]
+    if first > 0:
+        report(offset, f"text outside any cue: {_preview(lines[0])!r}")
+
+    for k, row in enumerate(timing_rows):
+        if k + 1 < len(timing_rows):
+            text_end = timing_rows[k + 1] - (1 if indexed[k + 1] else 0)
+        else:
+            text_end = len(lines)
+        try:
+            start_ms, end_ms = _timing_ms(lines[row])
+        except (ValueError, UnicodeDecodeError):
+            report(_line_offset(row), f"bad timing line {_preview(lines[row])!r}")
+            continue
+        index = int(lines[row - 1]) if indexed[k] else None
+        text = b"\n".join(lines[row + 1:text_end]).replace(b"\r", b"").strip()
+        yield SrtEntry(
+            index, start_ms / 1000, end_ms / 1000,
+            text.decode("utf-8", errors="replace"),
+            _line_offset(row),
+        )
+
+
+# --- iter_srt: メモリマップした SRT ファイルを逐次解析して字幕エントリを yield する ---
+def iter_srt(filepath, on_error=None):
+    """
+    Incrementally parses an SRT file, yielding ``SrtEntry`` records.
+
+    The file is memory-mapped and split into blocks at blank lines with a
+    linear regex run directly over the mapping, so memory use does not grow
+    with the file size. A UTF-8 BOM and CRLF/CR line endings are accepted,
+    and cues that are not separated by a blank line are still split at the
+    next timing line. Blocks that cannot be parsed (bad timing line, text
+    without a timing line) are skipped and reported.
+
+    Args:
+        filepath (str | Path): Path to the SRT file.
+        on_error (callable, optional): Called as ``(byte_offset, message)``
+            for every malformed block. Defaults to logging a warning.
+
+    Yields:
+        SrtEntry: Parsed cues in file order.
+
+    Raises:
+        OSError: If the file cannot be opened.
+    """
+    report = on_error or _log_malformed
+    with open(filepath, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            data = mm
+            if mm.find(b"\n") == -1 and mm.find(b"\r") != -1:
+                # Classic Mac (CR-only) files: same-length replacement keeps byte offsets valid
+                data = mm[:].replace(b"\r", b"\n")
+            pos = len(_UTF8_BOM) if data[:3] == _UTF8_BOM else 0
+            for match in _BLANK_LINES_RE.finditer(data, pos):
+                block = data[pos:match.start()]
+                entry = _parse_simple_block(block, pos)
+                if entry is not None:
+                    yield entry
+                elif block.strip():
+                    yield from _parse_srt_block(block, pos, report)
+                pos = match.end()
+            block = data[pos:]
+            entry = _parse_simple_block(block, pos)
+            if entry is not None:
+                yield entry
+            elif block.strip():
+                yield from _parse_srt_block(block, pos, report)
+
 # --- parse_srt: SRTファイルを解析して各字幕エントリを辞書のリストとして返す関数 ---
 def parse_srt(filepath: str):
-    """Parses an SRT file and returns a list of subtitle dictionaries."""
-    subtitles = []
+    """Parses an SRT file and returns a list of subtitle dictionaries (see ``iter_srt``)."""
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
+        return [entry.to_dict() for entry in iter_srt(filepath)]
     except FileNotFoundError:
         logger.error(f"SRT file not found at {filepath}")
         return []
@@ -46,26 +207,6 @@ def parse_srt(filepath: str):
         logger.error(f"Error reading SRT file {filepath}: {e}")
         return []
 
-    # Use regex to find blocks, more robust against extra newlines
-    blocks = re.findall(r'(\d+)\s*(\d{2}:\d{2}:\d{2},\d{3})\s*-->\s*(\d{2}:\d{2}:\d{2},\d{3})\s*([\s\S]*?)(?=\n\n\d+\s|\Z)', content)
-
-    for block in blocks:
-        try:
-            index = int(block[0])
-            start_str = block[1]
-            end_str = block[2]
-            text = block[3].strip()
-            
-            start = srt_time_to_seconds(start_str)
-            end = srt_time_to_seconds(end_str)
-
-            subtitles.append({'index': index, 'start': start, 'end': end, 'text': text})
-        except Exception as e:
-            logger.warning(f"Could not parse SRT block: {block}. Error: {e}")
-            continue # Skip malformed blocks
-
-    return subtitles
-
 # --- generate_srt_content: WhisperセグメントからSRTファイルの内容を生成する ---
 # Updated signature to accept width and font_size
 def generate_srt_content(segments, width=1280, font_size=65, max_lines=2):
@@ -73,7 +214,7 @@ def generate_srt_content(segments, width=1280, font_size=65, max_lines=2):
     Generates SRT file content string from Whisper segments, dynamically calculating line length.
 
     Args:
-        segments: Iterable of Whisper segment objects (or dicts) with 'start', 'end', 'text'.
+        segments: Iterable of segments (``utils.segments.Segment``, Whisper segments or dicts with 'start', 'end', 'text').
         width (int): The width of the video in pixels (used for line length calculation).
         font_size (int): The font size used for the subtitles (used for line length calculation).
         max_lines (int): The maximum number of lines per subtitle entry.
@@ -87,20 +228,19 @@ def generate_srt_content(segments, width=1280, font_size=65, max_lines=2):
         logger.error("Segments data is not iterable for SRT generation.")
         return "" # Return empty string if segments is not valid
 
+    # Normalize up front so all timestamps can be formatted in one vectorized pass
+    numbered = []
     for i, segment in enumerate(segments, 1):
         try:
-             # Check if segment is an object with attributes or a dict
-            if hasattr(segment, 'start') and hasattr(segment, 'end') and hasattr(segment, 'text'):
-                start_time_str = format_srt_time(segment.start)
-                end_time_str = format_srt_time(segment.end)
-                text = segment.text
-            elif isinstance(segment, dict) and 'start' in segment and 'end' in segment and 'text' in segment:
-                start_time_str = format_srt_time(segment['start'])
-                end_time_str = format_srt_time(segment['end'])
-                text = segment['text']
-            else:
-                logger.warning(f"Skipping invalid segment structure for SRT: {segment}")
-                continue # Skip this segment
+            numbered.append((i, to_segment(segment)))
+        except TypeError:
+            logger.warning(f"Skipping invalid segment structure for SRT: {segment}")
+    start_strs = format_srt_times([segment.start for _, segment in numbered])
+    end_strs = format_srt_times([segment.end for _, segment in numbered])
+
+    for (i, segment), start_time_str, end_time_str in zip(numbered, start_strs, end_strs):
+        try:
+            text = segment.text
 
             # --- Dynamic Line Length Calculation ---
             # Heuristic: Assume average character width is roughly 0.6 * font_size
@@ -0,0 +1,182 @@
+"""
+Utility: time_utils.py
+----------------------
+Shared time-conversion core for every subtitle writer.
+
+All formatting works on integer milliseconds: seconds are rounded to the
+nearest millisecond once (``seconds_to_ms``) and then split with integer
+arithmetic, so a value such as 1.9996s becomes ``00:00:02,000`` instead of
+``00:00:01,1000``. ASS centiseconds are rounded from the milliseconds the
+same way.
+
+Bulk variants (``format_*_times``) take whole arrays of seconds (lists,
+NumPy arrays or ``SegmentColumns.starts``) and render them with NumPy:
+the digits of every timestamp are computed column-wise into a fixed-width
+byte matrix that is viewed as strings, with no per-value Python formatting.
+FCPXML times are exact rationals on the frame grid (e.g. ``1001/30000s``).
+"""
+
+from fractions import Fraction
+
+import numpy as np
+
+# Largest value each format can represent
+_SRT_MAX_MS = (99 * 3600 + 59 * 60 + 59) * 1000 + 999
+_ASS_MAX_CS = (9 * 3600 + 59 * 60 + 59) * 100 + 99
+
+
+# --- Scalar conversions ----------------------------------------------------
+def seconds_to_ms(seconds) -> int:
+    """Rounds seconds to integer milliseconds (None and negatives become 0)."""
+    if seconds is None:
+        return 0
+    return max(0, int(round(seconds * 1000)))
+
+
+def parse_timestamp_ms(value) -> int:
+    """
+    Parses an SRT/WebVTT timestamp (``h:mm:ss,mmm`` or ``h:mm:ss.mmm``, str
+    or bytes) to integer milliseconds. Raises ValueError if malformed.
+    """
+    if isinstance(value, bytes):
+        value = value.decode("ascii")
+    clock, sep, fraction = value.strip().replace(",", ".").partition(".")
+    parts = clock.split(":")
+    if not 2 <= len(parts) <= 3 or (sep and not fraction.isdigit()) or len(fraction) > 3:
+        raise ValueError(f"Malformed timestamp: {value!r}")
+    hours, minutes, seconds = [int(p) for p in ([0] * (3 - len(parts)) + parts)]
+    return ((hours * 60 + minutes) * 60 + seconds) * 1000 + int(fraction.ljust(3, "0") or 0)
+
+
+def _split_ms(ms):
+    seconds, ms = divmod(ms, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return hours, minutes, seconds, ms
+
+
+def format_srt_ms(ms: int) -> str:
+    """Formats milliseconds as SRT ``hh:mm:ss,mmm``."""
+    hours, minutes, seconds, ms = _split_ms(min(ms, _SRT_MAX_MS))
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{ms:03d}"
+
+
+def format_vtt_ms(ms: int) -> str:
+    """Formats milliseconds as WebVTT ``hh:mm:ss.mmm`` (hours may exceed two digits)."""
+    hours, minutes, seconds, ms = _split_ms(ms)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}.{ms:03d}"
+
+
+def format_ass_ms(ms: int) -> str:
+    """Formats milliseconds as ASS ``h:mm:ss.cc`` (rounded to centiseconds)."""
+    cs = min((ms + 5) // 10, _ASS_MAX_CS)
+    seconds, cs = divmod(cs, 100)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}.{cs:02d}"
+
+
+def frame_duration(frame_rate) -> Fraction:
+    """
+    Returns the exact duration of one frame for a frame rate given as a
+    ``Fraction``, int or float (NTSC floats such as 29.97 map to 1001/30000).
+    """
+    if isinstance(frame_rate, float):
+        ntsc = Fraction(round(frame_rate * 1.001) * 1000, 1001)
+        rate = ntsc if abs(float(ntsc) - frame_rate) < 1e-3 else Fraction(frame_rate).limit_denominator(1001)
+    else:
+        rate = Fraction(frame_rate)
+    if rate <= 0:
+        raise ValueError(f"Invalid frame rate: {frame_rate!r}")
+    return 1 / rate
+
+
+def seconds_to_frames(seconds, frame_rate) -> int:
+    """Rounds seconds to the nearest whole frame at ``frame_rate`` (negatives become 0)."""
+    frame = frame_duration(frame_rate)
+    return max(0, round((seconds or 0) * frame.denominator / frame.numerator))
+
+
+def format_frames(frames: int, frame_rate) -> str:
+    """Formats a frame count as an FCPXML rational time, e.g. ``1001/30000s``."""
+    return _rational_string(frames, frame_duration(frame_rate))
+
+
+def _rational_string(frames, frame):
+    numerator = frames * frame.numerator
+    if numerator % frame.denominator == 0:
+        return f"{numerator // frame.denominator}s"
+    # Keep the frame denominator (e.g. 1001/30000s) as FCPXML expects
+    return f"{numerator}/{frame.denominator}s"
+
+
+def format_rational_time(seconds, frame_rate) -> str:
+    """Formats seconds as an FCPXML rational time snapped to the frame grid, e.g. ``1001/30000s``."""
+    frame = frame_duration(frame_rate)
+    frames = max(0, round(Fraction(seconds or 0) / frame))
+    return _rational_string(frames, frame)
+
+
+# --- Bulk (vectorized) conversions ---------------------------------------
+def seconds_to_ms_array(seconds) -> np.ndarray:
+    """Rounds an array-like of seconds to an int64 array of milliseconds (negatives clipped to 0)."""
+    values = np.asarray(seconds, dtype=np.float64)
+    return np.clip(np.rint(values * 1000.0), 0, None).astype(np.int64)
+
+
+def _render(parts, n):
+    """
+    Builds ``n`` fixed-width ASCII strings from ``parts``: each part is either
+    a literal separator string or an ``(int64 array, width)`` pair rendered as
+    zero-padded digits.
+    """
+    columns = []
+    for part in parts:
+        if isinstance(part, str):
+            columns.append(np.broadcast_to(np.frombuffer(part.encode("ascii"), dtype=np.uint8), (n, len(part))))
+        else:
+            values, width = part
+            powers = 10 ** np.arange(width - 1, -1, -1, dtype=np.int64)
+            columns.append((values[:, None] // powers % 10 + ord("0")).astype(np.uint8))
+    matrix = np.ascontiguousarray(np.hstack(columns))
+    return matrix.view(f"S{matrix.shape[1]}").ravel().astype(f"U{matrix.shape[1]}").tolist()
+
+
+def _split_ms_array(ms):
+    return ms // 3_600_000, ms // 60_000 % 60, ms // 1000 % 60, ms % 1000
+
+
+def format_srt_times(seconds) -> list:
+    """Formats an array-like of seconds as SRT timestamps."""
+    ms = np.minimum(seconds_to_ms_array(seconds), _SRT_MAX_MS)
+    if ms.size == 0:
+        return []
+    h, m, s, f = _split_ms_array(ms)
+    return _render([(h, 2), ":", (m, 2), ":", (s, 2), ",", (f, 3)], ms.size)
+
+
+def format_vtt_times(seconds) -> list:
+    """Formats an array-like of seconds as WebVTT timestamps."""
+    ms = seconds_to_ms_array(seconds)
+    if ms.size == 0:
+        return []
+    h, m, s, f = _split_ms_array(ms)
+    hour_width = max(2, len(str(int(h.max()))))
+    return _render([(h, hour_width), ":", (m, 2), ":", (s, 2), ".", (f, 3)], ms.size)
+
+
+def format_ass_times(seconds) -> list:
+    """Formats an array-like of seconds as ASS timestamps."""
+    cs = np.minimum((seconds_to_ms_array(seconds) + 5) // 10, _ASS_MAX_CS)
+    if cs.size == 0:
+        return []
+    h, m, s, c = cs // 360_000, cs // 6000 % 60, cs // 100 % 60, cs % 100
+    return _render([(h, 1), ":", (m, 2), ":", (s, 2), ".", (c, 2)], cs.size)
+
+
+def format_rational_times(seconds, frame_rate) -> list:
+    """Formats an array-like of seconds as FCPXML rational times on the frame grid."""
+    frame = frame_duration(frame_rate)
+    values = np.asarray(seconds, dtype=np.float64)
+    frames = np.clip(np.rint(values * frame.denominator / frame.numerator), 0, None).astype(np.int64)
+    return [_rational_string(n, frame) for n in frames.tolist()]
@@ -1,8 +1,15 @@
 import os
 import deepl
 import google.generativeai as genai
+import google.ai.generativelanguage as glm
+from google.api_core.client_options import ClientOptions
+import json
 import logging
+import threading
+from typing import TypedDict
 from time import sleep
+from urllib.parse import quote_plus
+from utils.translation_memory import translate_with_memory
 
 logger = logging.getLogger(__name__)
 
@@ -28,105 +35,433 @@ TARGET_LANG_MAP_GEMINI = {
     "日本語": "Japanese", "英語": "English",
 }
 
+# DeepL request limits: at most 50 texts and 128 KiB of request body per call.
+# Keep some headroom for the other form fields.
+DEEPL_MAX_TEXTS_PER_REQUEST = 50
+DEEPL_MAX_REQUEST_BYTES = 120 * 1024
+
+# --- DeepL client pool: API キーごとに Translator を 1 つだけ生成して再利用する ---
+_DEEPL_TRANSLATORS = {}
+_DEEPL_TRANSLATORS_LOCK = threading.Lock()
+
+def _get_deepl_translator(deepl_api_key):
+    """Returns a shared deepl.Translator (and its HTTP connection pool) for the key."""
+    with _DEEPL_TRANSLATORS_LOCK:
+        translator = _DEEPL_TRANSLATORS.get(deepl_api_key)
+        if translator is None:
+            translator = deepl.Translator(deepl_api_key)
+            _DEEPL_TRANSLATORS[deepl_api_key] = translator
+        return translator
+
+def _chunk_texts_for_deepl(indices, texts):
+    """Groups text indices into batches that respect DeepL's per-request limits."""
+    batch, batch_bytes = [], 0
+    for i in indices:
+        # Form-encoded size of "text=<value>&"
+        text_bytes = len(quote_plus(texts[i])) + 6
+        if batch and (
+            len(batch) >= DEEPL_MAX_TEXTS_PER_REQUEST
+            or batch_bytes + text_bytes > DEEPL_MAX_REQUEST_BYTES
+        ):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(i)
+        batch_bytes += text_bytes
+    if batch:
+        yield batch
+
+def _resolve_deepl_langs(source_lang_whisper, target_lang_ui):
+    """Maps Whisper/UI language codes to DeepL codes; returns ``(source, target, error)``."""
+    source_lang_deepl = LANG_MAP_DEEPL.get(source_lang_whisper)
+    target_lang_deepl = TARGET_LANG_MAP_DEEPL.get(target_lang_ui)
+
+    if not source_lang_deepl:
+        return None, None, f"DeepL does not support source language: {source_lang_whisper}"
+    if not target_lang_deepl:
+        return None, None, f"DeepL does not support target language: {target_lang_ui}"
+    return source_lang_deepl, target_lang_deepl, None
+
+def _send_deepl_batch(translator, texts, source_lang_deepl, target_lang_deepl):
+    """Sends one multi-text DeepL request and returns the translated strings (raises on error)."""
+    results = translator.translate_text(
+        texts,
+        source_lang=source_lang_deepl,
+        target_lang=target_lang_deepl,
+    )
+    return [result.text for result in results]
+
 # Updated signature to accept deepl_api_key
 def translate_text_deepl(text, source_lang_whisper, target_lang_ui, deepl_api_key=None):
     """Translates text using DeepL API, accepting API key as argument."""
+    translations, error = translate_texts_deepl(
+        [text], source_lang_whisper, target_lang_ui, deepl_api_key=deepl_api_key
+    )
+    return translations[0], error
+
+def translate_texts_deepl(texts, source_lang_whisper, target_lang_ui, deepl_api_key=None, progress_callback=None, stats=None):
+    """
+    Translates a list of texts with as few DeepL requests as possible.
+
+    Identical texts are sent once and texts found in the translation memory
+    are not sent at all; the rest go out as multi-text requests sized to
+    DeepL's payload limits, using one pooled client per API key.
+
+    Args:
+        texts (list[str]): Texts to translate.
+        source_lang_whisper (str): Source language code as detected by Whisper.
+        target_lang_ui (str): Target language as selected in the UI.
+        deepl_api_key (str): DeepL API key.
+        progress_callback (callable, optional): Called as ``(done, total)`` after each request.
+        stats (TranslationStats, optional): Translation-memory counters to accumulate into.
+
+    Returns:
+        tuple[list, str | None]: Translations aligned with ``texts`` (``None``
+        for entries that could not be translated) and the first error, if any.
+    """
+    return translate_with_memory(
+        texts,
+        source_lang_whisper,
+        target_lang_ui,
+        "deepl",
+        lambda pending: _translate_texts_deepl_uncached(
+            pending, source_lang_whisper, target_lang_ui, deepl_api_key, progress_callback
+        ),
+        stats=stats,
+    )
+
+def _translate_texts_deepl_uncached(texts, source_lang_whisper, target_lang_ui, deepl_api_key, progress_callback=None):
+    """Sends ``texts`` to DeepL in request-sized batches; see ``translate_texts_deepl``."""
+    translations = [None] * len(texts)
     if not deepl_api_key:
         logger.error("DeepL API key was not provided to translate_text_deepl.")
-        return None, "DeepL API key not provided"
-    if not text:
-        return "", None # Return empty string for empty input
+        return translations, "DeepL API key not provided"
+
+    source_lang_deepl, target_lang_deepl, lang_error = _resolve_deepl_langs(source_lang_whisper, target_lang_ui)
+    if lang_error:
+        return translations, lang_error
 
-    # Configure DeepL client locally within the function
     try:
-        local_deepl_translator = deepl.Translator(deepl_api_key)
+        translator = _get_deepl_translator(deepl_api_key)
     except Exception as e:
         logger.error(f"Failed to configure DeepL Translator with provided key: {e}")
-        return None, f"DeepL configuration failed: {e}"
+        return translations, f"DeepL configuration failed: {e}"
 
+    # Empty input needs no request
+    pending = []
+    for i, text in enumerate(texts):
+        if text:
+            pending.append(i)
+        else:
+            translations[i] = ""
 
-    source_lang_deepl = LANG_MAP_DEEPL.get(source_lang_whisper)
-    target_lang_deepl = TARGET_LANG_MAP_DEEPL.get(target_lang_ui)
+    error = None
+    done = len(texts) - len(pending)
+    for batch in _chunk_texts_for_deepl(pending, texts):
+        try:
+            results = _send_deepl_batch(
+                translator, [texts[i] for i in batch], source_lang_deepl, target_lang_deepl
+            )
+            for i, result in zip(batch, results):
+                translations[i] = result
+            logger.debug(f"DeepL batch translation successful for {len(batch)} texts")
+        except deepl.QuotaExceededException:
+            logger.warning("DeepL API quota exceeded.")
+            return translations, "DeepL quota exceeded"
+        except deepl.DeepLException as e:
+            logger.error(f"DeepL API error: {e}")
+            error = error or f"DeepL API error: {e}"
+        except Exception as e:
+            logger.error(f"Unexpected error during DeepL translation: {e}")
+            error = error or f"Unexpected DeepL error: {e}"
+        done += len(batch)
+        if progress_callback:
+            progress_callback(done, len(texts))
 
-    if not source_lang_deepl:
-        return None, f"DeepL does not support source language: {source_lang_whisper}"
-    if not target_lang_deepl:
-        return None, f"DeepL does not support target language: {target_lang_ui}"
+    return translations, error
 
-    try:
-        # Use the local translator instance
-        result = local_deepl_translator.translate_text(
-            text,
-            source_lang=source_lang_deepl,
-            target_lang=target_lang_deepl
-        )
-        logger.debug(f"DeepL translation successful for '{text[:20]}...'")
-        return result.text, None
-    except deepl.QuotaExceededException:
-        logger.warning("DeepL API quota exceeded.")
-        return None, "DeepL quota exceeded"
-    except deepl.DeepLException as e:
-        logger.error(f"DeepL API error: {e}")
-        return None, f"DeepL API error: {e}"
-    except Exception as e:
-        logger.error(f"Unexpected error during DeepL translation: {e}")
-        return None, f"Unexpected DeepL error: {e}"
+GEMINI_MODEL_NAME = 'gemini-1.5-flash' # Or another suitable model
+# Engine label used as part of the translation-memory key
+GEMINI_ENGINE = f"gemini/{GEMINI_MODEL_NAME}"
+# Segments packed into one batched Gemini request
+GEMINI_BATCH_SIZE = 50
+# Rounds of re-requesting segments that came back missing or merged
+GEMINI_BATCH_MAX_ATTEMPTS = 3
+
+class _GeminiSegment(TypedDict):
+    id: int
+    text: str
+
+# --- Gemini client cache: API キーごとに専用クライアントと GenerativeModel を再利用する ---
+_GEMINI_MODELS = {}
+_GEMINI_LOCK = threading.Lock()
+
+def _make_gemini_client(gemini_api_key):
+    """Builds a GenerativeServiceClient bound to one API key.
+
+    Set ``GEMINI_API_ENDPOINT`` to point the client at another endpoint
+    (e.g. a local stub server); the REST transport is used in that case.
+    """
+    options = {"api_key": gemini_api_key}
+    kwargs = {}
+    endpoint = os.environ.get("GEMINI_API_ENDPOINT")
+    if endpoint:
+        options["api_endpoint"] = endpoint
+        kwargs["transport"] = "rest"
+    return glm.GenerativeServiceClient(client_options=ClientOptions(**options), **kwargs)
+
+def _get_gemini_model(gemini_api_key):
+    """Returns a cached GenerativeModel with its own client for ``gemini_api_key``.
+
+    ``genai.configure`` is process-wide, so parallel jobs with different keys
+    could switch each other's key mid-request. Each model is instead given a
+    client carrying its key, and the global configuration is never touched.
+    """
+    with _GEMINI_LOCK:
+        model = _GEMINI_MODELS.get(gemini_api_key)
+        if model is None:
+            model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+            # GenerativeModel only falls back to the global client while _client is unset
+            model._client = _make_gemini_client(gemini_api_key)
+            _GEMINI_MODELS[gemini_api_key] = model
+        return model
+
+def _resolve_gemini_langs(source_lang_whisper, target_lang_ui):
+    source_lang_gemini = LANG_MAP_GEMINI.get(source_lang_whisper, source_lang_whisper) # Fallback to original code
+    target_lang_gemini = TARGET_LANG_MAP_GEMINI.get(target_lang_ui) or LANG_MAP_GEMINI.get(target_lang_ui)
+    return source_lang_gemini, target_lang_gemini
+
+def _generate_with_retry(model, prompt, **kwargs):
+    """Calls ``model.generate_content`` with a small retry loop and returns the response."""
+    # Add retry logic for potential API flakiness
+    retries = 3
+    delay = 1
+    for i in range(retries):
+        try:
+            return model.generate_content(prompt, **kwargs)
+        except Exception as e:
+             # Specific error handling for Gemini if available (e.g., rate limits, content filtering)
+             logger.warning(f"Gemini API attempt {i+1} failed: {e}")
+             if "rate limit" in str(e).lower() and i < retries - 1:
+                 sleep(delay * (i + 1)) # Exponential backoff might be better
+                 continue
+             elif i == retries - 1: # Last retry failed
+                 raise e # Re-raise the last exception
+             else:
+                 sleep(delay) # Simple delay for other errors
 
 # Updated signature to accept gemini_api_key
 def translate_text_gemini(text, source_lang_whisper, target_lang_ui, gemini_api_key=None):
     """Translates text using Google Gemini API, accepting API key as argument."""
+    if not text:
+        return "", None # Return empty string for empty input
+    translations, error = translate_with_memory(
+        [text],
+        source_lang_whisper,
+        target_lang_ui,
+        GEMINI_ENGINE,
+        lambda pending: _translate_text_gemini_uncached(
+            pending[0], source_lang_whisper, target_lang_ui, gemini_api_key
+        ),
+    )
+    return translations[0], error
+
+def _translate_text_gemini_uncached(text, source_lang_whisper, target_lang_ui, gemini_api_key):
+    """Sends one text to Gemini and returns ``([translation], error)``."""
+    translation, error = _translate_text_gemini_request(text, source_lang_whisper, target_lang_ui, gemini_api_key)
+    return [translation], error
+
+def _translate_text_gemini_request(text, source_lang_whisper, target_lang_ui, gemini_api_key):
+    """Single-prompt Gemini translation, bypassing the translation memory."""
     if not gemini_api_key:
         logger.error("Gemini API key was not provided to translate_text_gemini.")
         return None, "Gemini API key not provided"
     if not text:
         return "", None # Return empty string for empty input
 
-    # Configure Gemini client locally within the function
     try:
-        genai.configure(api_key=gemini_api_key)
-        local_gemini_model = genai.GenerativeModel('gemini-1.5-flash') # Or another suitable model
+        model = _get_gemini_model(gemini_api_key)
     except Exception as e:
         logger.error(f"Failed to configure Gemini API with provided key: {e}")
         return None, f"Gemini configuration failed: {e}"
 
-    source_lang_gemini = LANG_MAP_GEMINI.get(source_lang_whisper, source_lang_whisper) # Fallback to original code
-    target_lang_gemini = TARGET_LANG_MAP_GEMINI.get(target_lang_ui)
-
+    source_lang_gemini, target_lang_gemini = _resolve_gemini_langs(source_lang_whisper, target_lang_ui)
     if not target_lang_gemini:
          return None, f"Gemini does not support target language: {target_lang_ui}"
 
     prompt = f"Translate the following text from {source_lang_gemini} to {target_lang_gemini}. Output only the translated text, without any introductory phrases or explanations:\n\n{text}"
 
     try:
-        # Add retry logic for potential API flakiness
-        retries = 3
-        delay = 1
-        for i in range(retries):
-            try:
-                # Use the local model instance
-                response = local_gemini_model.generate_content(prompt)
-                # Accessing the text might differ based on Gemini API version/response structure
-                # Check response object structure if errors occur
-                translated_text = response.text.strip()
-                logger.debug(f"Gemini translation successful for '{text[:20]}...'")
-                return translated_text, None
-            except Exception as e:
-                 # Specific error handling for Gemini if available (e.g., rate limits, content filtering)
-                 logger.warning(f"Gemini API attempt {i+1} failed: {e}")
-                 if "rate limit" in str(e).lower() and i < retries - 1:
-                     sleep(delay * (i + 1)) # Exponential backoff might be better
-                     continue
-                 elif i == retries - 1: # Last retry failed
-                     raise e # Re-raise the last exception
-                 else:
-                     sleep(delay) # Simple delay for other errors
-
+        response = _generate_with_retry(model, prompt)
+        # Accessing the text might differ based on Gemini API version/response structure
+        # Check response object structure if errors occur
+        translated_text = response.text.strip()
+        logger.debug(f"Gemini translation successful for '{text[:20]}...'")
+        return translated_text, None
     except Exception as e:
         logger.error(f"Gemini API error after retries: {e}")
         # Log the prompt for debugging if needed (be mindful of sensitive data)
         # logger.debug(f"Failed Gemini prompt: {prompt}")
         return None, f"Gemini API error: {e}"
 
+def _build_gemini_batch_prompt(items, source_lang_gemini, target_lang_gemini):
+    """Builds a prompt asking for one JSON object per numbered segment."""
+    payload = json.dumps([{"id": i, "text": t} for i, t in items], ensure_ascii=False)
+    return (
+        f"Translate each subtitle segment below from {source_lang_gemini} to {target_lang_gemini}. "
+        "The segments are consecutive lines of one video: use the neighbouring lines as context, "
+        "but translate every segment on its own and never merge, split or drop segments. "
+        'Return a JSON array with exactly one object {"id": <same id>, "text": <translation>} '
+        "per input segment.\n\n"
+        f"{payload}"
+    )
+
+def _parse_gemini_batch_response(response_text, expected_ids):
+    """Maps a batched JSON response back to segment ids.
+
+    Returns a dict ``{id: translation}`` holding only well-formed entries for
+    ids that were requested; ids returned more than once are dropped because
+    they indicate that segments were merged or split.
+    """
+    try:
+        items = json.loads(response_text)
+    except (TypeError, json.JSONDecodeError) as e:
+        logger.warning(f"Gemini batch response is not valid JSON: {e}")
+        return {}
+    if not isinstance(items, list):
+        return {}
+
+    results, duplicates = {}, set()
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        seg_id, text = item.get("id"), item.get("text")
+        if not isinstance(seg_id, int) or seg_id not in expected_ids or not isinstance(text, str):
+            continue
+        if seg_id in results:
+            duplicates.add(seg_id)
+        results[seg_id] = text.strip()
+    for seg_id in duplicates:
+        del results[seg_id]
+    return results
+
+def _send_gemini_batch(model, items, source_lang_gemini, target_lang_gemini, retry=True):
+    """Sends one batched prompt for ``items`` (``(id, text)`` pairs) and returns ``{id: translation}``.
+
+    API errors are raised; with ``retry`` the request goes through ``_generate_with_retry``.
+    """
+    prompt = _build_gemini_batch_prompt(items, source_lang_gemini, target_lang_gemini)
+    generation_config = genai.GenerationConfig(
+        response_mime_type="application/json",
+        response_schema=list[_GeminiSegment],
+    )
+    if retry:
+        response = _generate_with_retry(model, prompt, generation_config=generation_config)
+    else:
+        response = model.generate_content(prompt, generation_config=generation_config)
+    return _parse_gemini_batch_response(response.text, {i for i, _ in items})
+
+def translate_texts_gemini(
+    texts,
+    source_lang_whisper,
+    target_lang_ui,
+    gemini_api_key=None,
+    batch_size=GEMINI_BATCH_SIZE,
+    progress_callback=None,
+    stats=None,
+):
+    """
+    Translates a list of texts with Gemini by packing numbered segments into
+    batched prompts with structured JSON output. Duplicates and texts found in
+    the translation memory are resolved before any request is sent.
+
+    Results are mapped back by segment id. Segments that are missing, duplicated
+    or came back empty are re-requested in smaller batches, and any that are
+    still unresolved after ``GEMINI_BATCH_MAX_ATTEMPTS`` rounds are translated
+    one by one.
+
+    Returns:
+        tuple[list, str | None]: Translations aligned with ``texts`` (``None``
+        for entries that could not be translated) and the first error, if any.
+    """
+    return translate_with_memory(
+        texts,
+        source_lang_whisper,
+        target_lang_ui,
+        GEMINI_ENGINE,
+        lambda pending: _translate_texts_gemini_uncached(
+            pending, source_lang_whisper, target_lang_ui, gemini_api_key, batch_size, progress_callback
+        ),
+        stats=stats,
+    )
+
+def _translate_texts_gemini_uncached(texts, source_lang_whisper, target_lang_ui, gemini_api_key, batch_size=GEMINI_BATCH_SIZE, progress_callback=None):
+    """Sends ``texts`` to Gemini in batched prompts; see ``translate_texts_gemini``."""
+    translations = [None] * len(texts)
+    if not gemini_api_key:
+        logger.error("Gemini API key was not provided to translate_texts_gemini.")
+        return translations, "Gemini API key not provided"
+
+    source_lang_gemini, target_lang_gemini = _resolve_gemini_langs(source_lang_whisper, target_lang_ui)
+    if not target_lang_gemini:
+        return translations, f"Gemini does not support target language: {target_lang_ui}"
+
+    try:
+        model = _get_gemini_model(gemini_api_key)
+    except Exception as e:
+        logger.error(f"Failed to configure Gemini API with provided key: {e}")
+        return translations, f"Gemini configuration failed: {e}"
+
+    pending = []
+    for i, text in enumerate(texts):
+        if text:
+            pending.append(i)
+        else:
+            translations[i] = ""
+
+    error = None
+    total = len(texts)
+    for attempt in range(GEMINI_BATCH_MAX_ATTEMPTS):
+        if not pending:
+            break
+        # Shrink batches on each retry round to reduce the chance of merged output
+        size = max(1, batch_size >> attempt)
+        unresolved = []
+        for start in range(0, len(pending), size):
+            batch = pending[start:start + size]
+            try:
+                results = _send_gemini_batch(
+                    model, [(i, texts[i]) for i in batch], source_lang_gemini, target_lang_gemini
+                )
+            except Exception as e:
+                logger.error(f"Gemini batch request failed: {e}")
+                error = error or f"Gemini API error: {e}"
+                results = {}
+            for i in batch:
+                if results.get(i):
+                    translations[i] = results[i]
+                else:
+                    unresolved.append(i)
+            if progress_callback:
+                progress_callback(total - len(pending) + start + len(batch) - len(unresolved), total)
+        if unresolved:
+            logger.warning(
+                f"Gemini batch round {attempt + 1}: {len(unresolved)} segments missing or merged, retrying"
+            )
+        pending = unresolved
+
+    # Last resort: one request per remaining segment
+    for i in pending:
+        translations[i], err = _translate_text_gemini_request(
+            texts[i], source_lang_whisper, target_lang_ui, gemini_api_key
+        )
+        error = error or err
+    if pending and progress_callback:
+        progress_callback(total, total)
+
+    if all(t is not None for t in translations):
+        error = None
+    return translations, error
+
 
 # This function is kept for potential future use but is replaced by the new logic in main4.py
 # def translate_segments(segments, source_language, target_language):
@@ -0,0 +1,210 @@
+"""
+Utility: translation_memory.py
+------------------------------
+SQLite-backed translation memory. Stores exact-match translations keyed on
+(normalized source text, source language, target language, engine) so
+repeated subtitle lines are never paid for twice.
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from dataclasses import dataclass
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# SQLite limits the number of host parameters per statement
+_SQL_BATCH_SIZE = 500
+
+
+def normalize_text(text: str) -> str:
+    """Normalizes text for exact-match lookups (NFKC, collapsed whitespace)."""
+    return _WHITESPACE_RE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+@dataclass
+class TranslationStats:
+    """Hit/miss counters for one translation job.
+
+    Every unique text is counted once as a hit or a miss; ``fallbacks``
+    counts the unique texts that were handed to a fallback engine.
+    """
+    hits: int = 0
+    misses: int = 0
+    duplicates: int = 0
+    fallbacks: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def add(self, other):
+        """Adds the counters of ``other`` (e.g. one batch of a streamed job)."""
+        self.hits += other.hits
+        self.misses += other.misses
+        self.duplicates += other.duplicates
+        self.fallbacks += other.fallbacks
+
+    def add_fallback(self, fallback):
+        """
+        Folds in the stats of a fallback stage run over texts this job already counted as misses.
+
+        Duplicates and misses were counted by the first stage; only texts the
+        fallback engine found in the memory turn a miss into a hit.
+        """
+        self.hits += fallback.hits
+        self.misses -= fallback.hits
+        self.fallbacks += fallback.hits + fallback.misses
+
+    def __str__(self):
+        return (
+            f"TM hits={self.hits}, misses={self.misses}, "
+            f"deduplicated={self.duplicates}, fallbacks={self.fallbacks}, hit rate={self.hit_rate:.0%}"
+        )
+
+
+class TranslationMemory:
+    """Thread-safe exact-match translation store backed by a single SQLite file."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS translations (
+                    source_text TEXT NOT NULL,
+                    source_lang TEXT NOT NULL,
+                    target_lang TEXT NOT NULL,
+                    engine TEXT NOT NULL,
+                    translation TEXT NOT NULL,
+                    PRIMARY KEY (source_text, source_lang, target_lang, engine)
+                ) WITHOUT ROWID
+                """
+            )
+
+    def get_many(self, texts, source_lang, target_lang, engine):
+        """Returns ``{normalized_text: translation}`` for every stored text."""
+        texts = list(texts)
+        found = {}
+        with self._lock:
+            for start in range(0, len(texts), _SQL_BATCH_SIZE):
+                chunk = texts[start:start + _SQL_BATCH_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT source_text, translation FROM translations "
+                    f"WHERE source_lang = ? AND target_lang = ? AND engine = ? "
+                    f"AND source_text IN ({placeholders})",
+                    (source_lang, target_lang, engine, *chunk),
+                )
+                found.update(rows)
+        return found
+
+    def put_many(self, pairs, source_lang, target_lang, engine):
+        """Stores ``(normalized_text, translation)`` pairs, replacing older entries."""
+        rows = [(text, source_lang, target_lang, engine, translation) for text, translation in pairs]
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO translations "
+                "(source_text, source_lang, target_lang, engine, translation) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+
+
+_MEMORY = None
+_MEMORY_LOCK = threading.Lock()
+
+
+def get_translation_memory():
+    """Returns the process-wide TranslationMemory, or None when disabled.
+
+    The database location is taken from ``TRANSLATION_MEMORY_PATH``; set it to
+    an empty string to disable the memory.
+    """
+    global _MEMORY
+    path = os.environ.get("TRANSLATION_MEMORY_PATH", "./.cache/translation_memory.sqlite3")
+    if not path:
+        return None
+    with _MEMORY_LOCK:
+        if _MEMORY is None:
+            try:
+                _MEMORY = TranslationMemory(path)
+            except Exception as e:
+                logger.error(f"Failed to open translation memory at '{path}': {e}")
+                return None
+        return _MEMORY
+
+
+def translate_with_memory(texts, source_lang, target_lang, engine, translate_batch, stats=None):
+    """
+    Wraps a batch translator with job-level deduplication and the translation memory.
+
+    Identical texts (after normalization) are translated once, texts already
+    in the memory are not sent at all, and new translations are stored. The
+    normalized form is only the lookup key: the engine receives the first
+    original text of each group, so half-width kana, full-width ASCII and
+    similar characters reach it unchanged.
+
+    Args:
+        texts (list[str]): Texts to translate.
+        translate_batch (callable): ``(list[str]) -> (list[str | None], error)``.
+        stats (TranslationStats, optional): Counters to accumulate into.
+
+    Returns:
+        tuple[list, str | None]: Translations aligned with ``texts`` and the error
+        reported by ``translate_batch``, if any.
+    """
+    stats = stats if stats is not None else TranslationStats()
+    translations = [None] * len(texts)
+
+    # Group input positions by normalized text
+    positions = {}
+    for i, text in enumerate(texts):
+        if not text:
+            translations[i] = ""
+            continue
+        positions.setdefault(normalize_text(text), []).append(i)
+    stats.duplicates += sum(len(p) - 1 for p in positions.values())
+
+    memory = get_translation_memory()
+    known = {}
+    if memory is not None and positions:
+        try:
+            known = memory.get_many(positions.keys(), source_lang, target_lang, engine)
+        except Exception as e:
+            logger.warning(f"Translation memory lookup failed: {e}")
+    stats.hits += len(known)
+
+    unknown = [key for key in positions if key not in known]
+    stats.misses += len(unknown)
+
+    error = None
+    if unknown:
+        results, error = translate_batch([texts[positions[key][0]] for key in unknown])
+        new_pairs = [(key, res) for key, res in zip(unknown, results) if res is not None]
+        known.update(new_pairs)
+        if memory is not None:
+            try:
+                memory.put_many(new_pairs, source_lang, target_lang, engine)
+            except Exception as e:
+                logger.warning(f"Translation memory update failed: {e}")
+
+    for key, idxs in positions.items():
+        translation = known.get(key)
+        for i in idxs:
+            translations[i] = translation
+
+    logger.info(f"[{engine}] {source_lang}->{target_lang}: {stats}")
+    return translations, error
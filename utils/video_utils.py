@@ -3,19 +3,216 @@
 import subprocess
 import os
 import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from fractions import Fraction
+from typing import Optional
 import ffmpeg
+import numpy as np
+from utils.ffmpeg_runner import FfmpegError, run_ffmpeg
 
 logger = logging.getLogger(__name__)
 
+# Whisper expects 16kHz mono input
+WHISPER_SAMPLE_RATE = 16000
+
+# --- MediaInfo: ffprobe 結果のキャッシュ（path + mtime + size 単位で一度だけ probe） ---
+MEDIA_INFO_CACHE_SIZE = 256
+
+
+@dataclass(frozen=True)
+class AudioStreamInfo:
+    """Layout of one audio stream as reported by ffprobe."""
+    index: int
+    codec: str = ""
+    channels: int = 0
+    channel_layout: str = ""
+    sample_rate: int = 0
+    language: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class MediaInfo:
+    """
+    Container-level metadata of a media file.
+
+    ``frame_rate`` is kept as an exact ``Fraction`` (e.g. 30000/1001) so
+    rational timelines such as FCPXML do not accumulate rounding drift.
+    Video fields are 0/None for audio-only files. ``start_time`` is the
+    container's first timestamp (non-zero for many MPEG-TS and remuxed
+    files); ffmpeg's ``-ss`` and output timestamps are relative to it.
+    """
+    path: str
+    width: int = 0
+    height: int = 0
+    frame_rate: Optional[Fraction] = None
+    duration: float = 0.0
+    audio_streams: tuple = ()
+    start_time: float = 0.0
+
+    @property
+    def has_video(self):
+        return self.width > 0 and self.height > 0
+
+    @property
+    def fps(self):
+        """Frame rate as a float, or None when unknown."""
+        return float(self.frame_rate) if self.frame_rate else None
+
+
+_MEDIA_INFO_CACHE = OrderedDict()
+_MEDIA_INFO_LOCK = threading.Lock()
+
+
+def _parse_rate(value):
+    """Parses an ffprobe rate such as '30000/1001'; returns None for '0/0' or garbage."""
+    try:
+        rate = Fraction(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    return rate if rate > 0 else None
+
+
+def _media_info_from_probe(path, probe):
+    streams = probe.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), None)
+    width = height = 0
+    frame_rate = None
+    duration = None
+    if video:
+        width = int(video.get("width", 0) or 0)
+        height = int(video.get("height", 0) or 0)
+        frame_rate = _parse_rate(video.get("r_frame_rate")) or _parse_rate(video.get("avg_frame_rate"))
+        duration = video.get("duration")
+    duration = duration or probe.get("format", {}).get("duration")
+    try:
+        duration = float(duration) if duration else 0.0
+    except ValueError:
+        logger.warning(f"Could not parse duration '{duration}' of '{path}'")
+        duration = 0.0
+    try:
+        start_time = float(probe.get("format", {}).get("start_time") or 0.0)
+    except ValueError:
+        start_time = 0.0
+    audio_streams = tuple(
+        AudioStreamInfo(
+            index=int(s.get("index", 0)),
+            codec=s.get("codec_name", ""),
+            channels=int(s.get("channels", 0) or 0),
+            channel_layout=s.get("channel_layout", ""),
+            sample_rate=int(s.get("sample_rate", 0) or 0),
+            language=(s.get("tags") or {}).get("language"),
+        )
+        for s in streams
+        if s.get("codec_type") == "audio"
+    )
+    return MediaInfo(str(path), width, height, frame_rate, duration, audio_streams, start_time)
+
+
+def probe_media(path) -> Optional[MediaInfo]:
+    """
+    Returns the ``MediaInfo`` of ``path``, running ffprobe at most once per file version.
+
+    Results are cached under (absolute path, mtime, size), so a file that is
+    replaced or rewritten is probed again. The cache is an LRU of
+    ``MEDIA_INFO_CACHE_SIZE`` entries shared by all threads; probing happens
+    under the lock so concurrent callers for the same file wait for one probe.
+
+    Args:
+        path (str): Path to a local media file.
+
+    Returns:
+        MediaInfo: Probed metadata, or None if the file is missing or cannot be probed.
+    """
+    try:
+        st = os.stat(path)
+    except OSError as e:
+        logger.error(f"Cannot probe '{path}': {e}")
+        return None
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    with _MEDIA_INFO_LOCK:
+        info = _MEDIA_INFO_CACHE.get(key)
+        if info is not None:
+            _MEDIA_INFO_CACHE.move_to_end(key)
+            return info
+        try:
+            info = _media_info_from_probe(path, ffmpeg.probe(str(path)))
+        except Exception as e:
+            logger.error(f"ffmpeg.probe failed for '{path}': {e}")
+            return None
+        _MEDIA_INFO_CACHE[key] = info
+        while len(_MEDIA_INFO_CACHE) > MEDIA_INFO_CACHE_SIZE:
+            _MEDIA_INFO_CACHE.popitem(last=False)
+    logger.info(
+        f"Probed '{path}': {info.width}x{info.height}, {info.fps or 0:.3f} fps, "
+        f"{info.duration:.2f}s, {len(info.audio_streams)} audio stream(s)"
+    )
+    return info
+
+# --- load_audio: 指定された動画/音声ファイルを ffmpeg のパイプ経由でメモリ上にデコードする関数 ---
+def load_audio(input_path, sample_rate=WHISPER_SAMPLE_RATE):
+    """
+    Decodes the input media file straight into memory for Whisper, without
+    writing an intermediate WAV file. ffmpeg writes 16-bit mono PCM to stdout
+    and the samples are converted to a float32 array in [-1.0, 1.0].
+
+    Args:
+        input_path (str): Path to the input media file.
+        sample_rate (int): Output sample rate (Whisper requires 16kHz).
+
+    Returns:
+        numpy.ndarray: 1-D float32 array of samples if successful, None otherwise.
+    """
+    logger.info(f"Decoding audio of '{input_path}' into memory ({sample_rate}Hz mono)...")
+    command = [
+        "ffmpeg", "-nostdin",
+        "-threads", "0",
+        "-i", input_path,
+        "-vn",                     # Disable video decoding
+        "-f", "s16le",             # Raw PCM 16-bit little-endian
+        "-acodec", "pcm_s16le",
+        "-ac", "1",                # Audio channels: mono
+        "-ar", str(sample_rate),   # Audio sample rate
+        "-loglevel", "error",
+        "pipe:1",                  # Write samples to stdout
+    ]
+    try:
+        result = subprocess.run(command, check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        logger.error(f"ffmpeg decoding failed for '{input_path}'.")
+        logger.error(f"Command: {' '.join(e.cmd)}")
+        logger.error(f"Return code: {e.returncode}")
+        logger.error(f"Stderr:\n{e.stderr.decode(errors='ignore')}")
+        return None
+    except FileNotFoundError:
+        logger.error("ffmpeg command not found. Please ensure ffmpeg is installed and in your system's PATH.")
+        return None
+    except Exception as e:
+        logger.error(f"An unexpected error occurred during audio decoding: {e}")
+        return None
+
+    audio = np.frombuffer(result.stdout, dtype=np.int16).astype(np.float32)
+    audio /= 32768.0
+    logger.info(f"Decoded {audio.shape[0] / sample_rate:.1f}s of audio from '{input_path}'")
+    return audio
+
+
 # --- convert_to_wav: 指定された動画/音声ファイルを wav フォーマット（mono, 16kHz）に変換する関数 ---
-def convert_to_wav(input_path, output_path):
+def convert_to_wav(input_path, output_path, on_progress=None, cancel_event=None, timeout=None):
     """
     Converts the input media file to a WAV file format required by Whisper.
     (16kHz, mono, PCM 16-bit little-endian)
 
+    Runs through ``run_ffmpeg``, so progress is reported while converting and
+    the conversion can be cancelled or time out.
+
     Args:
         input_path (str): Path to the input media file.
         output_path (str): Path where the output WAV file will be saved.
+        on_progress (callable, optional): Receives ``FfmpegProgress`` snapshots.
+        cancel_event (threading.Event, optional): Setting it stops the conversion.
+        timeout (float, optional): Wall-clock limit in seconds.
 
     Returns:
         str: The path to the converted WAV file if successful, None otherwise.
@@ -36,45 +233,42 @@ def convert_to_wav(input_path, output_path):
             output_path,
             "-y"                     # Overwrite output file if it exists
         ]
-        
+
+        media = probe_media(input_path)
         # Execute ffmpeg command
-        result = subprocess.run(command, check=True, capture_output=True, text=True)
-        
+        stderr = run_ffmpeg(
+            command,
+            duration=media.duration if media else None,
+            on_progress=on_progress,
+            cancel_event=cancel_event,
+            timeout=timeout,
+        )
+
         logger.info(f"Successfully converted '{input_path}' to '{output_path}'")
-        logger.debug(f"ffmpeg stdout:\n{result.stdout}")
-        logger.debug(f"ffmpeg stderr:\n{result.stderr}")
+        logger.debug(f"ffmpeg stderr:\n{stderr}")
         return output_path
 
-    except subprocess.CalledProcessError as e:
-        logger.error(f"ffmpeg conversion failed for '{input_path}'.")
-        logger.error(f"Command: {' '.join(e.cmd)}")
+    except FfmpegError as e:
+        logger.error(f"ffmpeg conversion failed for '{input_path}': {e.args[0].splitlines()[0]}")
         logger.error(f"Return code: {e.returncode}")
-        logger.error(f"Stderr:\n{e.stderr}")
-        # Clean up potentially corrupted output file
-        if os.path.exists(output_path):
-            try:
-                os.remove(output_path)
-                logger.info(f"Removed potentially corrupted output file: '{output_path}'")
-            except OSError as remove_err:
-                logger.error(f"Failed to remove corrupted output file '{output_path}': {remove_err}")
-        return None
+        logger.error(f"Stderr (tail):\n{e.stderr}")
     except FileNotFoundError:
         logger.error("ffmpeg command not found. Please ensure ffmpeg is installed and in your system's PATH.")
         return None
     except Exception as e:
         logger.error(f"An unexpected error occurred during WAV conversion: {e}")
-        # Clean up potentially corrupted output file
-        if os.path.exists(output_path):
-             try:
-                os.remove(output_path)
-                logger.info(f"Removed potentially corrupted output file: '{output_path}'")
-             except OSError as remove_err:
-                logger.error(f"Failed to remove corrupted output file '{output_path}': {remove_err}")
-        return None
+    # Clean up potentially corrupted output file
+    if os.path.exists(output_path):
+        try:
+            os.remove(output_path)
+            logger.info(f"Removed potentially corrupted output file: '{output_path}'")
+        except OSError as remove_err:
+            logger.error(f"Failed to remove corrupted output file '{output_path}': {remove_err}")
+    return None
 
 def get_video_resolution(input_path: str) -> tuple[int, int]:
     """
-    Retrieves the width and height of the video file at input_path using ffmpeg.probe.
+    Retrieves the width and height of the video file at input_path (see ``probe_media``).
 
     Args:
         input_path (str): Path to the video file.
@@ -82,17 +276,9 @@ def get_video_resolution(input_path: str) -> tuple[int, int]:
     Returns:
         tuple[int, int]: (width, height) in pixels, or (0, 0) on failure.
     """
-    try:
-        info = ffmpeg.probe(input_path)
-        video_stream = next(
-            (s for s in info["streams"] if s.get("codec_type") == "video"),
-            None,
-        )
-        if video_stream:
-            width = video_stream.get("width", 0)
-            height = video_stream.get("height", 0)
-            return width, height
+    info = probe_media(input_path)
+    if info is None:
+        return 0, 0
+    if not info.has_video:
         logger.error(f"No video stream found in '{input_path}'")
-    except Exception as e:
-        logger.error(f"Failed to probe video resolution for '{input_path}': {e}")
-    return 0, 0
+    return info.width, info.height
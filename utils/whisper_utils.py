@@ -1,61 +1,512 @@
+import os
 import time
 import logging # Import logging
-from faster_whisper import WhisperModel
+import atexit
+import threading
+import dataclasses
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+import numpy as np
+from faster_whisper import BatchedInferencePipeline, WhisperModel, decode_audio
+from faster_whisper.vad import VadOptions, get_speech_timestamps
+from utils.cache_utils import DiskLRUCache, hash_bytes_like, hash_file
+from utils.segments import to_segment, to_segments
 
 # --- Logging Setup ---
 logger = logging.getLogger(__name__)
 
-# --- モデルキャッシュ辞書 ---
-MODEL_CACHE = {}
+# Windows decoded per forward pass in "batched" mode (BatchedInferencePipeline)
+DEFAULT_BATCH_SIZE = 8
+
+# --- 文字起こし結果のディスクキャッシュ（音声ハッシュ + モデル/デコード設定がキー） ---
+TRANSCRIPT_CACHE = DiskLRUCache(
+    os.environ.get("TRANSCRIPT_CACHE_DIR", "./.cache/transcripts"),
+    max_bytes=int(os.environ.get("TRANSCRIPT_CACHE_MAX_MB", "512")) * 1024 * 1024,
+)
+
+# --- Whisper モデルマネージャ（メモリ予算付き LRU キャッシュ） ---
+# Approximate resident size (MB) of float16 weights; int8 roughly halves it.
+# Used when the RSS delta of a load cannot be measured.
+_APPROX_MODEL_SIZE_MB = {
+    "tiny": 75, "base": 145, "small": 485, "medium": 1530,
+    "large": 3090, "large-v1": 3090, "large-v2": 3090, "large-v3": 3090,
+    "large-v3-turbo": 1620, "turbo": 1620,
+}
+
+def _current_rss_bytes():
+    """Resident set size of this process, or None if it cannot be read."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def _estimate_model_bytes(model_size, compute_type):
+    size_mb = _APPROX_MODEL_SIZE_MB.get(model_size, 1530)
+    if "int8" in compute_type:
+        size_mb //= 2
+    return size_mb * 1024 * 1024
+
+@dataclass
+class CachedModel:
+    """A resident WhisperModel and its bookkeeping."""
+    model: WhisperModel
+    load_time: float
+    size_bytes: int
+    last_used: float = field(default_factory=time.time)
+
+class ModelManager:
+    """
+    Bounded LRU cache of WhisperModel instances.
+
+    Models are evicted least-recently-used first once their combined resident
+    size exceeds ``memory_budget_bytes`` (the most recent model is always
+    kept). Concurrent requests for the same model wait for a single load.
+    """
+
+    def __init__(self, memory_budget_bytes):
+        self.memory_budget_bytes = memory_budget_bytes
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def get(self, model_size="medium", device="cpu", compute_type="int8"):
+        cache_key = f"{model_size}_{device}_{compute_type}"
+        with self._lock:
+            entry = self._models.get(cache_key)
+            if entry is not None:
+                self._models.move_to_end(cache_key)
+                entry.last_used = time.time()
+                return entry.model
+            load_lock = self._load_locks.setdefault(cache_key, threading.Lock())
+
+        with load_lock:
+            # Another thread may have finished loading while we waited
+            with self._lock:
+                entry = self._models.get(cache_key)
+                if entry is not None:
+                    self._models.move_to_end(cache_key)
+                    entry.last_used = time.time()
+                    return entry.model
+
+            logger.info(f"Loading Whisper model: {model_size} (device={device}, compute={compute_type})")
+            rss_before = _current_rss_bytes()
+            start_time = time.time()
+            try:
+                model = WhisperModel(model_size, device=device, compute_type=compute_type)
+            except Exception as e:
+                logger.error(f"Failed to load Whisper model '{model_size}': {e}")
+                raise
+            elapsed = time.time() - start_time
+            rss_after = _current_rss_bytes()
+            size_bytes = (rss_after - rss_before) if rss_before and rss_after else 0
+            if size_bytes <= 0 or device != "cpu":
+                size_bytes = _estimate_model_bytes(model_size, compute_type)
+            logger.info(f"Model loaded in {elapsed:.2f} seconds (~{size_bytes / 2**20:.0f} MB resident)")
+
+            with self._lock:
+                self._models[cache_key] = CachedModel(model, elapsed, size_bytes)
+                self._evict()
+            return model
+
+    def _evict(self):
+        total = sum(entry.size_bytes for entry in self._models.values())
+        while total > self.memory_budget_bytes and len(self._models) > 1:
+            cache_key, entry = self._models.popitem(last=False)
+            total -= entry.size_bytes
+            logger.info(f"Evicted Whisper model '{cache_key}' (~{entry.size_bytes / 2**20:.0f} MB) to stay within budget")
+
+    def stats(self):
+        """Returns load time and resident size for every cached model (LRU first)."""
+        with self._lock:
+            return [
+                {
+                    "model": cache_key,
+                    "load_time_sec": round(entry.load_time, 2),
+                    "size_mb": round(entry.size_bytes / 2**20),
+                    "last_used": entry.last_used,
+                }
+                for cache_key, entry in self._models.items()
+            ]
+
+MODEL_MANAGER = ModelManager(
+    memory_budget_bytes=int(os.environ.get("WHISPER_MODEL_MEMORY_BUDGET_MB", "4096")) * 1024 * 1024,
+)
 
 # --- get_cached_model: モデルサイズ・デバイス・精度を指定して WhisperModel をキャッシュ経由で取得する ---
 def get_cached_model(model_size="medium", device="cpu", compute_type="int8"):
     """Loads a WhisperModel from cache or downloads it."""
-    cache_key = f"{model_size}_{device}_{compute_type}"
-    if cache_key not in MODEL_CACHE:
-        logger.info(f"Loading Whisper model: {model_size} (device={device}, compute={compute_type})")
-        start_time = time.time()
+    return MODEL_MANAGER.get(model_size, device, compute_type)
+
+def get_model_stats():
+    """Returns per-model load time and resident size of the cached Whisper models."""
+    return MODEL_MANAGER.stats()
+
+# --- warm_up_model: 短い無音でダミー推論を実行し、初回リクエストの遅延をなくす ---
+def warm_up_model(model):
+    """Runs a one-second silent inference so kernels and buffers are initialised."""
+    start_time = time.time()
+    segments, _ = model.transcribe(np.zeros(16000, dtype=np.float32), beam_size=1, language="en")
+    list(segments)
+    logger.info(f"Model warm-up finished in {time.time() - start_time:.2f} seconds")
+
+# --- preload_models: 指定モデルをバックグラウンドで読み込み＆ウォームアップする ---
+def preload_models(model_sizes=None, device="cpu", compute_type="int8", warmup=True):
+    """
+    Loads (and optionally warms up) models on a background daemon thread.
+
+    ``model_sizes`` defaults to the comma-separated ``WHISPER_PRELOAD_MODELS``
+    environment variable. Returns the started thread, or None if nothing to do.
+    """
+    if model_sizes is None:
+        model_sizes = [m.strip() for m in os.environ.get("WHISPER_PRELOAD_MODELS", "").split(",") if m.strip()]
+    if not model_sizes:
+        return None
+
+    def _run():
+        for model_size in model_sizes:
+            try:
+                model = get_cached_model(model_size, device, compute_type)
+                if warmup:
+                    warm_up_model(model)
+            except Exception as e:
+                logger.error(f"Preloading Whisper model '{model_size}' failed: {e}")
+
+    thread = threading.Thread(target=_run, name="whisper-preload", daemon=True)
+    thread.start()
+    logger.info(f"Preloading Whisper models in background: {', '.join(model_sizes)}")
+    return thread
+
+# --- _describe_audio: ログ出力用に音声入力（パス or 配列）を表す文字列を返す ---
+def _describe_audio(audio):
+    """Returns a short, log-friendly description of a path or in-memory audio array."""
+    if isinstance(audio, np.ndarray):
+        return f"<in-memory audio: {audio.shape[0] / 16000:.1f}s>"
+    return str(audio)
+
+# --- transcription_cache_key: 音声内容とデコード設定からキャッシュキーを生成する ---
+def transcription_cache_key(audio, model_size, compute_type, beam_size, mode="sequential"):
+    """Builds a content-addressed cache key from the audio and decode settings."""
+    if isinstance(audio, np.ndarray):
+        hasher = hash_bytes_like(np.ascontiguousarray(audio))
+    else:
+        hasher = hash_file(audio)
+    hasher.update(f"|{model_size}|{compute_type}|{beam_size}".encode())
+    if mode != "sequential":
+        # Other modes can segment differently, so they get their own entries
+        hasher.update(f"|{mode}".encode())
+    return hasher.hexdigest()
+
+# --- stream_transcribe_with_faster_whisper: segments をジェネレータのまま返すストリーミング版 ---
+def stream_transcribe_with_faster_whisper(audio_file_path, model_size="medium", device="cpu", compute_type="int8", beam_size=5, use_cache=True,
+                                          mode="sequential", batch_size=DEFAULT_BATCH_SIZE):
+    """Starts a faster-whisper transcription and returns ``(segments_iterator, info)``.
+
+    Segments are yielded as compact ``utils.segments.Segment`` objects as soon
+    as Whisper emits them, so callers can
+    translate and write subtitles while decoding is still running. Once the
+    iterator is exhausted, the full result is stored in ``TRANSCRIPT_CACHE``;
+    on a cache hit the cached segments are replayed instead.
+
+    With ``mode="batched"`` the cached model is wrapped in faster-whisper's
+    ``BatchedInferencePipeline``, which decodes ``batch_size`` VAD-split
+    windows at once for higher throughput.
+
+    Errors while loading the model or starting the decode are raised; errors
+    during decoding surface while iterating.
+    """
+    audio_desc = _describe_audio(audio_file_path)
+    cache_key = None
+    if use_cache:
         try:
-            model = WhisperModel(model_size, device=device, compute_type=compute_type)
-            elapsed = time.time() - start_time
-            logger.info(f"Model loaded in {elapsed:.2f} seconds")
-            MODEL_CACHE[cache_key] = model
+            cache_key = transcription_cache_key(audio_file_path, model_size, compute_type, beam_size, mode=mode)
+            cached = TRANSCRIPT_CACHE.get(cache_key)
+            if cached is not None:
+                logger.info(f"Transcription cache hit for {audio_desc} (key={cache_key[:12]})")
+                segments, info = cached
+                return iter(to_segments(segments)), info
         except Exception as e:
-            logger.error(f"Failed to load Whisper model '{model_size}': {e}")
-            # Re-raise the exception or return None to indicate failure
-            raise # Or return None
-    # Return the cached model, or the newly loaded one
-    return MODEL_CACHE.get(cache_key) # Use .get for safety, though it should exist if no exception
+            logger.warning(f"Transcription cache lookup failed for {audio_desc}: {e}")
+            cache_key = None
 
-# --- transcribe_with_faster_whisper: 音声ファイルを transcribe して segments と info を返す ---
-def transcribe_with_faster_whisper(audio_file_path, model_size="medium", device="cpu", compute_type="int8", beam_size=5):
-    """Transcribes an audio file using faster-whisper."""
-    try:
-        model = get_cached_model(model_size=model_size, device=device, compute_type=compute_type)
-        if model is None:
-             logger.error("Transcription failed: Model could not be loaded.")
-             return None, None # Indicate failure
+    model = get_cached_model(model_size=model_size, device=device, compute_type=compute_type)
+    if model is None:
+        raise RuntimeError("Transcription failed: Model could not be loaded.")
 
-        logger.info(f"Starting transcription for {audio_file_path} with beam_size={beam_size}")
-        start_time = time.time()
+    logger.info(f"Starting transcription for {audio_desc} with beam_size={beam_size}, mode={mode}")
+    start_time = time.time()
 
-        logger.info("Attempting to call model.transcribe...") # <<< 追加
+    logger.info("Attempting to call model.transcribe...") # <<< 追加
+    if mode == "batched":
+        # The pipeline only wraps the cached model, so building it per call is cheap
+        pipeline = BatchedInferencePipeline(model=model)
+        segments_generator, info = pipeline.transcribe(audio_file_path, beam_size=beam_size, batch_size=batch_size)
+    else:
         # Add VAD filter? Example: segments, info = model.transcribe(audio, beam_size=5, vad_filter=True)
         segments_generator, info = model.transcribe(audio_file_path, beam_size=beam_size)
-        logger.info("model.transcribe call completed. Info received.") # <<< 追加
-        logger.debug(f"Transcription info: Language={info.language}, Prob={info.language_probability:.2f}, Duration={info.duration}s") # <<< 追加 (Debugレベル)
+    logger.info("model.transcribe call completed. Info received.") # <<< 追加
+    logger.debug(f"Transcription info: Language={info.language}, Prob={info.language_probability:.2f}, Duration={info.duration}s") # <<< 追加 (Debugレベル)
 
-        logger.info("Attempting to convert segments generator to list...") # <<< 追加
-        # Consume the generator to get the list of segments
+    def _iter_segments():
+        segments = []
         # This is where potential errors during transcription might surface
-        segments = list(segments_generator)
-        logger.info("Successfully converted segments generator to list.") # <<< 追加
+        for segment in segments_generator:
+            segment = to_segment(segment)
+            segments.append(segment)
+            yield segment
 
         elapsed = time.time() - start_time
         logger.info(f"Transcription finished in {elapsed:.2f} seconds. Language: {info.language} (Prob: {info.language_probability:.2f})")
+        if cache_key is not None:
+            try:
+                TRANSCRIPT_CACHE.set(cache_key, (segments, info))
+            except Exception as e:
+                logger.warning(f"Failed to store transcription in cache: {e}")
+
+    return _iter_segments(), info
+
+# --- transcribe_with_faster_whisper: 音声ファイルを transcribe して segments と info を返す ---
+def transcribe_with_faster_whisper(audio_file_path, model_size="medium", device="cpu", compute_type="int8", beam_size=5, use_cache=True,
+                                   mode="sequential", batch_size=DEFAULT_BATCH_SIZE, on_segment=None):
+    """Transcribes audio using faster-whisper.
+
+    ``audio_file_path`` may be a path to an audio file or a 16kHz mono float32
+    NumPy array (see ``utils.video_utils.load_audio``), which is passed to
+    ``WhisperModel.transcribe`` as-is so no temporary file is needed.
+
+    With ``use_cache`` enabled, results are looked up in ``TRANSCRIPT_CACHE``
+    first, so resubmitting the same audio with the same settings skips the decode.
+    ``mode`` is ``"sequential"`` or ``"batched"`` (see ``stream_transcribe_with_faster_whisper``).
+    ``on_segment(seconds_done, total_seconds)``, if given, is called after each
+    segment; it must be picklable when this runs in a worker process.
+    """
+    try:
+        segments_iter, info = stream_transcribe_with_faster_whisper(
+            audio_file_path, model_size, device, compute_type, beam_size, use_cache, mode, batch_size
+        )
+        # Consume the generator to get the list of segments
+        segments = []
+        for segment in segments_iter:
+            segments.append(segment)
+            if on_segment is not None:
+                on_segment(segment.end, info.duration or 0)
         return segments, info
-        
+
     except Exception as e:
-        logger.error(f"Error during transcription of {audio_file_path}: {e}")
+        logger.error(f"Error during transcription of {_describe_audio(audio_file_path)}: {e}")
         logger.exception("Detailed traceback for transcription error:") # この行を追加
         return None, None # Indicate failure
+
+
+# --- 共有プロセスプール（バッチ処理・チャンク並列文字起こしで共用） ---
+_TRANSCRIBE_POOL = None
+_TRANSCRIBE_POOL_SIZE = 0
+_TRANSCRIBE_POOL_LOCK = threading.Lock()
+
+
+def _init_transcribe_worker(threads_per_worker):
+    """Limit CTranslate2/OpenMP threads so workers do not oversubscribe cores."""
+    os.environ["OMP_NUM_THREADS"] = str(threads_per_worker)
+
+
+def get_transcribe_pool(workers=None):
+    """Returns a process pool for Whisper decoding, reused across calls.
+
+    Keeping the pool alive means each worker process loads a model once and
+    serves it from its own ``MODEL_MANAGER`` on later calls. The pool never
+    exceeds the number of CPU cores. With ``workers=None`` an existing pool is
+    reused as-is, otherwise a pool of ``WHISPER_POOL_WORKERS`` (default: one
+    worker per four cores) is started.
+    """
+    global _TRANSCRIBE_POOL, _TRANSCRIBE_POOL_SIZE
+    cpu_count = os.cpu_count() or 1
+    with _TRANSCRIBE_POOL_LOCK:
+        if workers is None:
+            if _TRANSCRIBE_POOL is not None:
+                return _TRANSCRIBE_POOL
+            workers = int(os.environ.get("WHISPER_POOL_WORKERS", max(1, cpu_count // 4)))
+        workers = max(1, min(workers, cpu_count))
+        if _TRANSCRIBE_POOL is None or _TRANSCRIBE_POOL_SIZE != workers:
+            if _TRANSCRIBE_POOL is not None:
+                _TRANSCRIBE_POOL.shutdown(wait=False)
+            # "spawn" avoids forking a process that already runs Streamlit threads
+            _TRANSCRIBE_POOL = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_transcribe_worker,
+                initargs=(max(1, cpu_count // workers),),
+            )
+            _TRANSCRIBE_POOL_SIZE = workers
+            logger.info(f"Started transcription process pool with {workers} workers")
+        return _TRANSCRIBE_POOL
+
+
+# Longest a warm-up task waits for the other workers to finish loading the model
+WARMUP_TIMEOUT_SEC = 600
+
+
+def _warm_worker(model_size, device, compute_type, barrier):
+    get_cached_model(model_size=model_size, device=device, compute_type=compute_type)
+    # Hold this worker until every worker has loaded, so each process gets exactly one task
+    try:
+        barrier.wait(WARMUP_TIMEOUT_SEC)
+    except threading.BrokenBarrierError:
+        logger.warning(f"Transcription worker {os.getpid()} timed out waiting for the other workers to warm up")
+    return os.getpid()
+
+
+def warm_transcribe_pool(model_size="medium", device="cpu", compute_type="int8", workers=None):
+    """
+    Loads the model in every worker of the shared process pool (see
+    ``get_transcribe_pool``), so later chunked transcriptions do not pay the
+    model load inside the workers.
+
+    Returns:
+        int: Number of distinct worker processes that loaded the model.
+    """
+    pool = get_transcribe_pool(workers)
+    with multiprocessing.get_context("spawn").Manager() as manager:
+        barrier = manager.Barrier(_TRANSCRIBE_POOL_SIZE)
+        futures = [
+            pool.submit(_warm_worker, model_size, device, compute_type, barrier)
+            for _ in range(_TRANSCRIBE_POOL_SIZE)
+        ]
+        return len({future.result() for future in futures})
+
+
+@atexit.register
+def _shutdown_transcribe_pool():
+    if _TRANSCRIBE_POOL is not None:
+        _TRANSCRIBE_POOL.shutdown(wait=False, cancel_futures=True)
+
+
+# --- VAD で無音区間を境に分割し、チャンクを並列に文字起こしする ---
+SAMPLE_RATE = 16000
+DEFAULT_CHUNK_MINUTES = 10
+
+
+def split_on_silence(audio, chunk_minutes=DEFAULT_CHUNK_MINUTES, vad_options=None):
+    """
+    Splits audio into chunks of roughly ``chunk_minutes`` at voice-activity silences.
+
+    Cuts are placed in the middle of a silent gap between two speech regions,
+    so no speech (and thus no word) ever straddles a chunk edge. A single
+    speech region longer than the target is kept whole.
+
+    Returns:
+        list[tuple[int, int]]: ``(start_sample, end_sample)`` pairs covering the whole audio.
+    """
+    total = len(audio)
+    target = int(chunk_minutes * 60 * SAMPLE_RATE)
+    if total <= target:
+        return [(0, total)]
+
+    speech = get_speech_timestamps(audio, vad_options or VadOptions())
+    chunks = []
+    chunk_start = 0
+    for region, next_region in zip(speech, speech[1:]):
+        if region["end"] - chunk_start >= target:
+            cut = (region["end"] + next_region["start"]) // 2
+            chunks.append((chunk_start, cut))
+            chunk_start = cut
+    chunks.append((chunk_start, total))
+    return chunks
+
+
+def _replace_fields(obj, **changes):
+    """Copies a faster-whisper dataclass such as ``TranscriptionInfo`` (or legacy namedtuple) with some fields changed."""
+    if dataclasses.is_dataclass(obj):
+        return dataclasses.replace(obj, **changes)
+    return obj._replace(**changes)
+
+
+def _detect_language_worker(audio, model_size, device, compute_type):
+    model = get_cached_model(model_size=model_size, device=device, compute_type=compute_type)
+    language, probability, _ = model.detect_language(audio)
+    return language, probability
+
+
+def _transcribe_chunk_worker(audio, model_size, device, compute_type, beam_size, language):
+    model = get_cached_model(model_size=model_size, device=device, compute_type=compute_type)
+    segments, info = model.transcribe(audio, beam_size=beam_size, language=language)
+    # Compact segments keep the result pickled back to the parent small
+    return to_segments(segments), info
+
+
+# --- transcribe_chunked: 長尺音声を分割してワーカープロセスで並列に文字起こしする ---
+def transcribe_chunked(audio, model_size="medium", device="cpu", compute_type="int8", beam_size=5,
+                       chunk_minutes=DEFAULT_CHUNK_MINUTES, use_cache=True):
+    """
+    Transcribes long audio by splitting it at silences and decoding the chunks
+    concurrently on the shared process pool (see ``get_transcribe_pool``).
+
+    The language is detected once up front so every chunk decodes with the
+    same language. Segment and word timestamps are shifted back onto the
+    global timeline. Each worker process holds its
+    own copy of the model.
+
+    Returns:
+        tuple: ``(segments, info)`` like ``transcribe_with_faster_whisper``, or ``(None, None)`` on failure.
+    """
+    audio_desc = _describe_audio(audio)
+    try:
+        if not isinstance(audio, np.ndarray):
+            audio = decode_audio(audio, sampling_rate=SAMPLE_RATE)
+
+        cache_key = None
+        if use_cache:
+            cache_key = transcription_cache_key(audio, model_size, compute_type, beam_size, mode="chunked")
+            cached = TRANSCRIPT_CACHE.get(cache_key)
+            if cached is not None:
+                logger.info(f"Transcription cache hit for {audio_desc} (key={cache_key[:12]}, chunked)")
+                segments, info = cached
+                return to_segments(segments), info
+
+        start_time = time.time()
+        chunks = split_on_silence(audio, chunk_minutes)
+        pool = get_transcribe_pool()
+        logger.info(f"Chunked transcription of {audio_desc}: {len(chunks)} chunks")
+
+        language, language_probability = pool.submit(
+            _detect_language_worker, audio[chunks[0][0]:chunks[0][1]], model_size, device, compute_type
+        ).result()
+
+        futures = [
+            pool.submit(
+                _transcribe_chunk_worker, audio[start:end], model_size, device, compute_type, beam_size, language
+            )
+            for start, end in chunks
+        ]
+
+        segments = []
+        info = None
+        for (start, _), future in zip(chunks, futures):
+            chunk_segments, chunk_info = future.result()
+            info = info or chunk_info
+            offset = start / SAMPLE_RATE
+            # Move chunk-local segments (and their words) onto the global timeline
+            segments.extend(seg.shifted(offset) for seg in to_segments(chunk_segments))
+
+        info = _replace_fields(
+            info,
+            language=language,
+            language_probability=language_probability,
+            duration=len(audio) / SAMPLE_RATE,
+            duration_after_vad=len(audio) / SAMPLE_RATE,
+        )
+        elapsed = time.time() - start_time
+        logger.info(f"Chunked transcription finished in {elapsed:.2f} seconds ({len(chunks)} chunks). Language: {language}")
+
+        if cache_key is not None:
+            try:
+                TRANSCRIPT_CACHE.set(cache_key, (segments, info))
+            except Exception as e:
+                logger.warning(f"Failed to store transcription in cache: {e}")
+        return segments, info
+
+    except Exception as e:
+        logger.error(f"Error during chunked transcription of {audio_desc}: {e}")
+        logger.exception("Detailed traceback for chunked transcription error:")
+        return None, None